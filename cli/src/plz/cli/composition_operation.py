@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Any, List, Optional
+from typing import Any, Iterator, List, Optional, Tuple
 
 from plz.cli.operation import Operation
 
@@ -7,8 +7,8 @@ from plz.cli.operation import Operation
 class CompositionOperation(Operation):
     def _run_composition(self, composition: dict,
                          composition_path: [(str, Any)]):
-        if 'indices_to_compositions' in composition:
-            for index, c in composition['indices_to_compositions'].items():
+        if is_indices_composition(composition):
+            for index, c in indices_to_compositions(composition):
                 self._run_composition(composition=c,
                                       composition_path=composition_path +
                                       [('parallel', index)])
@@ -37,9 +37,38 @@ def get_all_atomic(composition: dict,
                    _start: Optional[List[str]] = None) -> {str}:
     if _start is None:
         _start = set()
-    if 'indices_to_compositions' in composition:
-        for sub_comp in composition['indices_to_compositions'].values():
+    if is_indices_composition(composition):
+        for _, _, sub_comp in index_ranges_to_compositions(composition):
             get_all_atomic(sub_comp, _start)
     else:
         _start.add(composition['execution_id'])
     return _start
+
+
+def is_indices_composition(composition: dict) -> bool:
+    return 'index_ranges_to_compositions' in composition \
+        or 'indices_to_compositions' in composition
+
+
+def index_ranges_to_compositions(composition: dict) \
+        -> Iterator[Tuple[int, int, dict]]:
+    """
+    Ranges of indices (end excluded) in an indices composition, together with
+    the sub-composition running them
+    """
+    if 'index_ranges_to_compositions' in composition:
+        for start, end, sub_comp in \
+                composition['index_ranges_to_compositions']:
+            yield start, end, sub_comp
+    else:
+        # Controllers before index ranges were introduced send an entry per
+        # index
+        for index, sub_comp in composition['indices_to_compositions'].items():
+            yield int(index), int(index) + 1, sub_comp
+
+
+def indices_to_compositions(composition: dict) -> Iterator[Tuple[str, dict]]:
+    # Indices are strings, as they used to be keys of a json object
+    for start, end, sub_comp in index_ranges_to_compositions(composition):
+        for index in range(start, end):
+            yield str(index), sub_comp
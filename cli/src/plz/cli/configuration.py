@@ -125,6 +125,9 @@ class Configuration:
             Property('quiet_build', type=bool, default=False),
             Property('user', required=True),
             Property('instance_type', default='t2.micro'),
+            # Acceptable instance types in order of preference, overriding
+            # `instance_type`. Entries like `p3.*` accept a whole family
+            Property('instance_types', type=list, default=None),
             Property('project', required=True),
             Property('image', type=str),
             Property('image_extensions', type=list, default=[]),
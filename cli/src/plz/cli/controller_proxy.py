@@ -76,6 +76,14 @@ class ControllerProxy(Controller):
         _check_status(response, requests.codes.accepted)
         return (json.loads(line) for line in response.iter_lines())
 
+    def get_dispatch_statuses(self, execution_id: str) -> Iterator[dict]:
+        response = self.server.get('executions',
+                                   execution_id,
+                                   'dispatch',
+                                   stream=True)
+        _check_status(response, requests.codes.ok)
+        return (json.loads(line) for line in response.iter_lines())
+
     def list_executions(self, user: str, list_for_all_users: bool) -> [dict]:
         response = self.server.get('executions',
                                    'list',
@@ -170,6 +178,34 @@ class ControllerProxy(Controller):
         _check_status(response, requests.codes.ok)
         return (frag.decode('utf-8') for frag in response.raw)
 
+    def get_missing_build_context_files(self, digests: List[str]) \
+            -> Optional[List[str]]:
+        response = self.server.post('snapshots',
+                                    'files',
+                                    'missing',
+                                    json={'digests': digests})
+        if response.status_code == requests.codes.not_found:
+            # Controllers that don't keep the files of build contexts
+            return None
+        _check_status(response, requests.codes.ok)
+        return response.json()['missing']
+
+    def put_build_context_files(self, files_tarball: BinaryIO) -> None:
+        response = self.server.post('snapshots',
+                                    'files',
+                                    data=files_tarball,
+                                    stream=True)
+        _check_status(response, requests.codes.ok)
+
+    def get_snapshot_id(self, user: str, project: str,
+                        context_digest: str) -> Optional[str]:
+        response = self.server.get('snapshots', user, project, context_digest)
+        if response.status_code == requests.codes.not_found:
+            # Controllers that don't name snapshots by their contents
+            return None
+        _check_status(response, requests.codes.ok)
+        return response.json()['id']
+
     def put_input(self, input_id: str, input_metadata: InputMetadata,
                   input_data_stream: BinaryIO) -> None:
         response = self.server.put(
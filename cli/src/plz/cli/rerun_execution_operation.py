@@ -63,6 +63,6 @@ class RerunExecutionOperation(Operation):
 
         new_execution_id, was_start_ok = \
             RunExecutionOperation.get_execution_id_from_start_response(
-                response_dicts)
+                self.controller, response_dicts)
         run_operation.execution_id = new_execution_id
         run_operation.follow_execution(was_start_ok)
@@ -16,7 +16,9 @@ from plz.cli.retrieve_measures_operation import RetrieveMeasuresOperation
 from plz.cli.retrieve_output_operation import RetrieveOutputOperation
 from plz.cli.show_status_operation import ShowStatusOperation
 from plz.cli.snapshot import DOCKERFILE_NAME, PullAccessDeniedException, \
-    capture_build_context, submit_context_for_building
+    capture_build_context, compute_context_manifest, digest_of_manifest, \
+    dockerfile_in_context, submit_context_for_building, upload_missing_files
+from plz.controller.api import Controller
 
 
 class RunExecutionOperation(Operation):
@@ -71,19 +73,53 @@ class RunExecutionOperation(Operation):
                 context_path=context_path,
                 excluded_paths=self.configuration.excluded_paths,
                 included_paths=self.configuration.included_paths,
-                exclude_gitignored_files=exclude_gitignored_files,
-            )
+                exclude_gitignored_files=exclude_gitignored_files)
+
+        build_context = None
+        with dockerfile_in_context(self.configuration.image,
+                                   self.configuration.image_extensions,
+                                   self.configuration.command, context_path):
+            manifest = self.suboperation(
+                f'Capturing the files in {os.path.abspath(context_path)}',
+                lambda: compute_context_manifest(
+                    context_path=context_path,
+                    excluded_paths=self.configuration.excluded_paths,
+                    included_paths=self.configuration.included_paths,
+                    exclude_gitignored_files=exclude_gitignored_files))
+            context_digest = digest_of_manifest(manifest)
+            # Snapshots of the same code are built only once
+            snapshot_id = self.controller.get_snapshot_id(
+                self.configuration.user, self.configuration.project,
+                context_digest)
+            if snapshot_id is not None:
+                log_info('Found a snapshot of the same files, no need to '
+                         'build it')
+            else:
+                # Only the files that the controller doesn't have yet
+                bytes_uploaded = self.suboperation(
+                    'Uploading the files', lambda: upload_missing_files(
+                        self.controller, context_path, manifest))
+                if bytes_uploaded is None:
+                    # The controller doesn't keep the files, so it gets the
+                    # whole build context
+                    build_context = self.suboperation(
+                        'Capturing the build context',
+                        build_context_suboperation)
+                    context_digest, manifest = None, None
+                else:
+                    log_debug(f'{bytes_uploaded} bytes uploaded')
 
         retries = self.configuration.workarounds['docker_build_retries']
-        while retries + 1 > 0:
-            with self.suboperation(
-                    f'Capturing the files in {os.path.abspath(context_path)}',
-                    build_context_suboperation) as build_context:
-
+        try:
+            while snapshot_id is None and retries + 1 > 0:
+                if build_context is not None:
+                    build_context.seek(0)
                 try:
                     snapshot_id = self.suboperation(
                         'Building the program snapshot',
-                        self._submit_context_callable(build_context))
+                        self._submit_context_callable(context_digest,
+                                                      manifest,
+                                                      build_context))
                     break
                 except CLIException as e:
                     if type(e.__cause__) == PullAccessDeniedException \
@@ -95,6 +131,9 @@ class RunExecutionOperation(Operation):
                         time.sleep(7)
                     else:
                         raise e
+        finally:
+            if build_context is not None:
+                build_context.close()
 
         input_id = self.suboperation('Capturing the input',
                                      self.capture_input,
@@ -105,7 +144,8 @@ class RunExecutionOperation(Operation):
         self.execution_id = execution_id
         self.follow_execution(was_start_ok)
 
-    def _submit_context_callable(self, build_context):
+    def _submit_context_callable(self, context_digest, manifest,
+                                 build_context):
         # Making it an internal function in self.run doesn't work. Making
         # _submit_context_callable = lambda: ...
         # in self.run _does_ work. Bug in python?
@@ -114,7 +154,9 @@ class RunExecutionOperation(Operation):
             project=self.configuration.project,
             controller=self.controller,
             build_context=build_context,
-            quiet_build=self.configuration.quiet_build)
+            quiet_build=self.configuration.quiet_build,
+            context_digest=context_digest,
+            manifest=manifest)
 
     def _check_dockerfile_specs(self):
         user_provided_dockerfile = os.path.isfile(
@@ -230,23 +272,31 @@ class RunExecutionOperation(Operation):
             parallel_indices_range=configuration.parallel_indices_range,
             indices_per_execution=configuration.indices_per_execution)
         return RunExecutionOperation.get_execution_id_from_start_response(
-            response_dicts)
+            self.controller, response_dicts)
 
     @staticmethod
-    def get_execution_id_from_start_response(response_dicts: Iterator[dict]
+    def get_execution_id_from_start_response(controller: Controller,
+                                             response_dicts: Iterator[dict]
                                              ) -> Tuple[str, bool]:
+        """
+        Gets the ID of a submitted execution, and follows the execution
+        until it gets instances
+
+        :return: the execution ID, and whether it got instances
+        """
         execution_id: Optional[str] = None
         ok = True
         for data in response_dicts:
             if 'id' in data:
                 execution_id = data['id']
-            elif 'status' in data:
-                print('Instance status:', data['status'].rstrip())
-            elif 'error' in data:
-                ok = False
-                log_error(data['error'].rstrip())
+            else:
+                ok = _print_start_status(data) and ok
         if not execution_id:
             raise CLIException('We did not receive an execution ID.')
+        if ok:
+            # Submitting just queues the execution
+            for data in controller.get_dispatch_statuses(execution_id):
+                ok = _print_start_status(data) and ok
         return execution_id, ok
 
     @staticmethod
@@ -255,6 +305,8 @@ class RunExecutionOperation(Operation):
         return {
             'instance_type':
                 configuration.instance_type,
+            'instance_types':
+                configuration.instance_types,
             'user':
                 configuration.user,
             'project':
@@ -304,3 +356,13 @@ def create_instance_market_spec(configuration: Configuration) -> dict:
         for k in ('instance_market_type', 'instance_max_idle_time_in_minutes',
                   'max_bid_price_in_dollars_per_hour')
     }
+
+
+def _print_start_status(data: dict) -> bool:
+    """:return: False if it's an error"""
+    if 'status' in data:
+        print('Instance status:', data['status'].rstrip())
+    elif 'error' in data:
+        log_error(data['error'].rstrip())
+        return False
+    return True
@@ -1,6 +1,12 @@
+import hashlib
+import io
 import json
 import os
-from typing import BinaryIO
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from stat import S_IMODE, S_ISDIR, S_ISLNK
+from typing import BinaryIO, List, Optional
 
 import docker.utils
 import glob2
@@ -12,11 +18,110 @@ from plz.controller.api import Controller
 
 DOCKERFILE_NAME = 'plz.Dockerfile'
 
+_READ_BUFFER_SIZE = 1024 * 1024
+
 
 def capture_build_context(image: str, image_extensions: [str], command: [str],
                           context_path: [str], excluded_paths: [str],
                           included_paths: [str],
                           exclude_gitignored_files) -> BinaryIO:
+    with dockerfile_in_context(image, image_extensions, command, context_path):
+        included_files = _get_context_files(context_path, excluded_paths,
+                                            included_paths,
+                                            exclude_gitignored_files)
+        return docker.utils.build.create_archive(
+            root=os.path.abspath(context_path),
+            files=included_files,
+            gzip=True)
+
+
+def compute_context_manifest(context_path: [str], excluded_paths: [str],
+                             included_paths: [str],
+                             exclude_gitignored_files) -> [dict]:
+    """
+    Entries for the files that `capture_build_context` would capture, with
+    the digests of their contents instead of the contents.
+
+    The Dockerfile must be in the context already
+    """
+    included_files = _get_context_files(context_path, excluded_paths,
+                                        included_paths,
+                                        exclude_gitignored_files)
+    manifest = []
+    for path in sorted(included_files):
+        full_path = os.path.join(context_path, path)
+        stat = os.lstat(full_path)
+        entry = {
+            'path': path.replace(os.sep, '/'),
+            'mode': S_IMODE(stat.st_mode),
+            'mtime': int(stat.st_mtime)
+        }
+        if S_ISLNK(stat.st_mode):
+            entry['type'] = 'link'
+            entry['target'] = os.readlink(full_path)
+        elif S_ISDIR(stat.st_mode):
+            entry['type'] = 'dir'
+        else:
+            entry['type'] = 'file'
+            entry['size'] = stat.st_size
+            entry['digest'] = _digest_of_file(full_path)
+        manifest.append(entry)
+    return manifest
+
+
+def digest_of_manifest(manifest: [dict]) -> str:
+    """
+    Digest of the build context with the manifest.
+
+    It depends only on the paths, permissions and contents of the files
+    (and so on the Dockerfile), so that the same code has the same digest
+    everywhere
+    """
+    digest = hashlib.sha256()
+    for entry in sorted(manifest, key=lambda e: e['path']):
+        fields = [entry['type'], oct(entry['mode']), entry['path']]
+        if entry['type'] == 'link':
+            fields.append(entry['target'])
+        elif entry['type'] == 'file':
+            fields.append(entry['digest'])
+        digest.update((' '.join(fields) + '\0').encode())
+    return digest.hexdigest()
+
+
+def upload_missing_files(controller: Controller, context_path: str,
+                         manifest: [dict]) -> Optional[int]:
+    """
+    Uploads the files in the manifest that the controller doesn't have.
+
+    :return: the number of bytes uploaded, or None if the controller doesn't
+        keep the files of build contexts
+    """
+    paths_by_digest = {
+        e['digest']: e['path']
+        for e in manifest if e['type'] == 'file'
+    }
+    missing = controller.get_missing_build_context_files(
+        sorted(paths_by_digest.keys()))
+    if missing is None:
+        return None
+    if len(missing) == 0:
+        return 0
+    with tempfile.TemporaryFile() as files_tarball:
+        with tarfile.open(fileobj=files_tarball, mode='w:gz') as tar:
+            for digest in missing:
+                tar.add(os.path.join(context_path, paths_by_digest[digest]),
+                        arcname=digest,
+                        recursive=False)
+        size = files_tarball.tell()
+        files_tarball.seek(0)
+        controller.put_build_context_files(files_tarball)
+    return size
+
+
+@contextmanager
+def dockerfile_in_context(image: str, image_extensions: [str], command: [str],
+                          context_path: str):
+    """Creates the Dockerfile for the duration, unless there's one"""
     dockerfile_path = os.path.join(context_path, DOCKERFILE_NAME)
     dockerfile_created = False
     try:
@@ -31,19 +136,29 @@ def capture_build_context(image: str, image_extensions: [str], command: [str],
                                  f'COPY . ./\n'
                                  f'CMD {json.dumps(command)}\n')
             os.chmod(dockerfile_path, 0o644)
-        included_files, _ = get_included_and_excluded_files(
-            context_path=context_path,
-            excluded_paths=excluded_paths,
-            included_paths=included_paths + [DOCKERFILE_NAME],
-            exclude_gitignored_files=exclude_gitignored_files)
-        build_context = docker.utils.build.create_archive(
-            root=os.path.abspath(context_path),
-            files=included_files,
-            gzip=True)
+        yield
     finally:
         if dockerfile_created:
             os.remove(dockerfile_path)
-    return build_context
+
+
+def _digest_of_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_READ_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_context_files(context_path: [str], excluded_paths: [str],
+                       included_paths: [str],
+                       exclude_gitignored_files) -> {str}:
+    included_files, _ = get_included_and_excluded_files(
+        context_path=context_path,
+        excluded_paths=excluded_paths,
+        included_paths=included_paths + [DOCKERFILE_NAME],
+        exclude_gitignored_files=exclude_gitignored_files)
+    return included_files
 
 
 def get_included_and_excluded_files(context_path: [str], excluded_paths: [str],
@@ -94,14 +209,26 @@ def get_included_and_excluded_files(context_path: [str], excluded_paths: [str],
     return included_files, excluded_files
 
 
-def submit_context_for_building(user: str, project: str,
+def submit_context_for_building(user: str,
+                                project: str,
                                 controller: Controller,
-                                build_context: BinaryIO,
-                                quiet_build: bool) -> str:
+                                build_context: Optional[BinaryIO],
+                                quiet_build: bool,
+                                context_digest: Optional[str] = None,
+                                manifest: Optional[List[dict]] = None) -> str:
+    """
+    Builds the snapshot from the build context or, if there's none, from
+    the files in the manifest, uploaded already
+    """
     metadata = {
         'user': user,
         'project': project,
     }
+    if context_digest is not None:
+        metadata['context_digest'] = context_digest
+    if build_context is None:
+        metadata['manifest'] = manifest
+        build_context = io.BytesIO()
     status_json_strings = controller.create_snapshot(metadata, build_context)
     errors = []
     snapshot_id: str = None
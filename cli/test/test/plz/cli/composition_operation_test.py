@@ -0,0 +1,57 @@
+import unittest
+
+from plz.cli.composition_operation import get_all_atomic, \
+    indices_to_compositions
+
+
+class CompositionOperationTest(unittest.TestCase):
+    def test_expands_index_ranges(self):
+        composition = {
+            'execution_id': 'parent',
+            'index_ranges_to_compositions': [[1, 3, {
+                'execution_id': 'first'
+            }], [3, 4, {
+                'execution_id': 'second'
+            }]],
+            'tombstone_executions': []
+        }
+        self.assertEqual(
+            dict(indices_to_compositions(composition)), {
+                '1': {
+                    'execution_id': 'first'
+                },
+                '2': {
+                    'execution_id': 'first'
+                },
+                '3': {
+                    'execution_id': 'second'
+                }
+            })
+        self.assertEqual(get_all_atomic(composition), {'first', 'second'})
+
+    def test_reads_compositions_with_an_entry_per_index(self):
+        composition = {
+            'execution_id': 'parent',
+            'indices_to_compositions': {
+                '0': {
+                    'execution_id': 'first'
+                },
+                '1': {
+                    'execution_id': 'first'
+                }
+            },
+            'tombstone_executions': []
+        }
+        self.assertEqual(dict(indices_to_compositions(composition)), {
+            '0': {
+                'execution_id': 'first'
+            },
+            '1': {
+                'execution_id': 'first'
+            }
+        })
+        self.assertEqual(get_all_atomic(composition), {'first'})
+
+    def test_atomic_composition(self):
+        self.assertEqual(get_all_atomic({'execution_id': 'atomic'}),
+                         {'atomic'})
@@ -0,0 +1,42 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from plz.cli.controller_proxy import ControllerProxy
+from plz.cli.exceptions import RequestException
+
+
+def _response(status_code: int, json: dict = None) -> mock.Mock:
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = json
+    return response
+
+
+class ControllerProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = mock.Mock()
+        self.controller = ControllerProxy(self.server)
+
+    def test_gets_the_snapshot_id(self):
+        self.server.get.return_value = _response(requests.codes.ok,
+                                                 {'id': 'snapshot'})
+        self.assertEqual(
+            self.controller.get_snapshot_id('user', 'project', 'digest'),
+            'snapshot')
+
+    def test_no_snapshot_id_from_controllers_without_digests(self):
+        self.server.get.return_value = _response(requests.codes.not_found)
+        self.assertIsNone(
+            self.controller.get_snapshot_id('user', 'project', 'digest'))
+
+    def test_other_errors_getting_the_snapshot_id_are_raised(self):
+        self.server.get.return_value = _response(
+            requests.codes.internal_server_error)
+        with self.assertRaises(RequestException):
+            self.controller.get_snapshot_id('user', 'project', 'digest')
+
+    def test_no_missing_files_from_controllers_without_them(self):
+        self.server.post.return_value = _response(requests.codes.not_found)
+        self.assertIsNone(
+            self.controller.get_missing_build_context_files(['digest']))
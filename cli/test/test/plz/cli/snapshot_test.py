@@ -0,0 +1,108 @@
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from plz.cli.snapshot import compute_context_manifest, digest_of_manifest, \
+    dockerfile_in_context, upload_missing_files
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.context_path = self.temporary_directory.name
+        self._write('main.py', 'print("hello")\n')
+        self._write(os.path.join('lib', 'util.py'), 'x = 1\n')
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_same_contents_have_the_same_digest(self):
+        digest = self._digest()
+        # Touching a file doesn't change what's built
+        os.utime(os.path.join(self.context_path, 'main.py'),
+                 (time.time() + 60, time.time() + 60))
+        self.assertEqual(self._digest(), digest)
+
+    def test_changed_contents_change_the_digest(self):
+        digest = self._digest()
+        self._write('main.py', 'print("bye")\n')
+        self.assertNotEqual(self._digest(), digest)
+
+    def test_new_files_change_the_digest(self):
+        digest = self._digest()
+        self._write('data.txt', '')
+        self.assertNotEqual(self._digest(), digest)
+
+    def test_excluded_files_dont_change_the_digest(self):
+        digest = self._digest()
+        self._write('notes.txt', 'ignore me')
+        self.assertEqual(self._digest(excluded_paths=['notes.txt']), digest)
+
+    def test_the_dockerfile_changes_the_digest(self):
+        self.assertNotEqual(self._digest(), self._digest(image='python:3.7'))
+
+    def test_the_dockerfile_is_removed(self):
+        self._digest()
+        self.assertEqual(sorted(os.listdir(self.context_path)),
+                         ['lib', 'main.py'])
+
+    def test_uploads_only_missing_files(self):
+        manifest = compute_context_manifest(self.context_path,
+                                            excluded_paths=[],
+                                            included_paths=[],
+                                            exclude_gitignored_files=False)
+        digests = {e['path']: e['digest'] for e in manifest if 'digest' in e}
+        controller = mock.Mock()
+        controller.get_missing_build_context_files.return_value = [
+            digests['main.py']
+        ]
+        uploaded_names = []
+        controller.put_build_context_files.side_effect = \
+            lambda files_tarball: uploaded_names.extend(
+                tarfile.open(fileobj=files_tarball).getnames())
+
+        upload_missing_files(controller, self.context_path, manifest)
+
+        self.assertEqual(
+            sorted(controller.get_missing_build_context_files.call_args[0][0]),
+            sorted(digests.values()))
+        self.assertEqual(uploaded_names, [digests['main.py']])
+
+    def test_uploads_nothing_to_controllers_without_the_files(self):
+        manifest = compute_context_manifest(self.context_path,
+                                            excluded_paths=[],
+                                            included_paths=[],
+                                            exclude_gitignored_files=False)
+        controller = mock.Mock()
+        controller.get_missing_build_context_files.return_value = None
+
+        self.assertIsNone(
+            upload_missing_files(controller, self.context_path, manifest))
+        controller.put_build_context_files.assert_not_called()
+
+    def test_digest_of_manifest_ignores_timestamps(self):
+        manifest = compute_context_manifest(self.context_path,
+                                            excluded_paths=[],
+                                            included_paths=[],
+                                            exclude_gitignored_files=False)
+        touched = [{**e, 'mtime': e['mtime'] + 60} for e in manifest]
+        self.assertEqual(digest_of_manifest(touched),
+                         digest_of_manifest(manifest))
+
+    def _write(self, path: str, contents: str):
+        full_path = os.path.join(self.context_path, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(contents)
+
+    def _digest(self, image: str = 'python:3.6', excluded_paths=()) -> str:
+        with dockerfile_in_context(image, [], ['python', 'main.py'],
+                                   self.context_path):
+            return digest_of_manifest(
+                compute_context_manifest(self.context_path,
+                                         excluded_paths=list(excluded_paths),
+                                         included_paths=[],
+                                         exclude_gitignored_files=False))
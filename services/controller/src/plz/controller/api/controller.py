@@ -34,6 +34,12 @@ class Controller(ABC):
                         instance_market_spec: dict) -> Iterator[dict]:
         pass
 
+    @abstractmethod
+    def get_dispatch_statuses(self, execution_id: str) -> Iterator[dict]:
+        """Statuses of getting instances for a queued execution, until it
+           has them or it failed"""
+        pass
+
     @abstractmethod
     def list_executions(self, user: str, list_for_all_users: bool) -> [dict]:
         pass
@@ -72,6 +78,35 @@ class Controller(ABC):
     @abstractmethod
     def create_snapshot(self, image_metadata: dict, context: BinaryIO) \
             -> Iterator[JSONString]:
+        """
+        Builds a snapshot from the context, a tarball. When the metadata has a
+        `manifest` of the files instead, the context is put together from
+        the build context files in the controller
+        """
+        pass
+
+    @abstractmethod
+    def get_missing_build_context_files(self, digests: List[str]) \
+            -> Optional[List[str]]:
+        """
+        :return: the digests of the files that need to be uploaded, or None
+            if the controller doesn't keep them (and the whole build context
+            needs to be uploaded)
+        """
+        pass
+
+    @abstractmethod
+    def put_build_context_files(self, files_tarball: BinaryIO) -> None:
+        """:param files_tarball: tarball with files named by their digest"""
+        pass
+
+    @abstractmethod
+    def get_snapshot_id(self, user: str, project: str,
+                        context_digest: str) -> Optional[str]:
+        """
+        :return: the ID of the snapshot built from a context with the digest,
+            None if there's none
+        """
         pass
 
     @abstractmethod
@@ -21,6 +21,12 @@ class AbortedExecutionException(ResponseHandledException):
         self.tombstone = tombstone
 
 
+class BadBuildContextException(ResponseHandledException):
+    def __init__(self, message: str, **kwargs):
+        super().__init__(response_code=requests.codes.bad_request, **kwargs)
+        self.message = message
+
+
 class BadInputMetadataException(ResponseHandledException):
     def __init__(self, input_metadata: dict, **kwargs):
         super().__init__(response_code=requests.codes.bad_request, **kwargs)
@@ -81,6 +87,7 @@ EXCEPTION_NAMES_TO_CLASSES = {
     e.__name__: e
     for e in (
         AbortedExecutionException,
+        BadBuildContextException,
         BadInputMetadataException,
         ExecutionAlreadyHarvestedException,
         ExecutionNotFoundException,
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import re
+import tarfile
+import tempfile
+import time
+from typing import BinaryIO, List, Optional
+
+from plz.controller.api.exceptions import BadBuildContextException
+
+READ_BUFFER_SIZE = 16384
+# Files mentioned by a manifest are about to be used in a build. Don't evict
+# files used recently, so that they're not gone when the build needs them
+_EVICTION_GRACE_SECONDS = 60 * 60
+
+log = logging.getLogger(__name__)
+
+
+class BuildContextFiles:
+    """
+    Files of build contexts, by the SHA-256 of their contents.
+
+    Clients send a manifest of the files in their context, upload only the
+    files that aren't here already, and the context is put together here
+    """
+
+    def __init__(self, files_dir: str, temp_data_dir: str,
+                 max_size_in_bytes: int):
+        self.files_dir = files_dir
+        self.temp_data_dir = temp_data_dir
+        self.max_size_in_bytes = max_size_in_bytes
+
+    def get_missing(self, digests: List[str]) -> List[str]:
+        missing = []
+        for digest in digests:
+            path = self._file_path(digest)
+            try:
+                # Mark as used, so that it's not evicted before the build
+                os.utime(path)
+            except FileNotFoundError:
+                missing.append(digest)
+        return missing
+
+    def put(self, files_tarball: BinaryIO) -> None:
+        """Stores the files in the tarball, named by their digests"""
+        with tarfile.open(fileobj=files_tarball, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                self._put_file(member.name, tar.extractfile(member))
+        self._evict()
+
+    def assemble(self, manifest: List[dict]) -> BinaryIO:
+        """
+        :return: a tarball with the files in the manifest, to be passed to
+            `docker build`
+        """
+        missing = self.get_missing(
+            list({e['digest']
+                  for e in manifest if e['type'] == 'file'}))
+        if len(missing) > 0:
+            raise BadBuildContextException(
+                f'Missing build context files: {missing}')
+        context = tempfile.TemporaryFile(dir=self.temp_data_dir)
+        try:
+            with tarfile.open(fileobj=context, mode='w') as tar:
+                for entry in sorted(manifest, key=lambda e: e['path']):
+                    self._add_to(tar, entry)
+            context.seek(0)
+            return context
+        except Exception:
+            context.close()
+            raise
+
+    def read_file(self, manifest: List[dict], path: str) -> Optional[bytes]:
+        """:return: the contents of the file in the manifest, if it's there"""
+        for entry in manifest:
+            if entry['path'] == path and entry['type'] == 'file':
+                try:
+                    with open(self._file_path(entry['digest']), 'rb') as f:
+                        return f.read()
+                except FileNotFoundError:
+                    return None
+        return None
+
+    def _add_to(self, tar: tarfile.TarFile, entry: dict) -> None:
+        info = tarfile.TarInfo(_checked_path(entry['path']))
+        info.mode = entry['mode']
+        info.mtime = entry.get('mtime', 0)
+        if entry['type'] == 'dir':
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        elif entry['type'] == 'link':
+            info.type = tarfile.SYMTYPE
+            info.linkname = entry['target']
+            tar.addfile(info)
+        elif entry['type'] == 'file':
+            path = self._file_path(entry['digest'])
+            info.size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                tar.addfile(info, f)
+        else:
+            raise BadBuildContextException(
+                f'Unknown type of build context entry: {entry["type"]}')
+
+    def _put_file(self, digest: str, stream: BinaryIO) -> None:
+        file_path = self._file_path(digest)
+        if os.path.exists(file_path):
+            return
+        file_hash = hashlib.sha256()
+        fd, temp_file_path = tempfile.mkstemp(dir=self.temp_data_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = stream.read(READ_BUFFER_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    file_hash.update(data)
+            if file_hash.hexdigest() != digest:
+                raise BadBuildContextException(
+                    f'Contents of build context file {digest} don\'t match '
+                    'its digest')
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.rename(temp_file_path, file_path)
+        except Exception:
+            os.remove(temp_file_path)
+            raise
+
+    def _evict(self) -> None:
+        """Removes the least recently used files while over the size"""
+        files = []
+        total_size = 0
+        for subdir in os.scandir(self.files_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        if total_size <= self.max_size_in_bytes:
+            return
+        now = time.time()
+        for mtime, size, path in sorted(files):
+            if total_size <= self.max_size_in_bytes \
+                    or now - mtime < _EVICTION_GRACE_SECONDS:
+                break
+            log.debug(f'Evicting build context file {path}')
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def _file_path(self, digest: str) -> str:
+        if not re.match(r'^[0-9a-f]{64}$', digest):
+            raise BadBuildContextException(
+                f'Invalid build context file digest: {digest}')
+        return os.path.join(self.files_dir, digest[:2], digest)
+
+
+def _checked_path(path: str) -> str:
+    # Paths come from the client, keep them inside the context
+    if os.path.isabs(path) or '..' in path.split('/'):
+        raise BadBuildContextException(
+            f'Invalid path in build context: {path}')
+    return path
@@ -0,0 +1,236 @@
+import collections
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from redis import StrictRedis
+
+log = logging.getLogger(__name__)
+
+# Waiters refresh their entry each time they check for their turn. Entries
+# that aren't refreshed for this long belong to a controller process that is
+# gone
+_WAITER_STALE_AFTER_SECONDS = 5 * 60
+# Builds running for longer than this are taken as leaked, as when the
+# controller process died while building
+_RUNNING_BUILD_STALE_AFTER_SECONDS = 2 * 60 * 60
+_LOCK_TIMEOUT_SECONDS = 30
+
+
+class BuildScheduler:
+    """
+    Limits the number of snapshots built at the same time.
+
+    Builds wait in a queue until there's room for them. With `fifo`
+    queueing, builds start in order of arrival. With `fair` queueing, users
+    take turns, so that a user building many snapshots doesn't hold back the
+    rest.
+
+    The state is in Redis, so that it's shared by all controller processes
+    """
+    FIFO = 'fifo'
+    FAIR = 'fair'
+    QUEUEINGS = (FIFO, FAIR)
+
+    def __init__(self,
+                 redis: StrictRedis,
+                 max_concurrent_builds: int,
+                 queueing: str = FIFO,
+                 poll_interval_in_seconds: float = 2):
+        if queueing not in BuildScheduler.QUEUEINGS:
+            raise ValueError(f'Invalid build queueing: {queueing}')
+        self.redis = redis
+        self.max_concurrent_builds = max_concurrent_builds
+        self.queueing = queueing
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self._finishes = threading.Condition()
+
+    def wait_for_turn(self, build_id: str, user: str) -> Iterator[int]:
+        """
+        Waits until the build can start, taking its place among the running
+        builds.
+
+        Yields the position of the build in the queue when it changes
+        """
+        self.redis.zadd(_queue_key(), {build_id: time.time()}, nx=True)
+        started = False
+        try:
+            last_position = None
+            while True:
+                position = self._try_to_start(build_id, user)
+                if position is None:
+                    started = True
+                    return
+                if position != last_position:
+                    yield position
+                    last_position = position
+                with self._finishes:
+                    self._finishes.wait(timeout=self.poll_interval_in_seconds)
+        finally:
+            if not started:
+                self._leave_queue(build_id)
+
+    def finish(self, build_id: str) -> None:
+        self.redis.hdel(_running_key(), build_id)
+        with self._finishes:
+            self._finishes.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            'max_concurrent_builds': self.max_concurrent_builds,
+            'queueing': self.queueing,
+            'running': self.redis.hlen(_running_key()),
+            'queued': self.redis.zcard(_queue_key()),
+            'stages': BuildTimings.get_stats(self.redis)
+        }
+
+    def _try_to_start(self, build_id: str, user: str) -> Optional[int]:
+        """
+        :return: None if the build started, or its position in the queue
+            otherwise, starting at 1
+        """
+        with self.redis.lock(f'lock:{__name__}#builds',
+                             timeout=_LOCK_TIMEOUT_SECONDS):
+            now = time.time()
+            self.redis.hset(_waiters_key(), build_id,
+                            json.dumps({
+                                'user': user,
+                                'last_seen': now
+                            }))
+            if self.redis.zscore(_queue_key(), build_id) is None:
+                # Dropped as stale, but it's still here
+                self.redis.zadd(_queue_key(), {build_id: now})
+            waiters = self._get_waiters(now)
+            running = self._get_running(now)
+            position = self._order(waiters, running).index(build_id)
+            room = self.max_concurrent_builds - len(running)
+            if position >= room:
+                return position - max(room, 0) + 1
+            pipeline = self.redis.pipeline()
+            pipeline.zrem(_queue_key(), build_id)
+            pipeline.hdel(_waiters_key(), build_id)
+            pipeline.hset(_running_key(), build_id,
+                          json.dumps({
+                              'user': user,
+                              'since': now
+                          }))
+            pipeline.execute()
+            return None
+
+    def _order(self, waiters: Dict[str, dict],
+               running: Dict[str, dict]) -> List[str]:
+        """:return: the waiting builds, in the order they are to start"""
+        arrivals = self.redis.zrange(_queue_key(), 0, -1, withscores=True)
+        build_ids = [
+            str(build_id, 'utf-8') for build_id, _ in arrivals
+            if str(build_id, 'utf-8') in waiters
+        ]
+        if self.queueing == BuildScheduler.FIFO:
+            return build_ids
+        # Each user's builds go after as many builds of other users as the
+        # user has running or waiting ahead of them
+        builds_per_user = collections.Counter(b['user']
+                                              for b in running.values())
+        turns = {}
+        for build_id in build_ids:
+            user = waiters[build_id]['user']
+            turns[build_id] = builds_per_user[user]
+            builds_per_user[user] += 1
+        # Sorting is stable, so builds with the same turn stay in order
+        return sorted(build_ids, key=lambda b: turns[b])
+
+    def _get_waiters(self, now: float) -> Dict[str, dict]:
+        waiters = {}
+        for build_id, waiter in self.redis.hgetall(_waiters_key()).items():
+            build_id = str(build_id, 'utf-8')
+            waiter = json.loads(str(waiter, 'utf-8'))
+            if now - waiter['last_seen'] > _WAITER_STALE_AFTER_SECONDS:
+                log.warning(f'Dropping stale build waiter {build_id}')
+                self._leave_queue(build_id)
+            else:
+                waiters[build_id] = waiter
+        return waiters
+
+    def _get_running(self, now: float) -> Dict[str, dict]:
+        running = {}
+        for build_id, build in self.redis.hgetall(_running_key()).items():
+            build_id = str(build_id, 'utf-8')
+            build = json.loads(str(build, 'utf-8'))
+            if now - build['since'] > _RUNNING_BUILD_STALE_AFTER_SECONDS:
+                log.warning(f'Dropping leaked build {build_id}')
+                self.redis.hdel(_running_key(), build_id)
+            else:
+                running[build_id] = build
+        return running
+
+    def _leave_queue(self, build_id: str) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.zrem(_queue_key(), build_id)
+        pipeline.hdel(_waiters_key(), build_id)
+        pipeline.execute()
+
+
+class BuildTimings:
+    """Time taken by each stage of a build"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = collections.OrderedDict()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[name] = \
+                self.seconds.get(name, 0) + time.time() - start
+
+    def record(self, redis: StrictRedis) -> None:
+        """Adds the timings to the totals of all builds"""
+        pipeline = redis.pipeline()
+        for name, seconds in self.seconds.items():
+            pipeline.hincrby(_stage_counts_key(), name, 1)
+            pipeline.hincrbyfloat(_stage_seconds_key(), name, seconds)
+        pipeline.execute()
+
+    def __str__(self) -> str:
+        return ', '.join(f'{name} {seconds:.1f}s'
+                         for name, seconds in self.seconds.items())
+
+    @staticmethod
+    def get_stats(redis: StrictRedis) -> Dict[str, dict]:
+        counts = redis.hgetall(_stage_counts_key())
+        seconds = redis.hgetall(_stage_seconds_key())
+        stats = {}
+        for name, count in counts.items():
+            count = int(count)
+            total_in_seconds = float(seconds.get(name, 0))
+            stats[str(name, 'utf-8')] = {
+                'count': count,
+                'total_in_seconds': total_in_seconds,
+                'mean_in_seconds': total_in_seconds / count
+            }
+        return stats
+
+
+def _queue_key() -> str:
+    return f'key:{__name__}#queue'
+
+
+def _waiters_key() -> str:
+    return f'key:{__name__}#waiters'
+
+
+def _running_key() -> str:
+    return f'key:{__name__}#running'
+
+
+def _stage_counts_key() -> str:
+    return f'key:{__name__}#stage_counts'
+
+
+def _stage_seconds_key() -> str:
+    return f'key:{__name__}#stage_seconds'
@@ -0,0 +1,114 @@
+from copy import deepcopy
+from typing import Dict, Optional, Set
+
+from plz.controller.db_storage import DBStorage
+from plz.controller.execution_composition import ExecutionComposition, \
+    IndicesComposition
+from plz.controller.immutable_records_cache import ImmutableRecord, \
+    ImmutableRecordsCache
+
+
+class CachingDBStorage(DBStorage):
+    """
+    Serves the records that don't change once written from an in-process
+    cache, and everything else from the underlying storage
+    """
+
+    def __init__(self, delegate: DBStorage, cache: ImmutableRecordsCache):
+        super().__init__()
+        self.delegate = delegate
+        self.cache = cache
+
+    def store_start_metadata(self, execution_id: str,
+                             start_metadata: dict) -> None:
+        self.delegate.store_start_metadata(execution_id, start_metadata)
+
+    def store_start_metadatas(self, start_metadatas: [dict]) -> None:
+        self.delegate.store_start_metadatas(start_metadatas)
+
+    def retrieve_start_metadata(self, execution_id: str) -> dict:
+        # Callers are free to modify what they get
+        return deepcopy(
+            self.cache.get(
+                ImmutableRecord.START_METADATA, execution_id, lambda: self.
+                delegate.retrieve_start_metadata(execution_id)))
+
+    def add_finished_execution_id(self,
+                                  user: str,
+                                  project: str,
+                                  execution_id: str,
+                                  finish_timestamp: Optional[int] = None):
+        self.delegate.add_finished_execution_id(user, project, execution_id,
+                                                finish_timestamp)
+
+    def retrieve_finished_execution_ids(self, user: str,
+                                        project: str) -> Set[str]:
+        return self.delegate.retrieve_finished_execution_ids(user, project)
+
+    def store_execution_composition(self,
+                                    execution_composition: ExecutionComposition
+                                    ) -> None:
+        self.delegate.store_execution_composition(execution_composition)
+
+    def retrieve_execution_composition(self, execution_id: str) \
+            -> ExecutionComposition:
+        composition = None
+
+        def retrieve():
+            nonlocal composition
+            composition = self.delegate.retrieve_execution_composition(
+                execution_id)
+            if isinstance(composition, IndicesComposition):
+                return composition.indices_to_compositions.copy()
+            return None
+
+        # Index ranges are written when all sub-executions have been
+        # assigned, and only change when a tombstoned sub-execution is
+        # retried. Tombstones can be added at any time, and we don't cache
+        # atomic compositions as a missing composition is taken as atomic
+        indices_to_compositions = self.cache.get(
+            ImmutableRecord.COMPOSITION_INDEX_RANGES,
+            execution_id,
+            retrieve,
+            should_cache=lambda ranges: ranges is not None and len(ranges) > 0)
+        if composition is not None:
+            return composition
+        tombstone_execution_ids = \
+            self.delegate.retrieve_tombstone_sub_execution_ids(execution_id)
+        if any(c.execution_id in tombstone_execution_ids
+               for _, _, c in indices_to_compositions.ranges()):
+            # The cached ranges might point to a sub-execution that has been
+            # retried since
+            return self.delegate.retrieve_execution_composition(execution_id)
+        return IndicesComposition(execution_id, indices_to_compositions.copy(),
+                                  tombstone_execution_ids)
+
+    def retrieve_execution_id_from_parent_and_index(self, execution_id: str,
+                                                    index: int
+                                                    ) -> Optional[str]:
+        composition = self.retrieve_execution_composition(execution_id)
+        if not isinstance(composition, IndicesComposition):
+            return None
+        sub_composition = composition.indices_to_compositions.get(index)
+        if sub_composition is None:
+            return None
+        return sub_composition.execution_id
+
+    def add_tombstone_sub_execution_id(self, execution_id: str,
+                                       sub_execution_id: str) -> None:
+        self.delegate.add_tombstone_sub_execution_id(execution_id,
+                                                     sub_execution_id)
+
+    def retrieve_tombstone_sub_execution_ids(self,
+                                             execution_id: str) -> Set[str]:
+        return self.delegate.retrieve_tombstone_sub_execution_ids(execution_id)
+
+    def get_user_of_execution(self, execution_id: str) -> str:
+        return self.get_users_of_executions([execution_id])[execution_id]
+
+    def get_users_of_executions(self, execution_ids: [str]) \
+            -> Dict[str, Optional[str]]:
+        return self.cache.get_all(ImmutableRecord.USER_OF_EXECUTION,
+                                  execution_ids,
+                                  self.delegate.get_users_of_executions,
+                                  should_cache=lambda user: user is not None)
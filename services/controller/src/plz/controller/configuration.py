@@ -7,17 +7,23 @@ import docker
 import pyhocon
 from redis import StrictRedis
 
+from plz.controller.caching_db_storage import CachingDBStorage
 from plz.controller.containers import Containers
-from plz.controller.images import ECRImages, LocalImages
+from plz.controller.images import BaseImagePulls, ECRImages, LocalImages
+from plz.controller.immutable_records_cache import ImmutableRecordsCache
+from plz.controller.input_volume_cache import InputVolumeCache
 from plz.controller.instances.aws.ec2_instance_group import EC2InstanceGroup
+from plz.controller.instances.local_scheduler import LocalScheduler
 from plz.controller.instances.localhost import Localhost
 from plz.controller.redis_db_storage import RedisDBStorage
 from plz.controller.results import LocalResultsStorage
+from plz.controller.sqlite_db_storage import SQLiteDBStorage
 from plz.controller.volumes import Volumes
 
-Dependencies = collections.namedtuple(
-    'Dependencies',
-    ['redis', 'instance_provider', 'images', 'results_storage', 'db_storage'])
+Dependencies = collections.namedtuple('Dependencies', [
+    'redis', 'instance_provider', 'images', 'results_storage', 'db_storage',
+    'immutable_records_cache'
+])
 
 
 def load() -> pyhocon.ConfigTree:
@@ -46,27 +52,37 @@ def load_from_file(path) -> pyhocon.ConfigTree:
 
 def dependencies_from_config(config) -> Dependencies:
     redis = StrictRedis(host=config.get('redis_host', 'localhost'))
-    # DB storage can only be redis for now, but in case we want to drop redis
-    # for something else, or allow other DBs to be specified in the info,
-    # the dependence on redis is nicely encapsulated here
-    db_storage = _db_storage_from(redis)
+    immutable_records_cache = ImmutableRecordsCache(
+        config.get_int('cache.max_entries', 10000))
+    db_storage = CachingDBStorage(_db_storage_from(config, redis),
+                                  immutable_records_cache)
     images = _images_from(config)
-    results_storage = _results_storage_from(config, redis, db_storage)
+    results_storage = _results_storage_from(config, redis, db_storage,
+                                            immutable_records_cache)
     instance_provider = _instance_provider_from(config, images, redis,
                                                 results_storage)
     return Dependencies(redis, instance_provider, images, results_storage,
-                        db_storage)
+                        db_storage, immutable_records_cache)
 
 
 def _instance_provider_from(config, images, redis, results_storage):
     docker_host = get_docker_host_from_config(config)
     instance_provider_type = config.get('instances.provider', 'localhost')
+    input_volume_cache_max_size_in_bytes = int(
+        config.get_float('instances.input_cache.max_size_in_gb', 10) * 1024**3)
     if instance_provider_type == 'localhost':
         containers = Containers.for_host(docker_host)
         volumes = Volumes.for_host(docker_host)
+        if input_volume_cache_max_size_in_bytes > 0:
+            input_volume_cache = InputVolumeCache(
+                volumes, redis, 'localhost',
+                input_volume_cache_max_size_in_bytes)
+        else:
+            input_volume_cache = None
         instance_provider = Localhost(
             results_storage, images, containers, volumes, redis,
-            config['assumptions.instance_lock_timeout'])
+            config['assumptions.instance_lock_timeout'], input_volume_cache,
+            _local_scheduler_from(config, redis, containers))
     elif instance_provider_type == 'aws-ec2':
         instance_provider = EC2InstanceGroup(
             redis=redis,
@@ -88,21 +104,75 @@ def _instance_provider_from(config, images, redis, results_storage):
             instance_max_startup_time_in_minutes=config[
                 'assumptions.instance_max_startup_time_in_minutes'],
             container_idle_timestamp_grace=config[
-                'assumptions.container_idle_timestamp_grace'])
+                'assumptions.container_idle_timestamp_grace'],
+            warm_pool_sizes={
+                i['instance_type']: i.get_int('min_idle')
+                for i in config.get('instances.warm_pool.instances', [])
+            },
+            warm_pool_max_idle_time_in_minutes=config.get_int(
+                'instances.warm_pool.max_idle_time_in_minutes', 30),
+            warm_pool_instance_market_spec=_warm_pool_market_spec_from(config),
+            max_prefetch_instances=config.get_int(
+                'instances.max_prefetch_instances', 2),
+            input_volume_cache_max_size_in_bytes=(
+                input_volume_cache_max_size_in_bytes),
+            instance_type_families={
+                family: list(instance_types)
+                for family, instance_types in config.get(
+                    'instances.instance_type_families', {}).items()
+            },
+            time_per_instance_type_in_seconds=config.get_int(
+                'instances.time_per_instance_type_in_seconds', 120),
+            max_executions_per_instance=config.get_int(
+                'instances.max_executions_per_instance', 1),
+            build_in_workers=config.get_bool('instances.build_in_workers',
+                                             False))
     else:
         raise ValueError('Invalid instance provider.')
     return instance_provider
 
 
+def _local_scheduler_from(config, redis, containers):
+    # Off by default, so that executions keep starting right away
+    if not config.get_bool('instances.local_scheduler.enabled', False):
+        return None
+    # Limits not given are taken from the docker host, but for the number of
+    # containers
+    max_cpus = config.get_float('instances.local_scheduler.max_cpus', None)
+    max_memory_in_gb = config.get_float(
+        'instances.local_scheduler.max_memory_in_gb', None)
+    max_memory_in_bytes = int(max_memory_in_gb * 1024**3) \
+        if max_memory_in_gb is not None else None
+    max_containers = config.get_int('instances.local_scheduler.max_containers',
+                                    None)
+    return LocalScheduler(redis, containers, max_cpus, max_memory_in_bytes,
+                          max_containers)
+
+
+def _warm_pool_market_spec_from(config):
+    instance_market_type = config.get(
+        'instances.warm_pool.instance_market_type', 'on_demand')
+    instance_market_spec = {'instance_market_type': instance_market_type}
+    if instance_market_type == 'spot':
+        instance_market_spec['max_bid_price_in_dollars_per_hour'] = \
+            config.get_float(
+                'instances.warm_pool.max_bid_price_in_dollars_per_hour')
+    return instance_market_spec
+
+
 def _images_from(config):
     images_type = config.get('images.provider', 'local')
 
     def docker_api_client_creator():
         return docker_client_from_config(config)
 
+    base_image_pulls = BaseImagePulls(
+        config.get('images.base_image_pull.policy', BaseImagePulls.ALWAYS),
+        config.get_float('images.base_image_pull.ttl_in_minutes', 60))
     if images_type == 'local':
         repository = config.get('images.repository', 'plz/builds')
-        images = LocalImages(docker_api_client_creator, repository)
+        images = LocalImages(docker_api_client_creator, repository,
+                             base_image_pulls)
     elif images_type == 'aws-ecr':
 
         def ecr_client_creator():
@@ -110,9 +180,11 @@ def _images_from(config):
                                 region_name=config['images.region'])
 
         repository_without_registry = config['images.repository']
-        images = ECRImages(docker_api_client_creator, ecr_client_creator,
+        images = ECRImages(docker_api_client_creator,
+                           ecr_client_creator,
                            repository_without_registry,
-                           config['assumptions.ecr_login_validity_in_minutes'])
+                           config['assumptions.ecr_login_validity_in_minutes'],
+                           base_image_pulls=base_image_pulls)
     else:
         raise ValueError('Invalid image provider.')
     return images
@@ -133,11 +205,12 @@ def docker_client_from_config(config):
     return docker.APIClient(base_url=docker_host, **client_extra_args)
 
 
-def _results_storage_from(config, redis, db_storage):
+def _results_storage_from(config, redis, db_storage, immutable_records_cache):
     results_storage_type = config.get('results.provider', 'local')
     if results_storage_type == 'local':
         directory = config.get('results.directory')
-        results_storage = LocalResultsStorage(redis, db_storage, directory)
+        results_storage = LocalResultsStorage(redis, db_storage, directory,
+                                              immutable_records_cache)
     elif results_storage_type == 'aws-s3':  # TODO: Implement this
         raise NotImplementedError('The AWS S3 provider is not implemented.')
     else:
@@ -145,5 +218,18 @@ def _results_storage_from(config, redis, db_storage):
     return results_storage
 
 
-def _db_storage_from(redis):
-    return RedisDBStorage(redis)
+def _db_storage_from(config, redis):
+    db_storage_type = config.get('db_storage.provider', 'redis')
+    if db_storage_type == 'redis':
+        db_storage = RedisDBStorage(redis)
+    elif db_storage_type == 'sqlite':
+        db_storage = SQLiteDBStorage(
+            get_sqlite_db_storage_path_from_config(config))
+    else:
+        raise ValueError('Invalid DB storage provider.')
+    return db_storage
+
+
+def get_sqlite_db_storage_path_from_config(config):
+    return config.get('db_storage.path',
+                      os.path.join(config.get('data_dir', '.'), 'plz.sqlite3'))
@@ -91,12 +91,28 @@ class Containers:
         tar, _ = container.get_archive(path)
         yield from tar
 
-    def execution_ids(self):
-        return [
-            container.name[len(self._CONTAINER_NAME_PREFIX):]
-            for container in self.docker_client.containers.list(all=True)
-            if container.name.startswith(self._CONTAINER_NAME_PREFIX)
-        ]
+    def execution_ids(self) -> List[str]:
+        # Listing full containers inspects each of them, so get just the
+        # names of ours in one request
+        containers = self.docker_client.api.containers(
+            all=True, filters={'name': self._CONTAINER_NAME_PREFIX})
+        execution_ids = []
+        for container in containers:
+            for name in container.get('Names') or []:
+                # Names come with a slash, and the filter matches anywhere
+                name = name.lstrip('/')
+                if name.startswith(self._CONTAINER_NAME_PREFIX):
+                    execution_ids.append(
+                        name[len(self._CONTAINER_NAME_PREFIX):])
+        return execution_ids
+
+    def exits(self) -> Iterator[str]:
+        """Execution IDs of the containers that exit, as they do"""
+        filters = {'type': 'container', 'event': 'die'}
+        for event in self.docker_client.events(filters=filters, decode=True):
+            name = event.get('Actor', {}).get('Attributes', {}).get('name', '')
+            if name.startswith(self._CONTAINER_NAME_PREFIX):
+                yield name[len(self._CONTAINER_NAME_PREFIX):]
 
     def from_execution_id(self, execution_id: str) -> Optional[Container]:
         try:
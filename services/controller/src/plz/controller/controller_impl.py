@@ -16,12 +16,20 @@ from plz.controller.api.exceptions import BadInputMetadataException, \
     ExecutionAlreadyHarvestedException, ExecutionNotFoundException, \
     InstanceStillRunningException, ResponseHandledException
 from plz.controller.api.types import InputMetadata, JSONString
+from plz.controller.build_context_files import BuildContextFiles
+from plz.controller.builds import BuildScheduler, BuildTimings
 from plz.controller.configuration import Dependencies
 from plz.controller.db_storage import DBStorage
 from plz.controller.execution import Executions
-from plz.controller.execution_composition import ExecutionComposition
-from plz.controller.execution_metadata import is_atomic
+from plz.controller.execution_composition import AtomicComposition, \
+    ExecutionComposition, IndicesComposition
+from plz.controller.execution_metadata import \
+    enrich_sub_execution_start_metadata, is_atomic, is_sub_execution
+from plz.controller.execution_queue import ExecutionQueue
 from plz.controller.images import Images
+from plz.controller.images.images_base import DOCKERFILE_NAME, \
+    base_images_of
+from plz.controller.immutable_records_cache import ImmutableRecordsCache
 from plz.controller.input_data import InputDataConfiguration
 from plz.controller.instances.instance_base import Instance, \
     InstanceProvider, NoInstancesFoundException
@@ -36,6 +44,8 @@ class ControllerImpl(Controller):
         self.instance_provider: InstanceProvider = \
             dependencies.instance_provider
         self.db_storage: DBStorage = dependencies.db_storage
+        self.immutable_records_cache: ImmutableRecordsCache = \
+            dependencies.immutable_records_cache
         self.redis: StrictRedis = dependencies.redis
         self.executions: Executions = Executions(dependencies.results_storage,
                                                  self.instance_provider)
@@ -46,6 +56,33 @@ class ControllerImpl(Controller):
         os.makedirs(temp_data_dir, exist_ok=True)
         self.input_data_configuration = InputDataConfiguration(
             self.redis, input_dir=input_dir, temp_data_dir=temp_data_dir)
+        build_context_files_dir = os.path.join(data_dir, 'build_context_files')
+        os.makedirs(build_context_files_dir, exist_ok=True)
+        self.build_context_files = BuildContextFiles(
+            build_context_files_dir,
+            temp_data_dir,
+            max_size_in_bytes=int(
+                config.get_float('images.build_context_cache.max_size_in_gb',
+                                 10) * 1024**3))
+        self.build_scheduler = BuildScheduler(
+            self.redis,
+            max_concurrent_builds=config.get_int(
+                'images.builds.max_concurrent_builds', 2),
+            queueing=config.get('images.builds.queueing', BuildScheduler.FIFO))
+        self.execution_queue = ExecutionQueue(
+            self.redis,
+            self._dispatch,
+            max_concurrent_dispatches=config.get_int(
+                'executions.max_concurrent_dispatches', 16),
+            max_concurrent_dispatches_per_user=config.get_int(
+                'executions.max_concurrent_dispatches_per_user', 4),
+            dispatchers_per_process=config.get_int(
+                'executions.dispatchers_per_process', 2))
+        self.execution_queue.start_dispatchers()
+        # Times that the indices of a sub-execution that lost its instance
+        # are run again
+        self.max_sub_execution_retries = config.get_int(
+            'executions.max_sub_execution_retries', 2)
         self.log = log
 
     # noinspection PyMethodMayBeStatic
@@ -105,21 +142,31 @@ class ControllerImpl(Controller):
             indices_per_execution=start_metadata.get('indices_per_execution'),
             previous_execution_id=previous_execution_id)
 
+    def get_dispatch_statuses(self, execution_id: str) -> Iterator[dict]:
+        return self.execution_queue.get_statuses(execution_id)
+
     def list_executions(self, user: str, list_for_all_users: bool) -> [dict]:
-        execution_infos = []
-        db_storage = self.db_storage
-        for info in self.instance_provider.get_executions():
-            execution_id = info.execution_id
-            if list_for_all_users or info.execution_id == '' \
-                    or db_storage.get_user_of_execution(execution_id) == user:
-                # _asdict is not protected, it's preceded by underscore as to
-                # avoid name conflicts, see docs
-                # noinspection PyProtectedMember
-                execution_infos.append(info._asdict())
-        return execution_infos
+        infos = self.instance_provider.get_executions()
+        if not list_for_all_users:
+            users_of_executions = self.db_storage.get_users_of_executions(
+                [info.execution_id for info in infos if info.execution_id])
+            infos = [
+                info for info in infos if info.execution_id == ''
+                or users_of_executions[info.execution_id] == user
+            ]
+        # _asdict is not protected, it's preceded by underscore as to
+        # avoid name conflicts, see docs
+        # noinspection PyProtectedMember
+        return [info._asdict() for info in infos]
 
     def harvest(self) -> None:
-        self.instance_provider.harvest()
+        interrupted_execution_ids = self.instance_provider.harvest()
+        for execution_id in interrupted_execution_ids:
+            # noinspection PyBroadException
+            try:
+                self._retry_sub_execution(execution_id)
+            except Exception:
+                self.log.exception(f'Exception retrying {execution_id}')
 
     def get_status(self, execution_id: str) -> dict:
         return self.executions.get(execution_id).get_status()
@@ -182,11 +229,94 @@ class ControllerImpl(Controller):
     def create_snapshot(self, image_metadata: dict, context: BinaryIO) -> \
             Iterator[JSONString]:
         tag = Images.construct_tag(image_metadata)
-        yield from (frag.decode('utf-8')
-                    for frag in self.images.build(context, tag))
-        self.instance_provider.push(tag)
+        last_snapshot_key = _last_snapshot_key(image_metadata['user'],
+                                               image_metadata['project'])
+        if 'context_digest' in image_metadata and self.images.has_image(tag):
+            # The same context was built already
+            self.redis.set(last_snapshot_key, tag)
+            yield json.dumps({'id': tag})
+            return
+        build_id = str(uuid.uuid4())
+        timings = BuildTimings()
+        # Idle workers build without queueing, as they don't take from the
+        # capacity of the controller
+        with timings.stage('build_host'):
+            build_host = self.instance_provider.acquire_build_host(tag)
+        if build_host is None:
+            images = self.images
+            with timings.stage('queue'):
+                for position in self.build_scheduler.wait_for_turn(
+                        build_id, image_metadata['user']):
+                    yield json.dumps({
+                        'stream':
+                            f'Queued for building at position {position}\n'
+                    })
+        else:
+            images = build_host.images
+            yield json.dumps(
+                {'stream': f'Building in worker {build_host.instance_id}\n'})
+        manifest = image_metadata.get('manifest')
+        assembled_context = None
+        is_pushing = False
+        try:
+            if 'context_digest' in image_metadata \
+                    and images.is_in_host(tag):
+                # Built while this one was queued, or the worker has it
+                self.redis.set(last_snapshot_key, tag)
+                yield json.dumps({'id': tag})
+                return
+            base_images = None
+            if manifest is not None:
+                with timings.stage('context'):
+                    dockerfile = self.build_context_files.read_file(
+                        manifest, DOCKERFILE_NAME)
+                    if dockerfile is not None:
+                        base_images = base_images_of(
+                            dockerfile.decode('utf-8'))
+                    assembled_context = \
+                        self.build_context_files.assemble(manifest)
+                context = assembled_context
+            last_snapshot = self.redis.get(last_snapshot_key)
+            if last_snapshot is not None:
+                last_snapshot = str(last_snapshot, 'utf-8')
+            yield from (frag.decode('utf-8')
+                        for frag in images.build(context,
+                                                 tag,
+                                                 base_images=base_images,
+                                                 cache_from=last_snapshot,
+                                                 timings=timings))
+            self.instance_provider.push(tag, build_host)
+            # The push releases the build host when it's done with it
+            is_pushing = True
+        finally:
+            if build_host is None:
+                self.build_scheduler.finish(build_id)
+            elif not is_pushing:
+                self.instance_provider.release_build_host(build_host)
+            if assembled_context is not None:
+                assembled_context.close()
+        self.instance_provider.prefetch_snapshot(tag)
+        self.redis.set(last_snapshot_key, tag)
+        timings.record(self.redis)
+        log.info(f'Built {tag}: {timings}')
         yield json.dumps({'id': tag})
 
+    def get_missing_build_context_files(self, digests: List[str]) \
+            -> List[str]:
+        return self.build_context_files.get_missing(digests)
+
+    def put_build_context_files(self, files_tarball: BinaryIO) -> None:
+        self.build_context_files.put(files_tarball)
+
+    def get_snapshot_id(self, user: str, project: str,
+                        context_digest: str) -> Optional[str]:
+        tag = Images.construct_tag({
+            'user': user,
+            'project': project,
+            'context_digest': context_digest
+        })
+        return tag if self.images.has_image(tag) else None
+
     def put_input(self, input_id: str, input_metadata: InputMetadata,
                   input_data_stream: BinaryIO) -> None:
         if not input_metadata.has_all_args_or_none():
@@ -283,24 +413,96 @@ class ControllerImpl(Controller):
             execution_id,
             execution_id_generator=_get_execution_uuid)
 
-        for m in all_metadatas:
-            self.db_storage.store_start_metadata(m['execution_id'], m)
+        self.db_storage.store_start_metadatas(all_metadatas)
+        self.db_storage.store_execution_composition(composition)
 
         metadatas_to_run = [m for m in all_metadatas if is_atomic(m)]
 
         self._set_user_last_execution_id(execution_spec['user'], execution_id)
+        # Queue it before answering, so that it's not lost if the client goes
+        # away
+        ahead = self._enqueue(execution_id, all_metadatas[0], composition,
+                              metadatas_to_run)
         yield {'id': execution_id}
-
+        yield {'status': f'queued ({ahead} of your executions ahead)'}
+
+    def _enqueue(self, execution_id: str, start_metadata: dict,
+                 composition: ExecutionComposition,
+                 metadatas_to_run: [dict]) -> int:
+        def job_metadata(m: dict) -> dict:
+            return {
+                'execution_id': m['execution_id'],
+                # User and project aren't kept in the execution spec of the
+                # metadata, but instance providers need them
+                'execution_spec': {
+                    **m['execution_spec'], 'user': m['user'],
+                    'project': m['project']
+                },
+                'status_prefix': _status_prefix(composition, m)
+            }
+
+        return self.execution_queue.enqueue(
+            execution_id, start_metadata['user'], {
+                'snapshot_id': start_metadata['snapshot_id'],
+                'parameters': start_metadata['parameters'],
+                'instance_market_spec': start_metadata['instance_market_spec'],
+                'user': start_metadata['user'],
+                'metadatas_to_run':
+                    [job_metadata(m) for m in metadatas_to_run]
+            })
+
+    def _retry_sub_execution(self, execution_id: str) -> None:
+        """
+        Runs again the indices of a sub-execution that lost its instance
+        (for instance, because the spot instance was reclaimed), so that the
+        parent execution doesn't need to be rerun
+        """
+        start_metadata = self.db_storage.retrieve_start_metadata(execution_id)
+        if not is_sub_execution(start_metadata):
+            return
+        retries = start_metadata.get('retries', 0)
+        if retries >= self.max_sub_execution_retries:
+            self.log.info(f'Not retrying {execution_id}, it was retried '
+                          f'{retries} times already')
+            return
+        parent_execution_id = start_metadata['parent_execution_id']
+        composition: IndicesComposition = \
+            self.db_storage.retrieve_execution_composition(parent_execution_id)
+        start, end = start_metadata['execution_spec']['index_range_to_run']
+        if composition.indices_to_compositions.get(start) is None or \
+                composition.indices_to_compositions[start].execution_id != \
+                execution_id:
+            # Retried already
+            return
+        retry_execution_id = _get_execution_uuid()
+        self.log.info(f'Retrying indices [{start}, {end}) of '
+                      f'{parent_execution_id} as {retry_execution_id}, as '
+                      f'{execution_id} lost its instance')
+        parent_start_metadata = self.db_storage.retrieve_start_metadata(
+            parent_execution_id)
+        retry_start_metadata = enrich_sub_execution_start_metadata(
+            parent_start_metadata, retry_execution_id, (start, end))
+        retry_start_metadata['retries'] = retries + 1
+        self.db_storage.store_start_metadatas([retry_start_metadata])
+        composition.reassign_index_range(start, end,
+                                         AtomicComposition(retry_execution_id))
+        self.db_storage.store_execution_composition(composition)
+        self._enqueue(retry_execution_id, parent_start_metadata, composition,
+                      [retry_start_metadata])
+
+    def _dispatch(self, job: dict) -> Iterator[dict]:
+        """Gets instances for a queued execution"""
+        metadatas_to_run = job['metadatas_to_run']
         try:
             def status_generator(
                     ex_id: str, ex_spec: dict,
                     input_data_configuration: InputDataConfiguration) \
                     -> Iterator[dict]:
                 input_stream = input_data_configuration.prepare_input_stream(
-                    execution_spec)
+                    ex_spec)
                 return self.instance_provider.run_in_instance(
-                    ex_id, snapshot_id, parameters, input_stream,
-                    instance_market_spec, ex_spec)
+                    ex_id, job['snapshot_id'], job['parameters'], input_stream,
+                    job['instance_market_spec'], ex_spec)
 
             statuses_generators = [
                 status_generator(m['execution_id'], m['execution_spec'],
@@ -310,8 +512,8 @@ class ControllerImpl(Controller):
 
             instances = [None for _ in statuses_generators]
 
-            yield from _create_instances(composition, instances,
-                                         metadatas_to_run, statuses_generators)
+            yield from _create_instances(instances, metadatas_to_run,
+                                         statuses_generators)
 
             indices_without_instance = [
                 i for (i, instance) in enumerate(instances) if instance is None
@@ -319,14 +521,11 @@ class ControllerImpl(Controller):
 
             if len(indices_without_instance) > 0:
                 for i in indices_without_instance:
-                    status_prefix = _status_prefix(composition,
-                                                   metadatas_to_run[i])
+                    status_prefix = metadatas_to_run[i]['status_prefix']
                     yield {
                         'error': status_prefix + 'Couldn\'t get an instance'
                     }
                     return
-
-            self.db_storage.store_execution_composition(composition)
         except Exception as e:
             self.log.exception('Exception running command.')
             yield {'error': str(e)}
@@ -342,8 +541,7 @@ def _get_execution_uuid() -> str:
 log = logging.getLogger(__name__)
 
 
-def _create_instances(composition: ExecutionComposition,
-                      instances: [Optional[Instance]],
+def _create_instances(instances: [Optional[Instance]],
                       metadatas_to_run: [dict],
                       statuses_generators: [Iterator[dict]]) -> Iterator[dict]:
     # Whether was there a status update
@@ -359,8 +557,7 @@ def _create_instances(composition: ExecutionComposition,
                 continue
             was_there_status = True
             if 'message' in status:
-                status_prefix = _status_prefix(composition,
-                                               metadatas_to_run[i])
+                status_prefix = metadatas_to_run[i]['status_prefix']
                 yield {'status': status_prefix + status['message']}
             if 'instance' in status:
                 instances[i] = status['instance']
@@ -377,3 +574,8 @@ def _status_prefix(composition: ExecutionComposition, metadata: dict) -> str:
 
 def _get_user_of_execution(db_storage: DBStorage, execution_id: str) -> str:
     return db_storage.retrieve_start_metadata(execution_id)['user']
+
+
+def _last_snapshot_key(user: str, project: str) -> str:
+    # Its layers are likely to be reused by the next build of the project
+    return f'key:{__name__}#last_snapshot:{user}:{project}'
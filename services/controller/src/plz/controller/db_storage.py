@@ -1,6 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import Optional, Set
+from typing import Dict, Optional, Set
 
 from plz.controller.execution_composition import ExecutionComposition
 
@@ -13,13 +13,26 @@ class DBStorage(ABC):
             -> None:
         pass
 
+    def store_start_metadatas(self, start_metadatas: [dict]) -> None:
+        """
+        Store the start metadata of an execution along with the one of its
+        sub-executions
+        """
+        for start_metadata in start_metadatas:
+            self.store_start_metadata(start_metadata['execution_id'],
+                                      start_metadata)
+
     @abstractmethod
     def retrieve_start_metadata(self, execution_id: str) -> dict:
         pass
 
     @abstractmethod
-    def add_finished_execution_id(self, user: str, project: str,
-                                  execution_id: str) -> None:
+    def add_finished_execution_id(self,
+                                  user: str,
+                                  project: str,
+                                  execution_id: str,
+                                  finish_timestamp: Optional[int] = None
+                                  ) -> None:
         pass
 
     @abstractmethod
@@ -44,9 +57,26 @@ class DBStorage(ABC):
                                                     ) -> Optional[str]:
         pass
 
+    @abstractmethod
+    def add_tombstone_sub_execution_id(self, execution_id: str,
+                                       sub_execution_id: str) -> None:
+        pass
+
     @abstractmethod
     def retrieve_tombstone_sub_execution_ids(self, execution_id: str) -> [str]:
         pass
 
     def get_user_of_execution(self, execution_id: str) -> str:
         return self.retrieve_start_metadata(execution_id)['user']
+
+    def get_users_of_executions(self, execution_ids: [str]) \
+            -> Dict[str, Optional[str]]:
+        return {
+            execution_id: self.get_user_of_execution(execution_id)
+            for execution_id in execution_ids
+        }
+
+
+class ExecutionState:
+    STARTED = 'started'
+    FINISHED = 'finished'
@@ -1,11 +1,14 @@
+import bisect
 import logging
 import os
 from abc import ABC, abstractmethod
-from collections import namedtuple, defaultdict
-from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+from collections import namedtuple
+from collections.abc import Mapping
+from typing import Any, Callable, Iterator, List, Optional, Set, Tuple
 
 from plz.controller.containers import Containers
-from plz.controller.execution_metadata import enrich_start_metadata
+from plz.controller.execution_metadata import enrich_start_metadata, \
+    enrich_sub_execution_start_metadata
 from plz.controller.volumes import VolumeEmptyDirectory, Volumes
 
 log = logging.getLogger(__name__)
@@ -92,37 +95,100 @@ class AtomicComposition(ExecutionComposition):
         return ''
 
 
+class IndexRanges(Mapping):
+    """
+    A map from indices to values, kept as sorted ranges of consecutive indices
+    that map to the same value.
+
+    Parallel executions assign blocks of consecutive indices to the same
+    sub-execution, so memory is proportional to the number of sub-executions
+    instead of to the number of indices
+    """
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._values: List[Any] = []
+
+    def assign(self, start: int, end: int, value: Any) -> None:
+        """Assign the value to all indices in `range(start, end)`"""
+        if start >= end:
+            raise ValueError(f'Empty index range [{start}, {end})')
+        position = bisect.bisect_right(self._starts, start)
+        if (position > 0 and self._ends[position - 1] > start) or \
+                (position < len(self._starts)
+                 and self._starts[position] < end):
+            raise ValueError(f'Index range [{start}, {end}) overlaps with '
+                             'an already assigned range')
+        # Extend a contiguous range with the same value instead of adding a
+        # new one
+        if position > 0 and self._ends[position - 1] == start \
+                and self._values[position - 1] is value:
+            self._ends[position - 1] = end
+            return
+        self._starts.insert(position, start)
+        self._ends.insert(position, end)
+        self._values.insert(position, value)
+
+    def replace(self, start: int, end: int, value: Any) -> None:
+        """Change the value of the range `range(start, end)`"""
+        position = bisect.bisect_right(self._starts, start) - 1
+        if position < 0 or self._starts[position] != start \
+                or self._ends[position] != end:
+            raise ValueError(f'Index range [{start}, {end}) is not assigned')
+        self._values[position] = value
+
+    def ranges(self) -> Iterator[Tuple[int, int, Any]]:
+        return zip(self._starts, self._ends, self._values)
+
+    def copy(self) -> 'IndexRanges':
+        index_ranges = IndexRanges()
+        index_ranges._starts = list(self._starts)
+        index_ranges._ends = list(self._ends)
+        index_ranges._values = list(self._values)
+        return index_ranges
+
+    def __getitem__(self, index: int) -> Any:
+        position = bisect.bisect_right(self._starts, index) - 1
+        if position < 0 or index >= self._ends[position]:
+            raise KeyError(index)
+        return self._values[position]
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in zip(self._starts, self._ends))
+
+
 class IndicesComposition(ExecutionComposition):
     """
     Comprises several executions, each one processing a set of indices
     """
 
-    def __init__(self, execution_id: str, indices_to_compositions: Optional[
-            Dict[int, Optional[ExecutionComposition]]],
+    def __init__(self, execution_id: str,
+                 indices_to_compositions: Optional[IndexRanges],
                  tombstone_execution_ids: Optional[Set[str]]):
         super().__init__(execution_id)
         # A non-injective map with the sub-execution for a given index. If
         # there's no execution for a given index (for instance, it didn't
-        # execute yet) the value is None
+        # execute yet) the index is not present
         self.indices_to_compositions = indices_to_compositions \
             if indices_to_compositions is not None \
-            else defaultdict(lambda: None)
+            else IndexRanges()
         self.tombstone_execution_ids = tombstone_execution_ids \
             if tombstone_execution_ids is not None \
             else {}
 
     def to_jsonable_dict(self):
-        def jsonable_of_index(i: int):
-            if self.indices_to_compositions[i] is None:
-                return None
-            return self.indices_to_compositions[i].to_jsonable_dict()
-
+        # Ranges of indices as [start, end, composition], end excluded
+        index_ranges_to_compositions = [[
+            start, end, composition.to_jsonable_dict()
+        ] for start, end, composition in self.indices_to_compositions.ranges()]
         return {
             'execution_id': self.execution_id,
-            'indices_to_compositions': {
-                i: jsonable_of_index(i)
-                for i in self.indices_to_compositions
-            },
+            'index_ranges_to_compositions': index_ranges_to_compositions,
             'tombstone_executions': list(self.tombstone_execution_ids)
         }
 
@@ -153,26 +219,29 @@ class IndicesComposition(ExecutionComposition):
             this_exec_n_indices = min(indices_per_execution,
                                       parallel_indices_range[1] - i)
             subexecution_id = execution_id_generator()
-            for j in range(this_exec_n_indices):
-                self.assign_index(i + j, AtomicComposition(subexecution_id))
-            enriched_start_metadata = enrich_start_metadata(
+            self.assign_index_range(i, i + this_exec_n_indices,
+                                    AtomicComposition(subexecution_id))
+            enriched_start_metadata = enrich_sub_execution_start_metadata(
+                metadatas[0],
                 subexecution_id,
-                start_metadata,
-                snapshot_id,
-                parameters,
-                instance_market_spec,
-                execution_spec,
-                parallel_indices_range=None,
-                index_range_to_run=(i, i + this_exec_n_indices),
-                indices_per_execution=None,
-                previous_execution_id=None)
+                index_range_to_run=(i, i + this_exec_n_indices))
             metadatas.append(enriched_start_metadata)
         return metadatas
 
     def assign_index(
             self, index: int, execution_composition: ExecutionComposition) \
             -> None:
-        self.indices_to_compositions[index] = execution_composition
+        self.assign_index_range(index, index + 1, execution_composition)
+
+    def assign_index_range(self, start: int, end: int,
+                           execution_composition: ExecutionComposition
+                           ) -> None:
+        self.indices_to_compositions.assign(start, end, execution_composition)
+
+    def reassign_index_range(self, start: int, end: int,
+                             execution_composition: ExecutionComposition
+                             ) -> None:
+        self.indices_to_compositions.replace(start, end, execution_composition)
 
     def get_component_brief_description(self, metadata: dict) -> str:
         index_range_to_run = metadata['execution_spec']['index_range_to_run']
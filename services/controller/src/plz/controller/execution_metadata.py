@@ -43,12 +43,16 @@ def _container_object_and_key_from_path(measures_dict: dict, path: str):
     return obj, fragments[-1]
 
 
-def compile_metadata_for_storage(start_metadata: dict,
-                                 finish_timestamp: int) -> dict:
+def compile_metadata_for_storage(start_metadata: dict, finish_timestamp: int,
+                                 instance_type: Optional[str]) -> dict:
     # This function doesn't do much for now, but having it is a way to
     # document that what we store as metadata is the start metadata plus
-    # other stuff
-    return {**start_metadata, 'finish_timestamp': finish_timestamp}
+    # other stuff. The instance type is there as executions can accept
+    # several of them
+    return {
+        **start_metadata, 'finish_timestamp': finish_timestamp,
+        'instance_type': instance_type
+    }
 
 
 def _tar_iterator(tarball_bytes: Iterator[bytes]) \
@@ -98,8 +102,63 @@ def enrich_start_metadata(execution_id: str, start_metadata: dict,
     enriched_start_metadata['parallel_indices_range'] = parallel_indices_range
     enriched_start_metadata['indices_per_execution'] = indices_per_execution
     enriched_start_metadata['previous_execution_id'] = previous_execution_id
+    enriched_start_metadata['parent_execution_id'] = None
+    return enriched_start_metadata
+
+
+def enrich_sub_execution_start_metadata(parent_start_metadata: dict,
+                                        execution_id: str,
+                                        index_range_to_run: Tuple[int, int]
+                                        ) -> dict:
+    # Sub-executions share everything with their parent but the execution ID
+    # and the indices they run. We copy only what changes, so that creating
+    # lots of them is cheap
+    enriched_start_metadata = dict(parent_start_metadata)
+    enriched_start_metadata['execution_id'] = execution_id
+    enriched_start_metadata['execution_spec'] = dict(
+        parent_start_metadata['execution_spec'])
+    enriched_start_metadata['execution_spec']['index_range_to_run'] = \
+        index_range_to_run
+    enriched_start_metadata['parallel_indices_range'] = None
+    enriched_start_metadata['indices_per_execution'] = None
+    enriched_start_metadata['previous_execution_id'] = None
+    enriched_start_metadata['parent_execution_id'] = \
+        parent_start_metadata['execution_id']
     return enriched_start_metadata
 
 
+def sub_execution_start_metadata_delta(start_metadata: dict) -> dict:
+    """
+    What is needed to recreate the start metadata of a sub-execution from the
+    one of its parent
+    """
+    delta = {
+        'parent_execution_id':
+            start_metadata['parent_execution_id'],
+        'execution_id':
+            start_metadata['execution_id'],
+        'index_range_to_run':
+            start_metadata['execution_spec']['index_range_to_run']
+    }
+    # Only sub-executions run again after losing their instance have retries
+    if 'retries' in start_metadata:
+        delta['retries'] = start_metadata['retries']
+    return delta
+
+
+def apply_sub_execution_start_metadata_delta(parent_start_metadata: dict,
+                                             delta: dict) -> dict:
+    start_metadata = enrich_sub_execution_start_metadata(
+        parent_start_metadata, delta['execution_id'],
+        delta['index_range_to_run'])
+    if 'retries' in delta:
+        start_metadata['retries'] = delta['retries']
+    return start_metadata
+
+
+def is_sub_execution(start_metadata: dict) -> bool:
+    return start_metadata.get('parent_execution_id', None) is not None
+
+
 def is_atomic(start_metadata: dict) -> bool:
     return start_metadata.get('parallel_indices_range', None) is None
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+from redis import StrictRedis
+
+log = logging.getLogger(__name__)
+
+# Statuses of an execution are kept for a while after it's dispatched, so that
+# clients that reconnect can still read them
+_STATUSES_EXPIRY_SECONDS = 24 * 60 * 60
+# Dispatches refresh their heartbeat this often, even while blocked. A
+# dispatch without a heartbeat for long belongs to a controller process that
+# is gone
+_DISPATCH_HEARTBEAT_SECONDS = 30
+_DISPATCH_STALE_AFTER_SECONDS = 5 * 60
+_CLAIM_LOCK_TIMEOUT_SECONDS = 30
+# Marks the end of the statuses of an execution
+_END = {'end': True}
+
+Dispatch = Callable[[dict], Iterator[dict]]
+
+
+class ExecutionQueue:
+    """
+    Executions waiting for an instance.
+
+    Submitting an execution just queues it. Dispatcher threads in every
+    controller process take executions from the queue and acquire instances
+    for them, storing the statuses so that clients can follow them.
+
+    There's a cap on the number of executions being dispatched at once, both
+    global and per user. Among the users with executions waiting, the one
+    with fewer executions being dispatched goes first, and then the one that
+    has been waiting for longer.
+
+    If a controller process goes away while dispatching, executions it hadn't
+    reported any status for are queued again. The others might have
+    instances already, so they are failed instead
+    """
+
+    def __init__(self,
+                 redis: StrictRedis,
+                 dispatch: Dispatch,
+                 max_concurrent_dispatches: int = 16,
+                 max_concurrent_dispatches_per_user: int = 4,
+                 dispatchers_per_process: int = 2,
+                 poll_interval_in_seconds: float = 1):
+        self.redis = redis
+        self.dispatch = dispatch
+        self.max_concurrent_dispatches = max_concurrent_dispatches
+        self.max_concurrent_dispatches_per_user = \
+            max_concurrent_dispatches_per_user
+        self.dispatchers_per_process = dispatchers_per_process
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        # Threads don't survive forking, so check that the dispatchers were
+        # started in this process
+        self._dispatchers_pid: Optional[int] = None
+        self._dispatchers_lock = threading.Lock()
+
+    def enqueue(self, execution_id: str, user: str, job: dict) -> int:
+        """
+        Queues the job of the execution, to be passed to the dispatch function
+
+        :return: the number of executions of the user queued before this one
+        """
+        self.start_dispatchers()
+        # Claiming might take the user out of the waiting users, after
+        # finding their queue empty
+        with self._claim_lock():
+            pipeline = self.redis.pipeline()
+            pipeline.hset(_jobs_key(), execution_id, json.dumps(job))
+            pipeline.rpush(_user_queue_key(user), execution_id)
+            # Users already waiting keep their place
+            pipeline.zadd(_waiting_users_key(), {user: time.time()}, nx=True)
+            queue_length = pipeline.execute()[1]
+        return queue_length - 1
+
+    def get_statuses(self, execution_id: str) -> Iterator[dict]:
+        """Statuses of the dispatch of the execution, until it's over"""
+        index = 0
+        while True:
+            statuses = [
+                json.loads(str(s, 'utf-8')) for s in self.redis.lrange(
+                    _statuses_key(execution_id), index, -1)
+            ]
+            for status in statuses:
+                if status == _END:
+                    return
+                yield status
+            if len(statuses) == 0:
+                if index == 0 and not self._is_pending(execution_id):
+                    yield {'error': f'Execution {execution_id} is not queued'}
+                    return
+                time.sleep(self.poll_interval_in_seconds)
+            index += len(statuses)
+
+    def _is_pending(self, execution_id: str) -> bool:
+        # A claimed execution is in the dispatches before leaving the jobs,
+        # and back in the jobs before leaving the dispatches if it's requeued
+        pipeline = self.redis.pipeline()
+        pipeline.hexists(_jobs_key(), execution_id)
+        pipeline.hexists(_dispatches_key(), execution_id)
+        return any(pipeline.execute())
+
+    def start_dispatchers(self) -> None:
+        with self._dispatchers_lock:
+            if self._dispatchers_pid == os.getpid():
+                return
+            self._dispatchers_pid = os.getpid()
+            for _ in range(self.dispatchers_per_process):
+                threading.Thread(target=self._dispatch_forever,
+                                 daemon=True).start()
+
+    def _dispatch_forever(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                execution_id = self._claim()
+                if execution_id is not None:
+                    self._dispatch(execution_id)
+                    continue
+            except Exception:
+                log.exception('Exception dispatching executions')
+            # Don't have all dispatchers polling at the same time
+            time.sleep(self.poll_interval_in_seconds *
+                       random.uniform(0.5, 1.5))
+
+    def _claim(self) -> Optional[str]:
+        # Cheap check before getting the lock. Dispatches need checking even
+        # if nobody is waiting, as stale ones might need queueing again
+        pipeline = self.redis.pipeline()
+        pipeline.zcard(_waiting_users_key())
+        pipeline.hlen(_dispatches_key())
+        if not any(pipeline.execute()):
+            return None
+        with self._claim_lock():
+            dispatches = self._live_dispatches()
+            if len(dispatches) >= self.max_concurrent_dispatches:
+                return None
+            dispatches_per_user = {}
+            for dispatch in dispatches.values():
+                user = dispatch['user']
+                dispatches_per_user[user] = \
+                    dispatches_per_user.get(user, 0) + 1
+            waiting_users = [(str(user, 'utf-8'), waiting_since)
+                             for user, waiting_since in self.redis.zrange(
+                                 _waiting_users_key(), 0, -1, withscores=True)]
+            candidates = [(dispatches_per_user.get(user,
+                                                   0), waiting_since, user)
+                          for user, waiting_since in waiting_users
+                          if dispatches_per_user.get(user, 0) <
+                          self.max_concurrent_dispatches_per_user]
+            if len(candidates) == 0:
+                return None
+            _, _, user = min(candidates)
+            execution_id = self.redis.lpop(_user_queue_key(user))
+            # Users go to the back once served
+            if self.redis.llen(_user_queue_key(user)) == 0:
+                self.redis.zrem(_waiting_users_key(), user)
+            else:
+                self.redis.zadd(_waiting_users_key(), {user: time.time()})
+            if execution_id is None:
+                return None
+            execution_id = str(execution_id, 'utf-8')
+            self._heartbeat(execution_id, user)
+            return execution_id
+
+    def _claim_lock(self):
+        return self.redis.lock(f'lock:{__name__}#claim',
+                               timeout=_CLAIM_LOCK_TIMEOUT_SECONDS)
+
+    def _live_dispatches(self) -> Dict[str, dict]:
+        dispatches = {}
+        now = time.time()
+        for execution_id, dispatch in self.redis.hgetall(
+                _dispatches_key()).items():
+            execution_id = str(execution_id, 'utf-8')
+            dispatch = json.loads(str(dispatch, 'utf-8'))
+            if now - dispatch['heartbeat'] > _DISPATCH_STALE_AFTER_SECONDS:
+                self._drop_stale_dispatch(execution_id, dispatch['user'])
+                continue
+            dispatches[execution_id] = dispatch
+        return dispatches
+
+    def _drop_stale_dispatch(self, execution_id: str, user: str):
+        # The job is kept until the dispatch reports something
+        if self.redis.hexists(_jobs_key(), execution_id):
+            log.warning(f'Dispatch of {execution_id} is stale, queueing it '
+                        f'again')
+            pipeline = self.redis.pipeline()
+            pipeline.lpush(_user_queue_key(user), execution_id)
+            pipeline.zadd(_waiting_users_key(), {user: time.time()}, nx=True)
+            pipeline.hdel(_dispatches_key(), execution_id)
+            pipeline.execute()
+            return
+        log.warning(f'Dispatch of {execution_id} is stale')
+        self.redis.hdel(_dispatches_key(), execution_id)
+        self._add_status(execution_id,
+                         {'error': 'The controller dispatching it went away'})
+        self._add_status(execution_id, _END)
+
+    def _heartbeat(self, execution_id: str, user: str):
+        self.redis.hset(_dispatches_key(), execution_id,
+                        json.dumps({
+                            'user': user,
+                            'heartbeat': time.time()
+                        }))
+
+    def _dispatch(self, execution_id: str):
+        job = json.loads(
+            str(self.redis.hget(_jobs_key(), execution_id), 'utf-8'))
+        user = job['user']
+        log.info(f'Dispatching {execution_id} of {user}')
+        # Getting an instance can block for long without reporting anything
+        # (for instance, pulling a snapshot)
+        done = threading.Event()
+        heartbeats = threading.Thread(target=self._heartbeat_until,
+                                      args=(execution_id, user, done),
+                                      daemon=True)
+        heartbeats.start()
+        is_job_stored = True
+        try:
+            for status in self.dispatch(job):
+                self._add_status(execution_id, status)
+                if is_job_stored:
+                    # It might have instances now, so it can't be requeued
+                    self.redis.hdel(_jobs_key(), execution_id)
+                    is_job_stored = False
+        except Exception as e:
+            log.exception(f'Exception dispatching {execution_id}')
+            self._add_status(execution_id, {'error': str(e)})
+        finally:
+            # Stop the heartbeats first, so that they don't store the
+            # dispatch again
+            done.set()
+            heartbeats.join()
+            # Followers find it pending or finished at any time
+            self._add_status(execution_id, _END)
+            pipeline = self.redis.pipeline()
+            pipeline.hdel(_jobs_key(), execution_id)
+            pipeline.hdel(_dispatches_key(), execution_id)
+            pipeline.execute()
+
+    def _heartbeat_until(self, execution_id: str, user: str,
+                         done: threading.Event):
+        while not done.wait(_DISPATCH_HEARTBEAT_SECONDS):
+            # noinspection PyBroadException
+            try:
+                self._heartbeat(execution_id, user)
+            except Exception:
+                log.exception(f'Exception refreshing the heartbeat of '
+                              f'{execution_id}')
+
+    def _add_status(self, execution_id: str, status: dict):
+        pipeline = self.redis.pipeline()
+        pipeline.rpush(_statuses_key(execution_id), json.dumps(status))
+        pipeline.expire(_statuses_key(execution_id), _STATUSES_EXPIRY_SECONDS)
+        pipeline.execute()
+
+
+def _jobs_key() -> str:
+    return f'key:{__name__}#jobs'
+
+
+def _user_queue_key(user: str) -> str:
+    return f'key:{__name__}#queue:{user}'
+
+
+def _waiting_users_key() -> str:
+    return f'key:{__name__}#waiting_users'
+
+
+def _dispatches_key() -> str:
+    return f'key:{__name__}#dispatches'
+
+
+def _statuses_key(execution_id: str) -> str:
+    return f'key:{__name__}#statuses:{execution_id}'
@@ -1,3 +1,4 @@
+from .base_image_pulls import BaseImagePulls  # noqa: F401 (unused)
 from .ecr import ECRImages  # noqa: F401 (unused)
 from .images_base import Images  # noqa: F401 (unused)
 from .local import LocalImages  # noqa: F401 (unused)
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import docker
+import docker.errors
+import docker.utils
+
+log = logging.getLogger(__name__)
+
+
+class BaseImagePulls:
+    """
+    Decides whether snapshot builds pull the images they start from.
+
+    With the `if_older_than` policy, the digest of each base image in the
+    registry is checked at most once in the time to live, and the image is
+    pulled only when it's missing in the host or its digest changed. The
+    digests are shared by the images of all hosts, so that a host building
+    for the first time doesn't check the registry again
+    """
+    ALWAYS = 'always'
+    IF_OLDER_THAN = 'if_older_than'
+    NEVER = 'never'
+    POLICIES = (ALWAYS, IF_OLDER_THAN, NEVER)
+
+    def __init__(self, policy: str = ALWAYS, ttl_in_minutes: float = 60):
+        if policy not in BaseImagePulls.POLICIES:
+            raise ValueError(f'Invalid base image pull policy: {policy}')
+        self.policy = policy
+        self.ttl_in_minutes = ttl_in_minutes
+        # Time of the check and digest in the registry, by image
+        self._remote_digests: Dict[str, Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, docker_api_client: docker.APIClient,
+                base_images: Optional[List[str]]) -> bool:
+        """
+        Pulls the base images that need it.
+
+        :param base_images: the images the build starts from, or None if
+            they aren't known
+        :return: whether `docker build` should pull the base images itself
+        """
+        if self.policy == BaseImagePulls.NEVER:
+            # Images that aren't in the host are still pulled by the build
+            return False
+        if self.policy == BaseImagePulls.ALWAYS or base_images is None:
+            return True
+        for image in base_images:
+            if self._is_outdated(docker_api_client, image):
+                _pull(docker_api_client, image)
+        return False
+
+    def _is_outdated(self, docker_api_client: docker.APIClient,
+                     image: str) -> bool:
+        try:
+            local_digests = [
+                d.split('@')[-1] for d in docker_api_client.inspect_image(
+                    image).get('RepoDigests') or []
+            ]
+        except docker.errors.ImageNotFound:
+            return True
+        if '@' in image:
+            # Pinned images don't change
+            return False
+        remote_digest = self._get_remote_digest(docker_api_client, image)
+        return remote_digest is not None \
+            and remote_digest not in local_digests
+
+    def _get_remote_digest(self, docker_api_client: docker.APIClient,
+                           image: str) -> Optional[str]:
+        with self._lock:
+            checked = self._remote_digests.get(image)
+        if checked is not None \
+                and time.time() - checked[0] < self.ttl_in_minutes * 60:
+            return checked[1]
+        try:
+            remote_digest = docker_api_client.inspect_distribution(
+                image)['Descriptor']['digest']
+        except docker.errors.APIError as e:
+            # Build with the image in the host, rather than failing
+            log.warning(f'Couldn\'t check the digest of {image}: {e}')
+            remote_digest = None
+        with self._lock:
+            self._remote_digests[image] = (time.time(), remote_digest)
+        return remote_digest
+
+
+def _pull(docker_api_client: docker.APIClient, image: str) -> None:
+    log.info(f'Pulling base image {image}')
+    repository, tag = docker.utils.parse_repository_tag(image)
+    if tag is None:
+        tag = 'latest'
+    for message in docker_api_client.pull(repository,
+                                          tag=tag,
+                                          stream=True,
+                                          decode=True):
+        if 'error' in message:
+            raise docker.errors.APIError(message['error'])
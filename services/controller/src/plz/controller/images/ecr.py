@@ -1,12 +1,17 @@
 import base64
 import json
 import logging
+import threading
 import time
-from typing import Any, BinaryIO, Callable, Iterator
+from typing import Any, BinaryIO, Callable, Iterator, List, Optional, \
+    Tuple
 
 import docker
-from requests.exceptions import ChunkedEncodingError, ConnectionError
+import docker.errors
+from botocore.exceptions import ClientError
 
+from plz.controller.builds import BuildTimings
+from plz.controller.images.base_image_pulls import BaseImagePulls
 from plz.controller.images.images_base import Images
 
 log = logging.getLogger(__name__)
@@ -17,14 +22,25 @@ class ECRImages(Images):
                  docker_api_client_creator: Callable[[], docker.APIClient],
                  ecr_client_creator: Callable[[], Any],
                  repository_without_registry: str,
-                 login_validity_in_minutes: int):
+                 login_validity_in_minutes: int,
+                 registry: Optional[str] = None,
+                 authorization: Optional['ECRAuthorization'] = None,
+                 base_image_pulls: Optional[BaseImagePulls] = None):
         self.ecr_client_creator = ecr_client_creator
-        self.ecr_client = self.ecr_client_creator()
         self.repository_without_registry = repository_without_registry
-        self.registry = self._get_registry(self.ecr_client,
-                                           repository_without_registry)
+        # Images for other hosts share the registry and the authorization,
+        # so that they don't need to ask AWS for them
+        if registry is None:
+            registry = self._get_registry(self.ecr_client_creator(),
+                                          repository_without_registry)
+        self.registry = registry
+        if authorization is None:
+            authorization = ECRAuthorization(ecr_client_creator,
+                                             login_validity_in_minutes)
+        self.authorization = authorization
         repository = f'{self.registry}/{repository_without_registry}'
-        super().__init__(docker_api_client_creator, repository)
+        super().__init__(docker_api_client_creator, repository,
+                         base_image_pulls)
         self.last_login_time = None
         self.login_validity_in_minutes = login_validity_in_minutes
 
@@ -35,40 +51,60 @@ class ECRImages(Images):
         return ECRImages(new_docker_api_client_creator,
                          self.ecr_client_creator,
                          self.repository_without_registry,
-                         self.login_validity_in_minutes)
+                         self.login_validity_in_minutes,
+                         registry=self.registry,
+                         authorization=self.authorization,
+                         base_image_pulls=self.base_image_pulls)
 
-    def build(self, fileobj: BinaryIO, tag: str) -> Iterator[bytes]:
+    def build(self,
+              fileobj: BinaryIO,
+              tag: str,
+              base_images: Optional[List[str]] = None,
+              cache_from: Optional[str] = None,
+              timings: Optional[BuildTimings] = None) -> Iterator[bytes]:
         self._login()
-        return self._build(fileobj, tag)
+        return self._build(fileobj, tag, base_images, cache_from, timings)
 
     def push(self,
              tag: str,
              log_level: int = logging.DEBUG,
              log_progress: bool = False):
         self._login()
-        self._log_output(
-            'Push',
-            self.docker_api_client.push(repository=self.repository,
-                                        tag=tag,
-                                        stream=True), log_level, log_progress)
+        stream = self.docker_api_client.push(repository=self.repository,
+                                             tag=tag,
+                                             stream=True)
+        self._log_output('Push',
+                         stream,
+                         log_level,
+                         log_progress,
+                         raise_on_error=True)
 
     def pull(self, tag: str):
-        self._login()
+        # Passing the credentials instead of logging in saves a request to
+        # the registry for each host
+        username, password = self.authorization.get_credentials()
         self._log_output(
-            'Push',
+            'Pull',
             self.docker_api_client.pull(repository=self.repository,
                                         tag=tag,
-                                        stream=True))
+                                        stream=True,
+                                        auth_config={
+                                            'username': username,
+                                            'password': password
+                                        }))
 
-    def can_pull(self, times: int) -> bool:
+    def has_image(self, tag: str) -> bool:
         try:
-            for _ in range(times):
-                self.docker_api_client.pull('hello-world')
-                log.debug('Could pull image')
+            self.ecr_client_creator().describe_images(
+                repositoryName=self.repository_without_registry,
+                imageIds=[{
+                    'imageTag': tag
+                }])
             return True
-        except (ChunkedEncodingError, ConnectionError):
-            log.debug('Couldn\'t pull image')
-            return False
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ImageNotFoundException':
+                return False
+            raise
 
     def _login(self) -> None:
         if self.last_login_time:
@@ -83,12 +119,7 @@ class ECRImages(Images):
         # which suggests that the problem is with the state of the (clients
         # of the) controller.
         self.docker_api_client = self.docker_api_client_creator()
-        self.ecr_client = self.ecr_client_creator()
-        authorization_token = self.ecr_client.get_authorization_token()
-        authorization_data = authorization_token['authorizationData']
-        encoded_token = authorization_data[0]['authorizationToken']
-        token = base64.b64decode(encoded_token).decode('utf-8')
-        username, password = token.split(':')
+        username, password = self.authorization.get_credentials()
         self.docker_api_client.login(username=username,
                                      password=password,
                                      registry=self.registry)
@@ -104,7 +135,8 @@ class ECRImages(Images):
     def _log_output(label: str,
                     stream: Iterator[bytes],
                     log_level: int = logging.DEBUG,
-                    log_progress: bool = False):
+                    log_progress: bool = False,
+                    raise_on_error: bool = False):
         for message_bytes in stream:
             message_str = message_bytes.decode('utf-8').strip()
             try:
@@ -115,3 +147,36 @@ class ECRImages(Images):
                     log.log(log_level, f'{label}: {message_str}')
             except json.JSONDecodeError:
                 log.debug(f'{label}: {message_str}')
+                continue
+            if raise_on_error and 'error' in message_json:
+                raise docker.errors.APIError(message_json['error'])
+
+
+class ECRAuthorization:
+    """Credentials for the registry, shared by the images of all hosts"""
+
+    def __init__(self, ecr_client_creator: Callable[[], Any],
+                 validity_in_minutes: int):
+        self.ecr_client_creator = ecr_client_creator
+        self.validity_in_minutes = validity_in_minutes
+        self._credentials: Optional[Tuple[str, str]] = None
+        self._last_retrieval_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get_credentials(self) -> Tuple[str, str]:
+        """:return: user name and password"""
+        with self._lock:
+            if self._last_retrieval_time is not None and \
+                    time.time() - self._last_retrieval_time < \
+                    self.validity_in_minutes * 60:
+                return self._credentials
+            log.debug('Getting ECR authorization token')
+            authorization_token = \
+                self.ecr_client_creator().get_authorization_token()
+            authorization_data = authorization_token['authorizationData']
+            encoded_token = authorization_data[0]['authorizationToken']
+            token = base64.b64decode(encoded_token).decode('utf-8')
+            username, password = token.split(':')
+            self._credentials = (username, password)
+            self._last_retrieval_time = time.time()
+            return self._credentials
@@ -1,13 +1,19 @@
 import collections
 import json
 import logging
+import re
 import time
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Callable, Iterator
+from typing import BinaryIO, Callable, Iterator, List, Optional
 
 import docker
+import docker.errors
 
 from plz.controller.api.exceptions import JSONResponseException
+from plz.controller.builds import BuildTimings
+from plz.controller.images.base_image_pulls import BaseImagePulls
+
+DOCKERFILE_NAME = 'plz.Dockerfile'
 
 Metadata = collections.namedtuple('Metadata', ['user', 'project', 'timestamp'])
 
@@ -17,13 +23,27 @@ log = logging.getLogger(__name__)
 class Images(ABC):
     def __init__(self,
                  docker_api_client_creator: Callable[[], docker.APIClient],
-                 repository: str):
+                 repository: str,
+                 base_image_pulls: Optional[BaseImagePulls] = None):
         self.docker_api_client_creator = docker_api_client_creator
         self.docker_api_client = docker_api_client_creator()
         self.repository = repository
+        if base_image_pulls is None:
+            base_image_pulls = BaseImagePulls()
+        self.base_image_pulls = base_image_pulls
 
     @staticmethod
     def construct_tag(image_metadata: dict) -> str:
+        """
+        Tags of snapshots with a digest of their build context are the same
+        for the same context, so that they're built only once
+        """
+        context_digest = image_metadata.get('context_digest')
+        if context_digest is not None:
+            if not _is_digest(context_digest):
+                raise ValueError(f'Invalid context digest: {context_digest}')
+            return f'{image_metadata["user"]}-{image_metadata["project"]}-' \
+                   f'{context_digest}'
         timestamp = str(int(time.time() * 1000))
         metadata = Metadata(image_metadata['user'], image_metadata['project'],
                             timestamp)
@@ -34,7 +54,17 @@ class Images(ABC):
         pass
 
     @abstractmethod
-    def build(self, fileobj: BinaryIO, tag: str) -> Iterator[bytes]:
+    def build(self,
+              fileobj: BinaryIO,
+              tag: str,
+              base_images: Optional[List[str]] = None,
+              cache_from: Optional[str] = None,
+              timings: Optional[BuildTimings] = None) -> Iterator[bytes]:
+        """
+        :param base_images: the images the build starts from, if known
+        :param cache_from: tag of a snapshot whose layers can be reused
+        :param timings: where to record the time taken by each stage
+        """
         pass
 
     @abstractmethod
@@ -46,30 +76,72 @@ class Images(ABC):
         pass
 
     @abstractmethod
-    def can_pull(self, times: int) -> bool:
+    def has_image(self, tag: str) -> bool:
+        """Whether the image is there for instances to run it"""
         pass
 
-    def _build(self, fileobj: BinaryIO, tag: str) -> Iterator[bytes]:
-        builder = self.docker_api_client.build(fileobj=fileobj,
-                                               custom_context=True,
-                                               encoding='bz2',
-                                               dockerfile='plz.Dockerfile',
-                                               rm=True,
-                                               tag=f'{self.repository}:{tag}',
-                                               pull=True)
-        for message_bytes in builder:
+    def _build(self,
+               fileobj: BinaryIO,
+               tag: str,
+               base_images: Optional[List[str]] = None,
+               cache_from: Optional[str] = None,
+               timings: Optional[BuildTimings] = None) -> Iterator[bytes]:
+        if timings is None:
+            timings = BuildTimings()
+        with timings.stage('base_images'):
+            pull = self.base_image_pulls.prepare(self.docker_api_client,
+                                                 base_images)
+        with timings.stage('cache'):
+            cache_from_images = self._cache_from(cache_from)
+        with timings.stage('build'):
+            builder = self.docker_api_client.build(
+                fileobj=fileobj,
+                custom_context=True,
+                encoding='bz2',
+                dockerfile=DOCKERFILE_NAME,
+                rm=True,
+                tag=f'{self.repository}:{tag}',
+                pull=pull,
+                cache_from=cache_from_images)
+            for message_bytes in builder:
+                try:
+                    message_str = message_bytes.decode('utf-8').strip()
+                    message_json = json.loads(message_str)
+                    # Ignore progress indicators because they're too noisy
+                    if 'progress' not in message_json:
+                        log.debug('Build: ' + message_str)
+                    self._raise_on_error_in_json(message_str, message_json)
+                except UnicodeDecodeError:
+                    pass
+                except json.JSONDecodeError:
+                    pass
+                yield message_bytes
+
+    def _cache_from(self, tag: Optional[str]) -> List[str]:
+        """
+        :return: the snapshot to take layers from, pulled if it's not in the
+            host, or nothing if it can't be had
+        """
+        if tag is None:
+            return []
+        if not self.is_in_host(tag):
+            # noinspection PyBroadException
             try:
-                message_str = message_bytes.decode('utf-8').strip()
-                message_json = json.loads(message_str)
-                # Ignore progress indicators because they're too noisy
-                if 'progress' not in message_json:
-                    log.debug('Build: ' + message_str)
-                self._raise_on_error_in_json(message_str, message_json)
-            except UnicodeDecodeError:
-                pass
-            except json.JSONDecodeError:
-                pass
-            yield message_bytes
+                self.pull(tag)
+            except Exception:
+                log.warning(f'Couldn\'t pull {tag} to use as build cache',
+                            exc_info=True)
+            if not self.is_in_host(tag):
+                return []
+        return [f'{self.repository}:{tag}']
+
+    def is_in_host(self, tag: str) -> bool:
+        """Whether the docker host has the image, so that it's not pulled"""
+        try:
+            self.docker_api_client.inspect_image(f'{self.repository}:{tag}')
+            return True
+        except docker.errors.ImageNotFound:
+            return False
 
     @staticmethod
     def _raise_on_error_in_json(message_str: str, message_json: dict):
@@ -77,5 +149,31 @@ class Images(ABC):
             raise ImageBuildError(message_str)
 
 
+def base_images_of(dockerfile: str) -> Optional[List[str]]:
+    """
+    :return: the images the stages of the Dockerfile start from, or None if
+        they can't be told without building, as when they use arguments
+    """
+    stages = set()
+    images = []
+    for line in re.sub(r'\\\n', ' ', dockerfile).splitlines():
+        words = line.split()
+        if len(words) == 0 or words[0].upper() != 'FROM':
+            continue
+        words = [w for w in words[1:] if not w.startswith('--')]
+        if len(words) == 0 or '$' in words[0]:
+            return None
+        image = words[0]
+        if image.lower() not in stages and image != 'scratch':
+            images.append(image)
+        if len(words) >= 3 and words[1].upper() == 'AS':
+            stages.add(words[2].lower())
+    return images
+
+
+def _is_digest(s: str) -> bool:
+    return re.fullmatch('[0-9a-f]{64}', s) is not None
+
+
 class ImageBuildError(JSONResponseException):
     pass
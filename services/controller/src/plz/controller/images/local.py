@@ -1,24 +1,34 @@
-from typing import BinaryIO, Callable, Iterator
+from typing import BinaryIO, Callable, Iterator, List, Optional
 
 import docker
 
+from plz.controller.builds import BuildTimings
+from plz.controller.images.base_image_pulls import BaseImagePulls
 from plz.controller.images.images_base import Images
 
 
 class LocalImages(Images):
     def __init__(self,
                  docker_api_client_creator: Callable[[], docker.APIClient],
-                 repository: str):
-        super().__init__(docker_api_client_creator, repository)
-
-    def build(self, fileobj: BinaryIO, tag: str) -> Iterator[bytes]:
-        return self._build(fileobj, tag)
+                 repository: str,
+                 base_image_pulls: Optional[BaseImagePulls] = None):
+        super().__init__(docker_api_client_creator, repository,
+                         base_image_pulls)
+
+    def build(self,
+              fileobj: BinaryIO,
+              tag: str,
+              base_images: Optional[List[str]] = None,
+              cache_from: Optional[str] = None,
+              timings: Optional[BuildTimings] = None) -> Iterator[bytes]:
+        return self._build(fileobj, tag, base_images, cache_from, timings)
 
     def for_host(self, docker_url: str) -> 'LocalImages':
         def new_docker_api_client_creator():
             return docker.APIClient(base_url=docker_url)
 
-        return LocalImages(new_docker_api_client_creator, self.repository)
+        return LocalImages(new_docker_api_client_creator, self.repository,
+                           self.base_image_pulls)
 
     def push(self, tag: str):
         pass
@@ -26,5 +36,5 @@ class LocalImages(Images):
     def pull(self, tag: str):
         pass
 
-    def can_pull(self, _) -> bool:
-        return True
+    def has_image(self, tag: str) -> bool:
+        return self.is_in_host(tag)
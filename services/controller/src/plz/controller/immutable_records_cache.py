@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, TypeVar
+
+T = TypeVar('T')
+
+
+class ImmutableRecord:
+    """
+    Kinds of records that never change once written, and therefore can be
+    cached. Records such as the status of a running execution must not be
+    added here
+    """
+    START_METADATA = 'start_metadata'
+    COMPOSITION_INDEX_RANGES = 'composition_index_ranges'
+    USER_OF_EXECUTION = 'user_of_execution'
+    # Only set once the execution has finished
+    FINISHED = 'finished'
+    EXIT_STATUS = 'exit_status'
+    STORED_METADATA = 'stored_metadata'
+
+    ALL = {
+        START_METADATA, COMPOSITION_INDEX_RANGES, USER_OF_EXECUTION, FINISHED,
+        EXIT_STATUS, STORED_METADATA
+    }
+
+
+class ImmutableRecordsCache:
+    """
+    Bounded LRU cache for records that don't change once written. It's
+    in-process, so each worker of the controller has its own
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self,
+            kind: str,
+            key: str,
+            retrieve: Callable[[], T],
+            should_cache: Callable[[T], bool] = lambda _: True) -> T:
+        """
+        Returns the cached record, retrieving it if needed. Retrieved records
+        are cached only if `should_cache` holds for them (for instance, the
+        record might not have been written yet).
+
+        Callers must not modify the records they get
+        """
+        return self.get_all(
+            kind, [key], lambda keys: {key: retrieve()
+                                       for key in keys}, should_cache)[key]
+
+    def get_all(self,
+                kind: str,
+                keys: List[str],
+                retrieve_all: Callable[[List[str]], Dict[str, T]],
+                should_cache: Callable[[T], bool] = lambda _: True) \
+            -> Dict[str, T]:
+        """Like `get`, but retrieves all missing records at once"""
+        if kind not in ImmutableRecord.ALL:
+            raise ValueError(f'Records of kind {kind} cannot be cached')
+        records = {}
+        missing_keys = []
+        with self._lock:
+            for key in keys:
+                entry_key = (kind, key)
+                if entry_key in self._entries:
+                    self._entries.move_to_end(entry_key)
+                    records[key] = self._entries[entry_key]
+                    self._hits += 1
+                else:
+                    missing_keys.append(key)
+                    self._misses += 1
+        if len(missing_keys) == 0:
+            return records
+        retrieved = retrieve_all(missing_keys)
+        with self._lock:
+            for key, record in retrieved.items():
+                if should_cache(record):
+                    self._entries[(kind, key)] = record
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        records.update(retrieved)
+        return records
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / requests if requests > 0 else None
+            }
@@ -0,0 +1,139 @@
+import io
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from redis import StrictRedis
+
+from plz.controller.volumes import VolumeArchive, Volumes
+
+log = logging.getLogger(__name__)
+
+# Hosts don't live that long. Records of what they hold expire after this
+# time without being updated, so that they don't pile up
+_RECORDS_EXPIRY_SECONDS = 7 * 24 * 60 * 60
+# Transferring and extracting a big input takes a while, but the lock
+# shouldn't be held forever if the controller dies while holding it
+_INPUT_LOCK_TIMEOUT_SECONDS = 60 * 60
+_EVICTION_LOCK_TIMEOUT_SECONDS = 5 * 60
+
+
+class InputVolumeCache:
+    """
+    Keeps the input data extracted in volumes of a docker host, so that
+    executions with the same input don't transfer and extract it again.
+
+    Inputs are content-addressed, so a volume never changes once populated.
+    When the cached inputs exceed the size budget, the least recently used
+    ones that no container is using are removed
+    """
+    VOLUME_PREFIX = 'plz-input-'
+
+    def __init__(self, volumes: Volumes, redis: StrictRedis, host_id: str,
+                 max_size_in_bytes: int):
+        self.volumes = volumes
+        self.redis = redis
+        self.host_id = host_id
+        self.max_size_in_bytes = max_size_in_bytes
+
+    @contextmanager
+    def volume_for(self, input_id: str,
+                   input_stream: BinaryIO) -> Iterator[str]:
+        """
+        Name of the volume with the input, populated from the stream if it's
+        not cached. The volume is not evicted while inside the context, so
+        start the containers using it there
+        """
+        volume_name = self.VOLUME_PREFIX + input_id
+        with self.redis.lock(self._input_lock_name(input_id),
+                             timeout=_INPUT_LOCK_TIMEOUT_SECONDS):
+            # Docker creates volumes when mounting them if they don't exist,
+            # so it might be there but empty
+            if self.redis.zscore(self.cached_inputs_key(self.host_id),
+                                 input_id) is not None \
+                    and self.volumes.exists(volume_name):
+                log.debug(f'Input {input_id} cached in {self.host_id}')
+            else:
+                log.debug(f'Caching input {input_id} in {self.host_id}')
+                self.volumes.remove(volume_name)
+                self.volumes.create(volume_name, [VolumeArchive(input_stream)])
+                self.redis.hset(self._sizes_key, input_id,
+                                _stream_size(input_stream))
+            self._touch(input_id)
+            yield volume_name
+        self._evict()
+
+    def _touch(self, input_id: str):
+        pipeline = self.redis.pipeline()
+        pipeline.zadd(self.cached_inputs_key(self.host_id),
+                      {input_id: time.time()})
+        pipeline.expire(self.cached_inputs_key(self.host_id),
+                        _RECORDS_EXPIRY_SECONDS)
+        pipeline.expire(self._sizes_key, _RECORDS_EXPIRY_SECONDS)
+        pipeline.execute()
+
+    def _evict(self):
+        lock = self.redis.lock(f'lock:{__name__}#eviction:{self.host_id}',
+                               timeout=_EVICTION_LOCK_TIMEOUT_SECONDS)
+        # Whoever has the lock is evicting already
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            sizes = {
+                str(input_id, 'utf-8'): int(size)
+                for input_id, size in self.redis.hgetall(
+                    self._sizes_key).items()
+            }
+            total_size = sum(sizes.values())
+            least_recently_used_first = [
+                str(input_id, 'utf-8') for input_id in self.redis.zrange(
+                    self.cached_inputs_key(self.host_id), 0, -1)
+            ]
+            for input_id in least_recently_used_first:
+                if total_size <= self.max_size_in_bytes:
+                    break
+                if self._evict_input(input_id):
+                    total_size -= sizes.get(input_id, 0)
+        finally:
+            lock.release()
+
+    def _evict_input(self, input_id: str) -> bool:
+        input_lock = self.redis.lock(self._input_lock_name(input_id),
+                                     timeout=_EVICTION_LOCK_TIMEOUT_SECONDS)
+        # Someone is about to start a container with it
+        if not input_lock.acquire(blocking=False):
+            return False
+        try:
+            # Docker refuses to remove volumes that containers are using
+            if not self.volumes.remove_if_unused(self.VOLUME_PREFIX +
+                                                 input_id):
+                return False
+            log.debug(f'Evicted input {input_id} from {self.host_id}')
+            pipeline = self.redis.pipeline()
+            pipeline.zrem(self.cached_inputs_key(self.host_id), input_id)
+            pipeline.hdel(self._sizes_key, input_id)
+            pipeline.execute()
+            return True
+        finally:
+            input_lock.release()
+
+    @staticmethod
+    def cached_inputs_key(host_id: str) -> str:
+        """Sorted set of the inputs in the host, by time of last use"""
+        return f'key:{__name__}#cached_inputs:{host_id}'
+
+    @property
+    def _sizes_key(self) -> str:
+        return f'key:{__name__}#sizes:{self.host_id}'
+
+    def _input_lock_name(self, input_id: str) -> str:
+        return f'lock:{__name__}#input:{self.host_id}:{input_id}'
+
+
+def _stream_size(stream: BinaryIO) -> int:
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, io.UnsupportedOperation):
+        return stream.seek(0, io.SEEK_END)
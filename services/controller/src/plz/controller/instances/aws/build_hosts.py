@@ -0,0 +1,33 @@
+from redis import StrictRedis
+
+# Builds taking longer than this are taken as abandoned, as when the
+# controller process died while building
+_BUILD_EXPIRY_SECONDS = 2 * 60 * 60
+
+
+class BuildHosts:
+    """
+    Idle instances in which snapshots are being built, so that they aren't
+    picked for two builds at once, nor disposed of while building
+    """
+
+    def __init__(self, redis: StrictRedis):
+        self.redis = redis
+
+    def claim(self, instance_id: str, snapshot_id: str) -> bool:
+        """:return: whether the instance wasn't building already"""
+        return bool(
+            self.redis.set(_building_key(instance_id),
+                           snapshot_id,
+                           ex=_BUILD_EXPIRY_SECONDS,
+                           nx=True))
+
+    def release(self, instance_id: str) -> None:
+        self.redis.delete(_building_key(instance_id))
+
+    def is_building(self, instance_id: str) -> bool:
+        return self.redis.exists(_building_key(instance_id)) > 0
+
+
+def _building_key(instance_id: str) -> str:
+    return f'key:{__name__}#building:{instance_id}'
@@ -2,20 +2,33 @@ import io
 import logging
 import os.path
 import time
-from typing import Dict, Iterator, Optional, Tuple
+from typing import Callable, Dict, Iterator, Optional, Tuple
 
 from redis import StrictRedis
 
 from plz.controller.containers import ContainerState, Containers
 from plz.controller.images import Images
+from plz.controller.input_volume_cache import InputVolumeCache
 from plz.controller.instances.docker import DockerInstance
 from plz.controller.instances.instance_base import ExecutionInfo, Instance, \
     KillingInstanceException, Parameters
+from plz.controller.instances.resources import Resources, requirements_of
 from plz.controller.results import ResultsStorage
 from plz.controller.volumes import Volumes
+from .build_hosts import BuildHosts
+from .slots import Slot, SlotTable, has_room
+from .snapshot_pushes import SnapshotPushes
 
 log = logging.getLogger(__name__)
 
+# Statuses of spot requests whose instances were taken away by AWS
+_SPOT_INTERRUPTION_STATUSES = {
+    'instance-terminated-by-price', 'instance-terminated-no-capacity',
+    'instance-terminated-capacity-oversubscribed',
+    'instance-terminated-launch-group-constraint'
+}
+_SPOT_INTERRUPTION_STATE_REASON = 'Server.SpotInstanceTermination'
+
 
 class EC2Instance(Instance):
     ROOT = os.path.join(os.path.dirname(__file__), '..', '..', '..')
@@ -32,23 +45,58 @@ class EC2Instance(Instance):
     # execution finishes, both the Execution-Id and the
     # Earmark-Execution-Id tags are empty, and instances can be reused by
     # other executions (or be disposed of by harvesting if the time has come)
+    #
+    # Executions that declare the resources they need can run alongside the
+    # one in the Execution-Id tag. All executions in an instance are in its
+    # slot table, and the instance is only free when the table is empty. When
+    # the execution in the tag finishes, the tag is passed on to another one
+    # in the table
     EXECUTION_ID_TAG = 'Plz:Execution-Id'
     GROUP_NAME_TAG = 'Plz:Group-Id'
     MAX_IDLE_SECONDS_TAG = 'Plz:Max-Idle-Seconds'
     IDLE_SINCE_TIMESTAMP_TAG = 'Plz:Idle-Since-Timestamp'
     EARMARK_EXECUTION_ID_TAG = 'Plz:Earmark-Execution-Id'
 
-    def __init__(self, client, images: Images, containers: Containers,
-                 volumes: Volumes, container_execution_id: str, data: dict,
-                 redis: StrictRedis, lock_timeout: int,
-                 container_idle_timestamp_grace: int):
+    def __init__(self,
+                 client,
+                 images: Images,
+                 containers: Containers,
+                 volumes: Volumes,
+                 container_execution_id: str,
+                 data: dict,
+                 redis: StrictRedis,
+                 lock_timeout: int,
+                 container_idle_timestamp_grace: int,
+                 slots: SlotTable,
+                 input_volume_cache_max_size_in_bytes: int = 0,
+                 runs_alongside: bool = False,
+                 snapshot_pushes: Optional[SnapshotPushes] = None,
+                 is_kept_in_warm_pool: Optional[Callable[[str], bool]] = None,
+                 packs_executions: bool = False):
         super().__init__(redis, lock_timeout)
         self.client = client
         self.images = images
+        self.data = data
+        self.slots = slots
+        # Whether the container is for an execution other than the one in the
+        # Execution-Id tag
+        self.runs_alongside = runs_alongside
+        self.snapshot_pushes = snapshot_pushes
+        # Whether idle instances of a type are needed to keep the warm pool
+        self.is_kept_in_warm_pool = is_kept_in_warm_pool
+        # Whether executions declaring their resources share the instance
+        self.packs_executions = packs_executions
+        self.build_hosts = BuildHosts(redis)
+        if input_volume_cache_max_size_in_bytes > 0:
+            input_volume_cache = InputVolumeCache(
+                volumes, redis, self.instance_id,
+                input_volume_cache_max_size_in_bytes)
+        else:
+            input_volume_cache = None
         self.delegate = DockerInstance(images, containers, volumes,
                                        container_execution_id, redis,
-                                       lock_timeout)
-        self.data = data
+                                       lock_timeout, input_volume_cache,
+                                       data['InstanceType'])
         self.container_idle_timestamp_grace = container_idle_timestamp_grace
 
     def run(self,
@@ -57,12 +105,16 @@ class EC2Instance(Instance):
             input_stream: Optional[io.BytesIO],
             docker_run_args: Dict[str, str],
             index_range_to_run: Optional[Tuple[int, int]],
-            max_idle_seconds: int = 60 * 30) -> None:
+            max_idle_seconds: int = 60 * 30,
+            input_id: Optional[str] = None,
+            user: Optional[str] = None) -> None:
         # Sanity check before we get the lock
         if self._get_earmark() != self.delegate.execution_id:
             raise InstanceUnavailableException(
                 'Trying to run in an instance that is not earmarked for this '
                 'execution!')
+        # Not holding the lock, as the push might take a while
+        needs_pull = self._wait_for_snapshot(snapshot_id)
         with self._lock:
             # Must be earmarked for this run
             if not self._is_running_and_free(
@@ -75,19 +127,106 @@ class EC2Instance(Instance):
                     f'free (executing [{self.get_execution_id()}] '
                     f'or earmarked for [{self._get_earmark()}] or '
                     f'not running)')
+            execution_id = self.delegate.execution_id
+            # Only executions packed together need to know what the others
+            # take
+            if self.packs_executions:
+                self._advertise_capacity_if_unknown()
+                self.slots.occupy(self.instance_id, execution_id, user,
+                                  requirements_of(docker_run_args))
+            try:
+                if needs_pull:
+                    self.images.pull(snapshot_id)
+                self.delegate.run(snapshot_id, parameters, input_stream,
+                                  docker_run_args, index_range_to_run,
+                                  input_id)
+            except Exception:
+                if self.packs_executions:
+                    self.slots.vacate(self.instance_id, execution_id)
+                raise
+            self._set_execution_id(execution_id, max_idle_seconds)
+
+    def run_alongside(self,
+                      snapshot_id: str,
+                      parameters: Parameters,
+                      input_stream: Optional[io.BytesIO],
+                      docker_run_args: Dict[str, str],
+                      index_range_to_run: Optional[Tuple[int, int]],
+                      user: str,
+                      max_occupants: int,
+                      input_id: Optional[str] = None) -> None:
+        """
+        Runs the execution next to the ones already running in the instance,
+        if there's room for it
+
+        :raises InstanceUnavailableException: if there isn't
+        """
+        execution_id = self.delegate.execution_id
+        requirements = requirements_of(docker_run_args)
+        needs_pull = self._wait_for_snapshot(snapshot_id)
+        with self._lock:
+            instance_slots = self.slots.get([self.instance_id
+                                             ])[self.instance_id]
+            if requirements is None or not self._is_running() \
+                    or not has_room(instance_slots, user, requirements,
+                                    max_occupants):
+                raise InstanceUnavailableException(
+                    f'No room for {execution_id} in {self.instance_id}')
+            self.slots.occupy(self.instance_id, execution_id, user,
+                              requirements)
+            try:
+                if needs_pull:
+                    self.images.pull(snapshot_id)
+                self.delegate.run(snapshot_id, parameters, input_stream,
+                                  docker_run_args, index_range_to_run,
+                                  input_id)
+            except Exception:
+                self.slots.vacate(self.instance_id, execution_id)
+                raise
+
+    def _advertise_capacity_if_unknown(self):
+        if self.slots.get([self.instance_id
+                           ])[self.instance_id].capacity is not None:
+            return
+        info = self.delegate.containers.docker_client.info()
+        self.slots.advertise_capacity(
+            self.instance_id,
+            Resources(cpus=info['NCPU'], memory_in_bytes=info['MemTotal']))
+
+    def prefetch(self, snapshot_id: str) -> bool:
+        """
+        Pulls the snapshot if the instance is idle, so that executions using
+        it start faster.
+
+        The instance isn't locked while pulling, as otherwise it couldn't be
+        earmarked in the meantime. Pulling concurrently with a run is fine
+
+        :return: whether the snapshot was pulled
+        """
+        if not self._is_running_and_free(
+                earmark='', check_running=True, earmark_optional=True):
+            return False
+        if self._wait_for_snapshot(snapshot_id):
             self.images.pull(snapshot_id)
-            self.delegate.run(snapshot_id, parameters, input_stream,
-                              docker_run_args, index_range_to_run)
-            self._set_execution_id(self.delegate.execution_id,
-                                   max_idle_seconds)
+        return True
 
-    def is_up(self, is_instance_newly_created: bool):
-        if not self._is_running():
+    def _wait_for_snapshot(self, snapshot_id: str) -> bool:
+        """
+        Waits until the snapshot can be pulled, if the instance doesn't have
+        it, as it might still be on its way to the registry
+
+        :return: whether the snapshot needs to be pulled
+        """
+        if self.images.is_in_host(snapshot_id):
             return False
-        return self.images.can_pull(5 if is_instance_newly_created else 1)
+        if self.snapshot_pushes is not None:
+            self.snapshot_pushes.wait_for(snapshot_id)
+        return True
 
     def kill(self, force_if_not_idle: bool):
-        if not force_if_not_idle and not self._is_idle(self.container_state()):
+        if not force_if_not_idle and (
+                not self._is_idle(self.container_state())
+                or len(self.slots.occupants(self.instance_id)) > 0):
             raise KillingInstanceException('Instance is not idle')
         try:
             self.client.terminate_instances(InstanceIds=[self.instance_id])
@@ -194,6 +333,8 @@ class EC2Instance(Instance):
         return int(get_tag(self.data, self.IDLE_SINCE_TIMESTAMP_TAG, '0'))
 
     def get_execution_id(self):
+        if self.runs_alongside:
+            return self.delegate.execution_id
         return get_tag(self.data, self.EXECUTION_ID_TAG, '')
 
     def get_instance_type(self):
@@ -202,6 +343,13 @@ class EC2Instance(Instance):
     def dispose_if_its_time(
             self, execution_info: Optional[ExecutionInfo] = None) \
             -> Optional[str]:
+        # Other executions are still running in the instance
+        if self.runs_alongside or \
+                len(self.slots.occupants(self.instance_id)) > 0:
+            return None
+        # A snapshot is being built in it
+        if self.build_hosts.is_building(self.instance_id):
+            return None
         if execution_info is not None:
             ei = execution_info
         else:
@@ -219,9 +367,13 @@ class EC2Instance(Instance):
         graced_timestamp = ei.idle_since_timestamp - \
             self.container_idle_timestamp_grace
         # In weird cases just dispose as well
-        if now - ei.idle_since_timestamp > ei.max_idle_seconds or \
-                graced_timestamp > now or \
-                ei.max_idle_seconds <= 0:
+        is_weird = graced_timestamp > now or ei.max_idle_seconds <= 0
+        if now - ei.idle_since_timestamp > ei.max_idle_seconds or is_weird:
+            if not is_weird and self.is_kept_in_warm_pool is not None \
+                    and self.is_kept_in_warm_pool(self.get_instance_type()):
+                log.debug(f'Keeping idle instance {self.instance_id} for the '
+                          'warm pool')
+                return None
             log.info(f'Disposing of instance {self.instance_id}. Now: {now}.'
                      f'Idle since: {ei.idle_since_timestamp}. '
                      f'Max idle seconds: {ei.max_idle_seconds}')
@@ -248,8 +400,15 @@ class EC2Instance(Instance):
                 idle_since_timestamp: int,
                 release_container: bool = True):
         with self._lock:
+            # Releasing the container forgets about the execution ID
+            execution_id = self.delegate.execution_id
             self.delegate.release(results_storage, idle_since_timestamp,
                                   release_container)
+            self.slots.vacate(self.instance_id, execution_id)
+            occupants = self.slots.occupants(self.instance_id)
+            if len(occupants) > 0:
+                self._pass_on_execution_id_tag(execution_id, occupants)
+                return
             self._set_tags([{
                 'Key': EC2Instance.EXECUTION_ID_TAG,
                 'Value': ''
@@ -258,10 +417,29 @@ class EC2Instance(Instance):
                 'Value': str(idle_since_timestamp)
             }])
 
+    def _pass_on_execution_id_tag(self, execution_id: str,
+                                  occupants: Dict[str, Slot]):
+        self.data = describe_instances(self.client,
+                                       [('instance-id', self.instance_id)])[0]
+        tagged_execution_id = get_tag(self.data, self.EXECUTION_ID_TAG, '')
+        if tagged_execution_id != execution_id \
+                and tagged_execution_id in occupants:
+            # It ran alongside the one in the tag, that's still running
+            return
+        next_execution_id = sorted(occupants)[0]
+        log.debug(f'Passing on the execution ID tag of {self.instance_id} '
+                  f'from [{execution_id}] to [{next_execution_id}]')
+        self._set_tags([{
+            'Key': EC2Instance.EXECUTION_ID_TAG,
+            'Value': next_execution_id
+        }])
+
     def _is_running_and_free(self, earmark: str, check_running: bool,
                              earmark_optional: bool):
         if check_running and not self._is_running():
             return False
+        if len(self.slots.occupants(self.instance_id)) > 0:
+            return False
         if earmark_optional:
             instances = get_aws_instances(
                 self.client,
@@ -296,6 +474,7 @@ class EC2Instance(Instance):
         # It seems AWS doesn't allow to delete an instance. We set the group
         # tag to empty so it won't be listed for a group anymore.
         self._set_tags([{'Key': EC2Instance.GROUP_NAME_TAG, 'Value': ''}])
+        self.slots.clear(self.instance_id)
 
     def get_forensics(self) -> dict:
         spot_requests = self.client.describe_spot_instance_requests(Filters=[{
@@ -310,11 +489,22 @@ class EC2Instance(Instance):
                         f'{self.instance_id}')
         else:
             spot_request_info = spot_requests[0]
+        instance = describe_instances(self.client,
+                                      filters=[('instance-id',
+                                                self.instance_id)])[0]
         return {
             'SpotInstanceRequest': spot_request_info,
-            'InstanceState': self.get_resource_state()
+            'InstanceState': instance['State']['Name'],
+            'StateReason': instance.get('StateReason', {})
         }
 
+    def was_interrupted(self, forensics: dict) -> bool:
+        spot_request_status = forensics.get('SpotInstanceRequest',
+                                            {}).get('Status', {}).get('Code')
+        state_reason = forensics.get('StateReason', {}).get('Code')
+        return spot_request_status in _SPOT_INTERRUPTION_STATUSES or \
+            state_reason == _SPOT_INTERRUPTION_STATE_REASON
+
     @property
     def instance_id(self):
         return self.data['InstanceId']
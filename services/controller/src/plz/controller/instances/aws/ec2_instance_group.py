@@ -1,43 +1,78 @@
+import collections
 import io
 import logging
-import socket
+import threading
 import time
-from contextlib import closing
-from typing import Any, Dict, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
+from botocore.exceptions import ClientError
 from redis import StrictRedis
 
-from plz.controller.containers import Containers
 from plz.controller.images import Images
-from plz.controller.instances.instance_base import Instance, \
+from plz.controller.instances.instance_base import BuildHost, Instance, \
     InstanceProvider, Parameters
+from plz.controller.instances.resources import requirements_of
 from plz.controller.results.results_base import ResultsStorage
-from plz.controller.volumes import Volumes
+from .build_hosts import BuildHosts
 from .ec2_instance import EC2Instance, InstanceUnavailableException, \
     describe_instances, get_aws_instances, get_tag
+from .host_clients import HostClientsPool
+from .instance_types import CAPACITY_ERROR_CODES, \
+    acceptable_instance_types, instance_types_to_start, preference_of
+from .placement import WorkerRecords, rank_instances, snapshot_family
+from .readiness import ReadinessTracker, ping_docker
+from .slots import SlotTable, has_room
+from .snapshot_pushes import SnapshotPushes
 
 log = logging.getLogger(__name__)
 
+# Starting instances doesn't take long, but the lock shouldn't be held forever
+# if the controller dies while holding it
+_WARM_POOL_LOCK_TIMEOUT_SECONDS = 300
+
 
 class EC2InstanceGroup(InstanceProvider):
     DOCKER_PORT = 2375
 
-    def __init__(self, name, redis: StrictRedis, client, aws_worker_ami: str,
-                 aws_key_name: Optional[str], results_storage: ResultsStorage,
-                 images: Images, acquisition_delay_in_seconds: int,
+    def __init__(self,
+                 name,
+                 redis: StrictRedis,
+                 client,
+                 aws_worker_ami: str,
+                 aws_key_name: Optional[str],
+                 results_storage: ResultsStorage,
+                 images: Images,
+                 acquisition_delay_in_seconds: int,
                  max_acquisition_tries: int,
-                 worker_security_group_names: List[str], use_public_dns: bool,
+                 worker_security_group_names: List[str],
+                 use_public_dns: bool,
                  instance_lock_timeout: int,
                  instance_max_startup_time_in_minutes: int,
-                 container_idle_timestamp_grace: int):
+                 container_idle_timestamp_grace: int,
+                 warm_pool_sizes: Optional[Dict[str, int]] = None,
+                 warm_pool_max_idle_time_in_minutes: int = 30,
+                 warm_pool_instance_market_spec: Optional[dict] = None,
+                 max_prefetch_instances: int = 2,
+                 input_volume_cache_max_size_in_bytes: int = 0,
+                 instance_type_families: Optional[Dict[str, List[str]]] = None,
+                 time_per_instance_type_in_seconds: int = 120,
+                 max_executions_per_instance: int = 1,
+                 build_in_workers: bool = False):
         super().__init__(results_storage, instance_lock_timeout)
         self.name = name
         self.redis = redis
+        self.worker_records = WorkerRecords(redis)
+        self.slots = SlotTable(redis)
+        self.readiness_tracker = ReadinessTracker()
+        self.host_clients = HostClientsPool(images)
         self.client = client
         self.aws_worker_ami = aws_worker_ami
         self.aws_key_name = aws_key_name
         self.results_storage = results_storage
         self.images = images
+        self.snapshot_pushes = SnapshotPushes(redis, images)
+        self.build_hosts = BuildHosts(redis)
         self.acquisition_delay_in_seconds = acquisition_delay_in_seconds
         self.max_acquisition_tries = max_acquisition_tries
         self.instances: Dict[str, EC2Instance] = {}
@@ -46,6 +81,36 @@ class EC2InstanceGroup(InstanceProvider):
         self.instance_max_startup_time_in_minutes = \
             instance_max_startup_time_in_minutes
         self.container_idle_timestamp_grace = container_idle_timestamp_grace
+        # Instance type to the number of idle instances to keep around, so
+        # that executions don't have to wait for an instance to start
+        self.warm_pool_sizes = warm_pool_sizes \
+            if warm_pool_sizes is not None else {}
+        self.warm_pool_max_idle_time_in_minutes = \
+            warm_pool_max_idle_time_in_minutes
+        self.warm_pool_instance_market_spec = \
+            warm_pool_instance_market_spec \
+            if warm_pool_instance_market_spec is not None \
+            else {'instance_market_type': 'on_demand'}
+        # Maximum number of idle instances pulling a new snapshot ahead of
+        # time
+        self.max_prefetch_instances = max_prefetch_instances
+        # Disk space in each instance for inputs kept around for other
+        # executions. Zero disables the cache
+        self.input_volume_cache_max_size_in_bytes = \
+            input_volume_cache_max_size_in_bytes
+        # Family name (like `p3`) to its types to start, in order
+        self.instance_type_families = instance_type_families \
+            if instance_type_families is not None else {}
+        # How long to wait for a new instance before trying the next
+        # acceptable type
+        self.time_per_instance_type_in_seconds = \
+            time_per_instance_type_in_seconds
+        # Executions that declare the CPUs and memory they use share
+        # instances, up to this number per instance
+        self.max_executions_per_instance = max_executions_per_instance
+        # Whether to build snapshots in idle instances, when there's one,
+        # instead of in the controller
+        self.build_in_workers = build_in_workers
         # Lazily initialized by ami_id
         self._ami_id = None
         # Lazily initialized by _instance_initialization_code
@@ -65,8 +130,26 @@ class EC2InstanceGroup(InstanceProvider):
         return self._ami_id
 
     def instance_iterator(self, only_running: bool) -> Iterator[Instance]:
-        for instance_data in self._get_group_aws_instances([], only_running):
-            yield self._ec2_instance_from_instance_data(instance_data)
+        instances_data = self._get_group_aws_instances([], only_running)
+        if not only_running:
+            # All instances of the group are here, forget about the rest
+            self.host_clients.retain_only(
+                self._docker_url(i) for i in instances_data)
+        slots = self.slots.get([i['InstanceId'] for i in instances_data])
+        is_kept_in_warm_pool = self._warm_pool_keeper(instances_data)
+        for instance_data in instances_data:
+            execution_id = get_tag(instance_data, EC2Instance.EXECUTION_ID_TAG)
+            # Those running alongside go first, as harvesting the one in the
+            # tag might take the instance out of the group
+            for other_execution_id in sorted(
+                    slots[instance_data['InstanceId']].occupants):
+                if other_execution_id != execution_id:
+                    yield self._ec2_instance_from_instance_data(
+                        instance_data,
+                        container_execution_id=other_execution_id,
+                        runs_alongside=True)
+            yield self._ec2_instance_from_instance_data(
+                instance_data, is_kept_in_warm_pool=is_kept_in_warm_pool)
 
     def get_forensics(self, execution_id) -> dict:
         instance = self.instance_for(execution_id)
@@ -91,26 +174,51 @@ class EC2InstanceGroup(InstanceProvider):
         """
         tries_remaining = max_tries
         yield _msg('querying availability')
-        instance_type = execution_spec.get('instance_type')
+        acceptable_types = acceptable_instance_types(execution_spec)
+        instance_with_others = yield from self._run_alongside_others(
+            execution_id, snapshot_id, parameters, input_stream,
+            acceptable_types, execution_spec)
+        if instance_with_others is not None:
+            yield {'instance': instance_with_others}
+            return
+        types_to_start = instance_types_to_start(acceptable_types,
+                                                 self.instance_type_families)
+        # Type of the instance we're waiting for. When a new instance takes
+        # too long, we fall back to the next type
+        instance_type = types_to_start[0] if types_to_start else None
+        type_deadline = None
         instance_max_uptime_in_minutes = execution_spec.get(
             'instance_max_uptime_in_minutes')
         instance_data = None
         instance: EC2Instance = None
         # Just to make the IDE happy, it's initialised in all execution paths
         is_instance_newly_created = False
-        need_to_recreate_instance = False
         try:
             while tries_remaining > 0:
                 tries_remaining -= 1
+                if is_instance_newly_created and instance_data is not None \
+                        and time.time() > type_deadline \
+                        and _next_of(instance_type, types_to_start):
+                    next_type = _next_of(instance_type, types_to_start)
+                    yield _msg(f'{instance_type} is taking too long, '
+                               f'trying {next_type}')
+                    self._give_up_on_new_instance(execution_id, instance,
+                                                  instance_data)
+                    instance, instance_data = None, None
+                    instance_type = next_type
+                    tries_remaining = max_tries - 1
+
                 if instance_data is None:
-                    instance_data, is_instance_newly_created = \
+                    instance_data, is_instance_newly_created, instance_type = \
                         yield from self._create_or_reuse_instance(
                             execution_id, instance_market_spec,
-                            instance_max_uptime_in_minutes, instance_type)
+                            instance_max_uptime_in_minutes, acceptable_types,
+                            types_to_start, instance_type, snapshot_id,
+                            execution_spec)
+                    type_deadline = \
+                        time.time() + self.time_per_instance_type_in_seconds
 
-                if instance is None or need_to_recreate_instance:
-                    if instance is not None:
-                        instance.hard_unearmark_for(execution_id)
+                if instance_data is not None and instance is None:
                     instance, instance_data = \
                         yield from self._make_earmarked_instance_from_data(
                             execution_id, instance_data,
@@ -119,21 +227,36 @@ class EC2InstanceGroup(InstanceProvider):
                 # If the instance is None, it might mean that AWS instance
                 # is not yet ready as to create an EC2Instance object (for
                 # instance, it still doesn't have DNS assigned)
-                if instance is not None and instance.is_up(
-                        is_instance_newly_created):
-                    yield _msg('starting container')
-                    need_to_recreate_instance, instance_data = \
-                        yield from self._start_container_in_instance(
-                            execution_id, execution_spec,
-                            input_stream, instance, instance_data,
-                            instance_market_spec,
-                            instance_max_uptime_in_minutes,
-                            instance_type,
-                            parameters, snapshot_id)
-                    if not need_to_recreate_instance:
-                        yield _msg('running')
-                        yield {'instance': instance}
-                        return
+                if instance is not None:
+                    # Waiting for the instance takes the place of the delay
+                    is_up = self.readiness_tracker.wait_until_ready(
+                        self._docker_url(instance.data),
+                        timeout=delay_in_seconds)
+                    if is_up:
+                        yield _msg('starting container')
+                        need_to_recreate_instance, instance_data = \
+                            yield from self._start_container_in_instance(
+                                execution_id, execution_spec,
+                                input_stream, instance, instance_data,
+                                instance_market_spec, parameters, snapshot_id)
+                        if need_to_recreate_instance:
+                            instance.hard_unearmark_for(execution_id)
+                            instance = None
+                        else:
+                            # Counted once the execution has its instance,
+                            # whatever it took to get it
+                            if is_instance_newly_created:
+                                counter_key = self._cold_starts_key
+                            else:
+                                counter_key = self._warm_pool_hits_key
+                            self.redis.hincrby(counter_key, instance_type)
+                            yield _msg(f'running in a {instance_type}')
+                            yield {'instance': instance}
+                            return
+                    else:
+                        yield _msg(
+                            f'pending. Tries remaining: {tries_remaining}')
+                        continue
 
                 time_before_yield = time.time()
                 yield _msg(f'pending. Tries remaining: {tries_remaining}')
@@ -146,9 +269,8 @@ class EC2InstanceGroup(InstanceProvider):
     def _start_container_in_instance(
             self, execution_id: str, execution_spec: dict,
             input_stream: Optional[io.BytesIO], instance: EC2Instance,
-            instance_data: dict, instance_market_spec: dict,
-            instance_max_uptime_in_minutes: int, instance_type: str,
-            parameters: dict, snapshot_id: str):
+            instance_data: dict, instance_market_spec: dict, parameters: dict,
+            snapshot_id: str):
         try:
             instance.run(
                 snapshot_id=snapshot_id,
@@ -157,7 +279,11 @@ class EC2InstanceGroup(InstanceProvider):
                 docker_run_args=execution_spec['docker_run_args'],
                 max_idle_seconds=instance_market_spec[
                     'instance_max_idle_time_in_minutes'] * 60,
-                index_range_to_run=execution_spec['index_range_to_run'])
+                index_range_to_run=execution_spec['index_range_to_run'],
+                input_id=execution_spec.get('input_id'),
+                user=execution_spec['user'])
+            self.worker_records.record_execution(instance.instance_id,
+                                                 snapshot_id, execution_spec)
         except InstanceUnavailableException as e:
             log.info(e)
             yield _msg('gone while waiting')
@@ -170,13 +296,71 @@ class EC2InstanceGroup(InstanceProvider):
             # Try to unearmark but catch any exceptions
             except Exception:
                 log.exception('Exception unearmarking instance')
-            instance_data = self._ask_aws_for_new_instance(
-                instance_type, instance_max_uptime_in_minutes,
-                instance_market_spec, execution_id)
-            # need_to_recreate_instance is True
-            return True, instance_data
+            # need_to_recreate_instance is True. Another instance is found or
+            # started as for the first one
+            return True, None
         return False, instance_data
 
+    def _run_alongside_others(self, execution_id: str, snapshot_id: str,
+                              parameters: Parameters,
+                              input_stream: Optional[io.BytesIO],
+                              acceptable_types: List[str],
+                              execution_spec: dict) -> Optional[EC2Instance]:
+        """
+        Runs the execution in an instance with other executions, if it
+        declares the resources it needs and there's an instance with room
+        for it.
+
+        :return: the instance, or None if the execution wasn't started
+        """
+        if self.max_executions_per_instance <= 1:
+            return None
+        docker_run_args = execution_spec['docker_run_args']
+        requirements = requirements_of(docker_run_args)
+        if requirements is None:
+            return None
+        user = execution_spec['user']
+        busy_instances = [
+            i for i in self._get_group_aws_instances([], only_running=True)
+            if get_tag(i, EC2Instance.EXECUTION_ID_TAG, '') != ''
+            and preference_of(i['InstanceType'], acceptable_types) is not None
+        ]
+        slots = self.slots.get([i['InstanceId'] for i in busy_instances])
+        instances_with_room = [
+            i for i in busy_instances
+            if has_room(slots[i['InstanceId']], user, requirements,
+                        self.max_executions_per_instance)
+        ]
+        if len(instances_with_room) == 0:
+            return None
+        for instance_data in rank_instances(instances_with_room,
+                                            self.worker_records, snapshot_id,
+                                            execution_spec, acceptable_types):
+            instance = self._ec2_instance_from_instance_data(
+                instance_data,
+                container_execution_id=execution_id,
+                runs_alongside=True)
+            yield _msg('starting container alongside other executions')
+            try:
+                instance.run_alongside(
+                    snapshot_id=snapshot_id,
+                    parameters=parameters,
+                    input_stream=input_stream,
+                    docker_run_args=docker_run_args,
+                    index_range_to_run=execution_spec['index_range_to_run'],
+                    user=user,
+                    max_occupants=self.max_executions_per_instance,
+                    input_id=execution_spec.get('input_id'))
+            except InstanceUnavailableException as e:
+                log.info(e)
+                continue
+            self.worker_records.record_execution(instance.instance_id,
+                                                 snapshot_id, execution_spec)
+            yield _msg(f'running in a {instance_data["InstanceType"]} '
+                       'alongside other executions')
+            return instance
+        return None
+
     def _make_earmarked_instance_from_data(self, execution_id: str,
                                            instance_data: dict,
                                            is_instance_newly_created: bool
@@ -207,38 +391,91 @@ class EC2InstanceGroup(InstanceProvider):
                 yield _msg('reusing existing instance')
         return instance, instance_data
 
-    def _create_or_reuse_instance(self, execution_id: str,
-                                  instance_market_spec: dict,
-                                  instance_max_uptime_in_minutes: int,
-                                  instance_type: str) -> (EC2Instance, bool):
-        instances_not_assigned = self._get_group_aws_instances(
-            only_running=True,
-            filters=[(f'tag:{EC2Instance.EXECUTION_ID_TAG}', ''),
-                     (f'tag:{EC2Instance.EARMARK_EXECUTION_ID_TAG}', ''),
-                     ('instance-type', instance_type)])
+    def _create_or_reuse_instance(
+            self, execution_id: str, instance_market_spec: dict,
+            instance_max_uptime_in_minutes: int, acceptable_types: List[str],
+            types_to_start: List[str], instance_type: Optional[str],
+            snapshot_id: str,
+            execution_spec: dict) -> (Optional[dict], bool, Optional[str]):
+        """
+        :return: the instance data (None if there's no instance yet), whether
+            the instance is new and its type
+        """
+        instances_not_assigned = [
+            i for i in self._get_group_aws_instances(
+                only_running=True,
+                filters=[(
+                    f'tag:{EC2Instance.EXECUTION_ID_TAG}',
+                    ''), (f'tag:{EC2Instance.EARMARK_EXECUTION_ID_TAG}', '')])
+            if preference_of(i['InstanceType'], acceptable_types) is not None
+        ]
         if len(instances_not_assigned) > 0:
-            is_instance_newly_created = False
-            instance_data = instances_not_assigned[0]
-        else:
-            yield _msg('requesting new instance')
-            is_instance_newly_created = True
-            instance_data = self._ask_aws_for_new_instance(
-                instance_type, instance_max_uptime_in_minutes,
-                instance_market_spec, execution_id)
-            yield _msg(f'waiting for the instance to be ready')
-        return instance_data, is_instance_newly_created
+            # Prefer the types that come first, then instances that already
+            # have what the execution needs
+            instance_data = rank_instances(instances_not_assigned,
+                                           self.worker_records, snapshot_id,
+                                           execution_spec, acceptable_types)[0]
+            instance_type = instance_data['InstanceType']
+            return instance_data, False, instance_type
+        while instance_type is not None:
+            yield _msg(f'requesting new {instance_type} instance')
+            try:
+                instance_data = self._ask_aws_for_new_instance(
+                    instance_type, instance_max_uptime_in_minutes,
+                    instance_market_spec, execution_id)
+                yield _msg(f'waiting for the instance to be ready')
+                return instance_data, True, instance_type
+            except ClientError as e:
+                error_code = e.response['Error']['Code']
+                if error_code not in CAPACITY_ERROR_CODES:
+                    raise
+                next_type = _next_of(instance_type, types_to_start)
+                if next_type is None:
+                    raise
+                yield _msg(f'couldn\'t get a {instance_type} ({error_code}), '
+                           f'trying {next_type}')
+                instance_type = next_type
+        yield _msg('no idle instance of types: ' + ', '.join(acceptable_types))
+        return None, False, None
+
+    def _give_up_on_new_instance(self, execution_id: str,
+                                 instance: Optional[EC2Instance],
+                                 instance_data: dict):
+        # It was started for this execution only, so no one else is using it
+        if instance is not None:
+            instance.hard_unearmark_for(execution_id)
+        # noinspection PyBroadException
+        try:
+            self.client.terminate_instances(
+                InstanceIds=[instance_data['InstanceId']])
+        except Exception:
+            log.exception(
+                f'Error terminating instance {instance_data["InstanceId"]}')
 
     def instance_for(self, execution_id: str) -> Optional[EC2Instance]:
         instance_data_list = self._get_group_aws_instances(filters=[
             (f'tag:{EC2Instance.EXECUTION_ID_TAG}', execution_id)
         ],
                                                            only_running=False)
-        if len(instance_data_list) == 0:
-            return None
-        elif len(instance_data_list) > 1:
+        if len(instance_data_list) > 1:
             raise ValueError(
                 f'More than one instance for execution ID {execution_id}')
-        return self._ec2_instance_from_instance_data(instance_data_list[0])
+        elif len(instance_data_list) == 1:
+            return self._ec2_instance_from_instance_data(instance_data_list[0])
+        # It might be running alongside other executions
+        instance_id = self.slots.instance_of(execution_id)
+        if instance_id is None:
+            return None
+        instance_data_list = self._get_group_aws_instances(filters=[
+            ('instance-id', instance_id)
+        ],
+                                                           only_running=False)
+        if len(instance_data_list) == 0:
+            return None
+        return self._ec2_instance_from_instance_data(
+            instance_data_list[0],
+            container_execution_id=execution_id,
+            runs_alongside=True)
 
     def release_instance(self,
                          execution_id: str,
@@ -249,8 +486,196 @@ class EC2InstanceGroup(InstanceProvider):
         super().release_instance(execution_id, fail_if_not_found,
                                  idle_since_timestamp)
 
-    def push(self, image_tag):
-        self.images.push(image_tag)
+    def push(self, image_tag: str, build_host: Optional[BuildHost] = None):
+        if build_host is None:
+            # Instances wait for the push only when they need to pull
+            self.snapshot_pushes.push(image_tag)
+            return
+        # The instance has the snapshot, so it's a good place for the
+        # execution
+        self.worker_records.record_snapshot(build_host.instance_id, image_tag)
+        # Keep the instance claimed while pushing from it, so that it's not
+        # disposed of nor picked for another build
+        self.snapshot_pushes.push(
+            image_tag,
+            build_host.images,
+            on_done=lambda: self.release_build_host(build_host))
+
+    def acquire_build_host(self, snapshot_id: str) -> Optional[BuildHost]:
+        if not self.build_in_workers:
+            return None
+        for instance_data in self._get_idle_instances_by_family(snapshot_id):
+            instance_id = instance_data['InstanceId']
+            if not self.build_hosts.claim(instance_id, snapshot_id):
+                continue
+            docker_url = self._docker_url(instance_data)
+            if not ping_docker(docker_url):
+                self.build_hosts.release(instance_id)
+                continue
+            log.debug(f'Building {snapshot_id} in {instance_id}')
+            return BuildHost(instance_id,
+                             self.host_clients.get(docker_url).images)
+        return None
+
+    def release_build_host(self, build_host: BuildHost) -> None:
+        self.build_hosts.release(build_host.instance_id)
+
+    def prefetch_snapshot(self, snapshot_id: str) -> None:
+        if self.max_prefetch_instances <= 0:
+            return
+        # Don't make the request wait for it
+        threading.Thread(target=self._prefetch_snapshot,
+                         args=(snapshot_id, ),
+                         daemon=True).start()
+
+    def _prefetch_snapshot(self, snapshot_id: str) -> None:
+        instances = self._get_idle_instances_by_family(
+            snapshot_id)[:self.max_prefetch_instances]
+        if len(instances) == 0:
+            return
+
+        def prefetch(instance_data: dict):
+            instance_id = instance_data['InstanceId']
+            # noinspection PyBroadException
+            try:
+                instance = self._ec2_instance_from_instance_data(instance_data)
+                if instance.prefetch(snapshot_id):
+                    self.worker_records.record_snapshot(
+                        instance_id, snapshot_id)
+                    log.debug(f'Prefetched {snapshot_id} in {instance_id}')
+            except Exception:
+                log.exception(
+                    f'Error prefetching {snapshot_id} in {instance_id}')
+
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            # Consume the results so that the executor waits for all
+            list(executor.map(prefetch, instances))
+
+    def _get_idle_instances_by_family(self, snapshot_id: str) -> List[dict]:
+        """
+        :return: the running instances not assigned to an execution, those
+            with a snapshot of the same family first
+        """
+        instances_not_assigned = self._get_group_aws_instances(
+            only_running=True,
+            filters=[(f'tag:{EC2Instance.EXECUTION_ID_TAG}', ''),
+                     (f'tag:{EC2Instance.EARMARK_EXECUTION_ID_TAG}', '')])
+        if len(instances_not_assigned) == 0:
+            return []
+        # Snapshots of the same user and project most likely share the base
+        # layers, so pulling in instances that have one of them is cheap
+        family = snapshot_family(snapshot_id)
+        records = self.worker_records.get(
+            [i['InstanceId'] for i in instances_not_assigned])
+
+        def has_snapshot_in_family(instance_data: dict) -> bool:
+            return any(
+                snapshot_family(s) == family
+                for s in records[instance_data['InstanceId']].snapshot_ids)
+
+        return sorted(instances_not_assigned,
+                      key=has_snapshot_in_family,
+                      reverse=True)
+
+    def harvest(self) -> List[str]:
+        interrupted_execution_ids = super().harvest()
+        # noinspection PyBroadException
+        try:
+            self._replenish_warm_pool()
+        except Exception:
+            log.exception('Exception replenishing the warm pool')
+        return interrupted_execution_ids
+
+    def _replenish_warm_pool(self):
+        if len(self.warm_pool_sizes) == 0:
+            return
+        # Harvesting might be triggered concurrently, don't start the same
+        # instances twice
+        lock = self.redis.lock(f'lock:{__name__}#warm_pool:{self.name}',
+                               timeout=_WARM_POOL_LOCK_TIMEOUT_SECONDS)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            for instance_type, size in self.warm_pool_sizes.items():
+                missing = size - len(
+                    self._get_idle_aws_instances(instance_type))
+                if missing <= 0:
+                    continue
+                log.info(f'Starting {missing} instances of type '
+                         f'{instance_type} for the warm pool')
+                self.client.run_instances(**self._get_instance_spec(
+                    instance_type,
+                    instance_max_uptime_in_minutes=None,
+                    instance_market_spec=self.warm_pool_instance_market_spec,
+                    execution_id='',
+                    max_idle_seconds=self.warm_pool_max_idle_time_in_minutes *
+                    60),
+                                          MinCount=missing,
+                                          MaxCount=missing)
+        finally:
+            lock.release()
+
+    def _warm_pool_keeper(self, instances_data: List[dict]) \
+            -> Optional[Callable[[str], bool]]:
+        """
+        :return: whether an idle instance of a type is to be kept, as there
+            aren't more idle ones than the warm pool needs. Otherwise it'd be
+            disposed of, and started again when replenishing the pool. Idle
+            instances are counted once among the instances given, and those
+            not kept are taken off the count as they are disposed of
+        """
+        if len(self.warm_pool_sizes) == 0:
+            return None
+        surplus = collections.Counter(i['InstanceType'] for i in instances_data
+                                      if _is_idle_aws_instance(i))
+        for instance_type in surplus:
+            surplus[instance_type] -= self.warm_pool_sizes.get(
+                instance_type, 0)
+
+        def is_kept_in_warm_pool(instance_type: str) -> bool:
+            if self.warm_pool_sizes.get(instance_type, 0) <= 0:
+                return False
+            if surplus[instance_type] > 0:
+                surplus[instance_type] -= 1
+                return False
+            return True
+
+        return is_kept_in_warm_pool
+
+    def _get_idle_aws_instances(self, instance_type: str) -> [dict]:
+        instances = self._get_group_aws_instances(
+            only_running=False,
+            filters=[(f'tag:{EC2Instance.EXECUTION_ID_TAG}', ''),
+                     (f'tag:{EC2Instance.EARMARK_EXECUTION_ID_TAG}', ''),
+                     ('instance-type', instance_type)])
+        return [i for i in instances if _is_idle_aws_instance(i)]
+
+    def get_warm_pool_stats(self) -> dict:
+        hits = self.redis.hgetall(self._warm_pool_hits_key)
+        cold_starts = self.redis.hgetall(self._cold_starts_key)
+        instance_types = set(self.warm_pool_sizes.keys()).union(
+            str(t, 'utf-8') for t in set(hits.keys()).union(cold_starts))
+        return {
+            instance_type: {
+                'size':
+                    self.warm_pool_sizes.get(instance_type, 0),
+                'idle':
+                    len(self._get_idle_aws_instances(instance_type)),
+                'hits':
+                    int(hits.get(instance_type.encode('utf-8'), 0)),
+                'cold_starts':
+                    int(cold_starts.get(instance_type.encode('utf-8'), 0))
+            }
+            for instance_type in instance_types
+        }
+
+    @property
+    def _warm_pool_hits_key(self) -> str:
+        return f'key:{__name__}#warm_pool_hits:{self.name}'
+
+    @property
+    def _cold_starts_key(self) -> str:
+        return f'key:{__name__}#cold_starts:{self.name}'
 
     def _get_group_aws_instances(self, filters, only_running: bool):
         filters += [(f'tag:{EC2Instance.GROUP_NAME_TAG}', self.name)]
@@ -269,27 +694,35 @@ class EC2InstanceGroup(InstanceProvider):
                                              MaxCount=1)
         return response['Instances'][0]
 
-    def _ec2_instance_from_instance_data(self,
-                                         instance_data,
-                                         container_execution_id=None
-                                         ) -> EC2Instance:
+    def _ec2_instance_from_instance_data(
+            self,
+            instance_data,
+            container_execution_id=None,
+            runs_alongside: bool = False,
+            is_kept_in_warm_pool: Optional[Callable[[str], bool]] = None
+    ) -> EC2Instance:
         if container_execution_id is None:
             container_execution_id = get_tag(instance_data,
                                              EC2Instance.EXECUTION_ID_TAG)
-        dns_name = self._get_dns_name(instance_data)
-        docker_url = f'tcp://{dns_name}:{self.DOCKER_PORT}'
-        images = self.images.for_host(docker_url)
-        containers = Containers.for_host(docker_url)
-        volumes = Volumes.for_host(docker_url)
-        return EC2Instance(self.client, images, containers, volumes,
-                           container_execution_id, instance_data, self.redis,
+        clients = self.host_clients.get(self._docker_url(instance_data))
+        packs_executions = self.max_executions_per_instance > 1
+        return EC2Instance(self.client, clients.images, clients.containers,
+                           clients.volumes, container_execution_id,
+                           instance_data, self.redis,
                            self.instance_lock_timeout,
-                           self.container_idle_timestamp_grace)
+                           self.container_idle_timestamp_grace, self.slots,
+                           self.input_volume_cache_max_size_in_bytes,
+                           runs_alongside, self.snapshot_pushes,
+                           is_kept_in_warm_pool, packs_executions)
 
-    def _get_instance_spec(self, instance_type: str,
+    def _get_instance_spec(self,
+                           instance_type: str,
                            instance_max_uptime_in_minutes: Optional[int],
                            instance_market_spec: dict,
-                           execution_id: str) -> dict:
+                           execution_id: str,
+                           max_idle_seconds: Optional[int] = None) -> dict:
+        if max_idle_seconds is None:
+            max_idle_seconds = self.instance_max_startup_time_in_minutes * 60
         spec = {'ImageId': self.ami_id}
         if self.aws_key_name:
             spec['KeyName'] = self.aws_key_name
@@ -310,10 +743,8 @@ class EC2InstanceGroup(InstanceProvider):
                     'Value': str(int(time.time()))
                 },
                 {
-                    'Key':
-                        EC2Instance.MAX_IDLE_SECONDS_TAG,
-                    'Value':
-                        str(self.instance_max_startup_time_in_minutes * 60)
+                    'Key': EC2Instance.MAX_IDLE_SECONDS_TAG,
+                    'Value': str(max_idle_seconds)
                 },
                 {
                     'Key': EC2Instance.EARMARK_EXECUTION_ID_TAG,
@@ -348,6 +779,9 @@ class EC2InstanceGroup(InstanceProvider):
             spec['SecurityGroups'] = self.worker_security_group_names
         return spec
 
+    def _docker_url(self, instance_data: dict) -> str:
+        return f'tcp://{self._get_dns_name(instance_data)}:{self.DOCKER_PORT}'
+
     def _get_dns_name(self, instance_data: dict) -> str:
         if self.use_public_dns:
             return instance_data['PublicDnsName']
@@ -355,9 +789,19 @@ class EC2InstanceGroup(InstanceProvider):
             return instance_data['PrivateDnsName']
 
 
-def _is_socket_open(host: str, port: int) -> bool:
-    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
-        return sock.connect_ex((host, port)) == 0
+def _next_of(instance_type: str, types_to_start: List[str]) -> Optional[str]:
+    try:
+        i = types_to_start.index(instance_type)
+    except ValueError:
+        return None
+    return types_to_start[i + 1] if i + 1 < len(types_to_start) else None
+
+
+def _is_idle_aws_instance(instance_data: dict) -> bool:
+    # Pending instances are about to be idle, so they count as well
+    return instance_data['State']['Name'] in {'pending', 'running'} \
+        and get_tag(instance_data, EC2Instance.EXECUTION_ID_TAG) == '' \
+        and get_tag(instance_data, EC2Instance.EARMARK_EXECUTION_ID_TAG) == ''
 
 
 def _msg(s) -> Dict:
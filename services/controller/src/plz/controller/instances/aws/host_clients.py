@@ -0,0 +1,61 @@
+import collections
+import logging
+import threading
+from typing import Dict, Iterable
+
+import docker
+
+from plz.controller.containers import Containers
+from plz.controller.images import Images
+from plz.controller.volumes import Volumes
+
+log = logging.getLogger(__name__)
+
+HostClients = collections.namedtuple('HostClients',
+                                     ['images', 'containers', 'volumes'])
+
+
+class HostClientsPool:
+    """
+    Clients for the docker daemons of the instances.
+
+    Creating them means opening new connections, and for some images providers
+    calling AWS as well, so they're kept for as long as the instances are
+    around
+    """
+
+    def __init__(self, images: Images):
+        self.images = images
+        self._clients: Dict[str, HostClients] = {}
+        self._lock = threading.Lock()
+
+    def get(self, docker_url: str) -> HostClients:
+        with self._lock:
+            clients = self._clients.get(docker_url)
+            if clients is None:
+                # Containers and volumes can share the connections
+                docker_client = docker.DockerClient(base_url=docker_url)
+                clients = HostClients(images=self.images.for_host(docker_url),
+                                      containers=Containers(docker_client),
+                                      volumes=Volumes(docker_client))
+                self._clients[docker_url] = clients
+            return clients
+
+    def retain_only(self, docker_urls: Iterable[str]) -> None:
+        """Evicts the clients of hosts that are gone"""
+        docker_urls = set(docker_urls)
+        with self._lock:
+            gone = [u for u in self._clients if u not in docker_urls]
+            evicted = [self._clients.pop(u) for u in gone]
+        for docker_url, clients in zip(gone, evicted):
+            log.debug(f'Evicting clients of {docker_url}')
+            _close(clients)
+
+
+def _close(clients: HostClients) -> None:
+    # noinspection PyBroadException
+    try:
+        clients.images.docker_api_client.close()
+        clients.containers.docker_client.close()
+    except Exception:
+        log.exception('Error closing clients')
@@ -0,0 +1,56 @@
+import fnmatch
+from typing import Dict, List, Optional
+
+# Errors when starting instances that mean that there's no capacity for the
+# type right now, so that it makes sense to try another one
+CAPACITY_ERROR_CODES = {
+    'InsufficientInstanceCapacity', 'InstanceLimitExceeded',
+    'MaxSpotInstanceCountExceeded', 'SpotMaxPriceTooLow', 'Unsupported'
+}
+
+
+def acceptable_instance_types(execution_spec: dict) -> List[str]:
+    """
+    Instance types that the execution can use, in order of preference.
+
+    Entries can be families, like `p3.*`
+    """
+    instance_types = execution_spec.get('instance_types')
+    if instance_types:
+        return list(instance_types)
+    return [execution_spec['instance_type']]
+
+
+def instance_types_to_start(acceptable: List[str],
+                            families: Dict[str, List[str]]) -> List[str]:
+    """
+    Types of the instances to start, in order, when no idle instance of an
+    acceptable type is available.
+
+    Families are replaced by their types in the configuration, and ignored
+    if they aren't there (only idle instances of the family are used)
+    """
+    instance_types = []
+    for instance_type in acceptable:
+        if _is_family(instance_type):
+            family_types = families.get(_family_name(instance_type), [])
+        else:
+            family_types = [instance_type]
+        instance_types += [t for t in family_types if t not in instance_types]
+    return instance_types
+
+
+def preference_of(instance_type: str, acceptable: List[str]) -> Optional[int]:
+    """:return: the position of the type in the list, None if not there"""
+    for i, acceptable_type in enumerate(acceptable):
+        if fnmatch.fnmatchcase(instance_type, acceptable_type):
+            return i
+    return None
+
+
+def _is_family(instance_type: str) -> bool:
+    return instance_type.endswith('.*')
+
+
+def _family_name(instance_type: str) -> str:
+    return instance_type[:-len('.*')]
@@ -0,0 +1,141 @@
+import collections
+import time
+from typing import Dict, List, Optional
+
+from redis import StrictRedis
+
+from plz.controller.input_volume_cache import InputVolumeCache
+from .ec2_instance import EC2Instance, get_tag
+from .instance_types import preference_of
+
+# Instances don't live that long. Records of what they hold expire after this
+# time without being updated, so that they don't pile up
+_RECORDS_EXPIRY_SECONDS = 7 * 24 * 60 * 60
+
+# What each thing that an instance already has saves when starting an
+# execution. Having the snapshot means no pull at all, while a snapshot of
+# the same user and project most likely shares all layers but the last ones
+_SNAPSHOT_SCORE = 100
+_SNAPSHOT_FAMILY_SCORE = 50
+_INPUT_SCORE = 40
+_SAME_PROJECT_SCORE = 10
+_SAME_USER_SCORE = 5
+# Given to an instance that has just been released, and decreasing with the
+# time it's been idle
+_RECENCY_SCORE = 5
+
+WorkerRecord = collections.namedtuple(
+    'WorkerRecord', ['snapshot_ids', 'input_ids', 'user', 'project'])
+
+
+class WorkerRecords:
+    """What each worker holds, as to place executions where they start faster
+    """
+
+    def __init__(self, redis: StrictRedis):
+        self.redis = redis
+
+    def record_snapshot(self, instance_id: str, snapshot_id: str) -> None:
+        pipeline = self.redis.pipeline()
+        self._record_snapshot_in(pipeline, instance_id, snapshot_id)
+        pipeline.execute()
+
+    def record_execution(self, instance_id: str, snapshot_id: str,
+                         execution_spec: dict) -> None:
+        pipeline = self.redis.pipeline()
+        self._record_snapshot_in(pipeline, instance_id, snapshot_id)
+        pipeline.hmset(_last_execution_key(instance_id), {
+            'user': execution_spec['user'],
+            'project': execution_spec['project']
+        })
+        pipeline.expire(_last_execution_key(instance_id),
+                        _RECORDS_EXPIRY_SECONDS)
+        pipeline.execute()
+
+    def get(self, instance_ids: List[str]) -> Dict[str, WorkerRecord]:
+        pipeline = self.redis.pipeline()
+        for instance_id in instance_ids:
+            pipeline.smembers(_snapshots_key(instance_id))
+            # The input volume cache of the instance knows about the inputs
+            pipeline.zrange(InputVolumeCache.cached_inputs_key(instance_id), 0,
+                            -1)
+            pipeline.hmget(_last_execution_key(instance_id),
+                           ['user', 'project'])
+        results = pipeline.execute()
+        records = {}
+        for i, instance_id in enumerate(instance_ids):
+            snapshot_ids, input_ids, (user, project) = results[3 * i:3 * i + 3]
+            records[instance_id] = WorkerRecord(
+                snapshot_ids={str(s, 'utf-8')
+                              for s in snapshot_ids},
+                input_ids={str(s, 'utf-8')
+                           for s in input_ids},
+                user=_str_or_none(user),
+                project=_str_or_none(project))
+        return records
+
+    @staticmethod
+    def _record_snapshot_in(pipeline, instance_id: str,
+                            snapshot_id: str) -> None:
+        pipeline.sadd(_snapshots_key(instance_id), snapshot_id)
+        pipeline.expire(_snapshots_key(instance_id), _RECORDS_EXPIRY_SECONDS)
+
+
+def rank_instances(instances_data: List[dict], records: WorkerRecords,
+                   snapshot_id: str, execution_spec: dict,
+                   acceptable_types: List[str]) -> List[dict]:
+    """
+    Sorts the instances by the preference of their types and then so that
+    those where the execution would start faster go first
+    """
+    records_of_instances = records.get(
+        [i['InstanceId'] for i in instances_data])
+    now = int(time.time())
+    return sorted(
+        instances_data,
+        key=lambda i: (preference_of(i['InstanceType'], acceptable_types),
+                       -_score(i, records_of_instances[i['InstanceId']],
+                               snapshot_id, execution_spec, now)))
+
+
+def snapshot_family(snapshot_id: str) -> str:
+    # Snapshot IDs are made of the user, the project and either a digest of
+    # the build context or, for older clients, a timestamp. Dropping the last
+    # part leaves the user and the project, so the family being the snapshots
+    # of a user and project is an accident of that format
+    return snapshot_id.rsplit('-', 1)[0]
+
+
+def _score(instance_data: dict, record: WorkerRecord, snapshot_id: str,
+           execution_spec: dict, now: int) -> float:
+    score = 0
+    if snapshot_id in record.snapshot_ids:
+        score += _SNAPSHOT_SCORE
+    elif any(
+            snapshot_family(s) == snapshot_family(snapshot_id)
+            for s in record.snapshot_ids):
+        score += _SNAPSHOT_FAMILY_SCORE
+    input_id = execution_spec.get('input_id')
+    if input_id and input_id in record.input_ids:
+        score += _INPUT_SCORE
+    if record.user == execution_spec.get('user'):
+        score += _SAME_USER_SCORE
+        if record.project == execution_spec.get('project'):
+            score += _SAME_PROJECT_SCORE
+    idle_since_timestamp = int(
+        get_tag(instance_data, EC2Instance.IDLE_SINCE_TIMESTAMP_TAG, '0'))
+    idle_minutes = max(now - idle_since_timestamp, 0) / 60
+    score += _RECENCY_SCORE / (1 + idle_minutes)
+    return score
+
+
+def _str_or_none(b: Optional[bytes]) -> Optional[str]:
+    return str(b, 'utf-8') if b is not None else None
+
+
+def _snapshots_key(instance_id: str) -> str:
+    return f'key:{__name__}#snapshots:{instance_id}'
+
+
+def _last_execution_key(instance_id: str) -> str:
+    return f'key:{__name__}#last_execution:{instance_id}'
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, Dict, Optional
+
+import docker
+
+log = logging.getLogger(__name__)
+
+# A docker daemon that is up answers right away
+_PING_TIMEOUT_SECONDS = 2
+# Hosts no one has waited for in this time are not checked any more (for
+# instance, because the execution was cancelled)
+_ABANDONED_AFTER_SECONDS = 60
+
+
+def ping_docker(docker_url: str) -> bool:
+    # noinspection PyBroadException
+    try:
+        with closing(
+                docker.APIClient(base_url=docker_url,
+                                 timeout=_PING_TIMEOUT_SECONDS)) as client:
+            return client.ping()
+    except Exception:
+        return False
+
+
+class _PendingHost:
+    def __init__(self, now: float, initial_delay_in_seconds: float):
+        self.ready = threading.Event()
+        self.next_check_time = now
+        self.delay_in_seconds = initial_delay_in_seconds
+        self.last_waited_time = now
+
+
+class ReadinessTracker:
+    """
+    Checks whether the docker daemons of pending instances are up, and
+    notifies whoever is waiting for them.
+
+    All pending hosts are checked concurrently from a single thread per
+    process, backing off exponentially between checks of the same host
+    """
+
+    def __init__(self,
+                 is_ready: Callable[[str], bool] = ping_docker,
+                 initial_delay_in_seconds: float = 0.5,
+                 max_delay_in_seconds: float = 8,
+                 max_concurrent_checks: int = 16):
+        self.is_ready = is_ready
+        self.initial_delay_in_seconds = initial_delay_in_seconds
+        self.max_delay_in_seconds = max_delay_in_seconds
+        self.max_concurrent_checks = max_concurrent_checks
+        self._condition = threading.Condition()
+        self._pending: Dict[str, _PendingHost] = {}
+        # Threads don't survive forking, so check that the checker thread was
+        # started in this process
+        self._checker_pid: Optional[int] = None
+
+    def wait_until_ready(self, docker_url: str, timeout: float) -> bool:
+        """
+        :return: whether the host is ready, False if it wasn't before the
+            timeout
+        """
+        with self._condition:
+            now = time.time()
+            host = self._pending.get(docker_url)
+            if host is None:
+                host = _PendingHost(now, self.initial_delay_in_seconds)
+                self._pending[docker_url] = host
+            host.last_waited_time = now
+            self._ensure_checker_is_running()
+            self._condition.notify()
+        return host.ready.wait(timeout)
+
+    def _ensure_checker_is_running(self):
+        if self._checker_pid == os.getpid():
+            return
+        self._checker_pid = os.getpid()
+        threading.Thread(target=self._check_forever, daemon=True).start()
+
+    def _check_forever(self):
+        with ThreadPoolExecutor(
+                max_workers=self.max_concurrent_checks) as executor:
+            while True:
+                # noinspection PyBroadException
+                try:
+                    self._check_due_hosts(executor)
+                except Exception:
+                    log.exception('Error checking readiness of hosts')
+                    time.sleep(self.max_delay_in_seconds)
+
+    def _check_due_hosts(self, executor: ThreadPoolExecutor):
+        with self._condition:
+            now = time.time()
+            for docker_url, host in list(self._pending.items()):
+                if now - host.last_waited_time > _ABANDONED_AFTER_SECONDS:
+                    del self._pending[docker_url]
+            if len(self._pending) == 0:
+                self._condition.wait()
+                return
+            due = {
+                docker_url: host
+                for docker_url, host in self._pending.items()
+                if host.next_check_time <= now
+            }
+            if len(due) == 0:
+                self._condition.wait(
+                    min(h.next_check_time
+                        for h in self._pending.values()) - now)
+                return
+        results = list(executor.map(self.is_ready, due.keys()))
+        with self._condition:
+            now = time.time()
+            for (docker_url, host), is_ready in zip(due.items(), results):
+                if is_ready:
+                    log.debug(f'{docker_url} is ready')
+                    host.ready.set()
+                    if self._pending.get(docker_url) is host:
+                        del self._pending[docker_url]
+                else:
+                    host.next_check_time = now + host.delay_in_seconds
+                    host.delay_in_seconds = min(host.delay_in_seconds * 2,
+                                                self.max_delay_in_seconds)
@@ -0,0 +1,134 @@
+import collections
+import json
+from typing import Dict, List, Optional
+
+from redis import StrictRedis
+
+from plz.controller.instances.resources import Resources
+
+# Requirements are None for executions that want the whole instance
+Slot = collections.namedtuple('Slot', ['user', 'requirements'])
+
+InstanceSlots = collections.namedtuple('InstanceSlots',
+                                       ['capacity', 'occupants'])
+
+
+def has_room(instance_slots: InstanceSlots, user: str, requirements: Resources,
+             max_occupants: int) -> bool:
+    """
+    Whether an execution with the requirements can run alongside the ones
+    in the instance.
+
+    Only executions of the same user share an instance, and only if all of
+    them declare their requirements
+    """
+    occupants = instance_slots.occupants.values()
+    capacity = instance_slots.capacity
+    if capacity is None or len(occupants) == 0 \
+            or len(occupants) >= max_occupants:
+        return False
+    if any(s.user != user or s.requirements is None for s in occupants):
+        return False
+    cpus = requirements.cpus + sum(s.requirements.cpus for s in occupants)
+    memory_in_bytes = requirements.memory_in_bytes + sum(
+        s.requirements.memory_in_bytes for s in occupants)
+    return cpus <= capacity.cpus \
+        and memory_in_bytes <= capacity.memory_in_bytes
+
+
+class SlotTable:
+    """
+    Executions running in each instance, with the resources they take.
+
+    Callers must hold the lock of the instance when occupying or vacating its
+    slots
+    """
+
+    def __init__(self, redis: StrictRedis):
+        self.redis = redis
+
+    def advertise_capacity(self, instance_id: str,
+                           capacity: Resources) -> None:
+        self.redis.hmset(_capacity_key(instance_id), {
+            'cpus': capacity.cpus,
+            'memory_in_bytes': capacity.memory_in_bytes
+        })
+
+    def get(self, instance_ids: List[str]) -> Dict[str, InstanceSlots]:
+        pipeline = self.redis.pipeline()
+        for instance_id in instance_ids:
+            pipeline.hmget(_capacity_key(instance_id),
+                           ['cpus', 'memory_in_bytes'])
+            pipeline.hgetall(_slots_key(instance_id))
+        results = pipeline.execute()
+        instance_slots = {}
+        for i, instance_id in enumerate(instance_ids):
+            (cpus, memory_in_bytes), slots = results[2 * i:2 * i + 2]
+            if cpus is None or memory_in_bytes is None:
+                capacity = None
+            else:
+                capacity = Resources(cpus=float(cpus),
+                                     memory_in_bytes=int(memory_in_bytes))
+            instance_slots[instance_id] = InstanceSlots(
+                capacity=capacity,
+                occupants={
+                    str(execution_id, 'utf-8'): _slot_from_json(slot)
+                    for execution_id, slot in slots.items()
+                })
+        return instance_slots
+
+    def occupants(self, instance_id: str) -> Dict[str, Slot]:
+        return self.get([instance_id])[instance_id].occupants
+
+    def occupy(self, instance_id: str, execution_id: str, user: str,
+               requirements: Optional[Resources]) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.hset(_slots_key(instance_id), execution_id,
+                      _slot_to_json(Slot(user, requirements)))
+        pipeline.hset(_instances_key(), execution_id, instance_id)
+        pipeline.execute()
+
+    def vacate(self, instance_id: str, execution_id: str) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.hdel(_slots_key(instance_id), execution_id)
+        pipeline.hdel(_instances_key(), execution_id)
+        pipeline.execute()
+
+    def clear(self, instance_id: str) -> None:
+        """Forget about an instance that is gone"""
+        execution_ids = self.redis.hkeys(_slots_key(instance_id))
+        pipeline = self.redis.pipeline()
+        if len(execution_ids) > 0:
+            pipeline.hdel(_instances_key(), *execution_ids)
+        pipeline.delete(_slots_key(instance_id), _capacity_key(instance_id))
+        pipeline.execute()
+
+    def instance_of(self, execution_id: str) -> Optional[str]:
+        instance_id = self.redis.hget(_instances_key(), execution_id)
+        return str(instance_id, 'utf-8') if instance_id is not None else None
+
+
+def _slot_to_json(slot: Slot) -> str:
+    requirements = slot.requirements._asdict() \
+        if slot.requirements is not None else None
+    return json.dumps({'user': slot.user, 'requirements': requirements})
+
+
+def _slot_from_json(s: bytes) -> Slot:
+    slot = json.loads(str(s, 'utf-8'))
+    requirements = slot['requirements']
+    return Slot(user=slot['user'],
+                requirements=Resources(
+                    **requirements) if requirements is not None else None)
+
+
+def _capacity_key(instance_id: str) -> str:
+    return f'key:{__name__}#capacity:{instance_id}'
+
+
+def _slots_key(instance_id: str) -> str:
+    return f'key:{__name__}#slots:{instance_id}'
+
+
+def _instances_key() -> str:
+    return f'key:{__name__}#instances'
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from concurrent import futures
+from typing import Callable, Optional
+
+from redis import StrictRedis
+
+from plz.controller.images import Images
+
+log = logging.getLogger(__name__)
+
+_PUSHING = 'pushing'
+_PUSHED = 'pushed'
+_FAILED = 'failed'
+
+# A push in progress refreshes its state this often. If the controller
+# process dies while pushing, the state expires after a few missed refreshes
+_HEARTBEAT_SECONDS = 10
+_PUSHING_EXPIRY_SECONDS = 6 * _HEARTBEAT_SECONDS
+# Finished pushes are remembered for longer than executions take to start
+_FINISHED_EXPIRY_SECONDS = 24 * 60 * 60
+
+
+class SnapshotPushes:
+    """
+    Pushes snapshots in the background, so that executions don't wait for
+    the push before getting an instance.
+
+    The state of each push is in Redis, so that instances in any controller
+    process can wait for it before pulling the snapshot
+    """
+
+    def __init__(self,
+                 redis: StrictRedis,
+                 images: Images,
+                 poll_interval_in_seconds: float = 1):
+        self.redis = redis
+        self.images = images
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+
+    def push(self,
+             tag: str,
+             images: Optional[Images] = None,
+             on_done: Optional[Callable[[], None]] = None) -> None:
+        """
+        Starts pushing the snapshot, unless it's pushed or being pushed
+
+        :param images: those of the host with the snapshot, if it's not the
+            one of the controller
+        :param on_done: called once the snapshot isn't needed in the host
+            anymore, whether it was pushed or not
+        """
+        if not self.redis.set(
+                _state_key(tag), _PUSHING, ex=_PUSHING_EXPIRY_SECONDS,
+                nx=True):
+            state = self._get_state(tag)
+            if state != _FAILED or not self.redis.set(
+                    _state_key(tag), _PUSHING, ex=_PUSHING_EXPIRY_SECONDS,
+                    xx=True):
+                log.debug(f'Not pushing {tag} as it\'s {state}')
+                if on_done is not None:
+                    on_done()
+                return
+        threading.Thread(target=self._push,
+                         args=(tag, images or self.images, on_done),
+                         daemon=True).start()
+
+    def wait_for(self, tag: str) -> None:
+        """
+        Waits until the snapshot is pushed. Snapshots with no push in
+        progress are taken as pushed
+
+        :raises SnapshotPushException: if the push failed
+        """
+        start = time.time()
+        state = self._get_state(tag)
+        while state == _PUSHING:
+            time.sleep(self.poll_interval_in_seconds)
+            state = self._get_state(tag)
+        if state == _FAILED:
+            raise SnapshotPushException(f'Pushing snapshot {tag} failed')
+        waited = time.time() - start
+        if waited >= self.poll_interval_in_seconds:
+            log.debug(f'Waited {waited:.1f}s for the push of {tag}')
+
+    def _push(self, tag: str, images: Images,
+              on_done: Optional[Callable[[], None]]) -> None:
+        log.debug(f'Pushing {tag}')
+        try:
+            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(images.push, tag)
+                while True:
+                    try:
+                        future.result(timeout=_HEARTBEAT_SECONDS)
+                        state = _PUSHED
+                        break
+                    except futures.TimeoutError:
+                        self.redis.expire(_state_key(tag),
+                                          _PUSHING_EXPIRY_SECONDS)
+                    except Exception:
+                        log.exception(f'Error pushing {tag}')
+                        state = _FAILED
+                        break
+            self.redis.set(_state_key(tag), state, ex=_FINISHED_EXPIRY_SECONDS)
+            log.debug(f'Push of {tag}: {state}')
+        finally:
+            if on_done is not None:
+                on_done()
+
+    def _get_state(self, tag: str) -> Optional[str]:
+        state = self.redis.get(_state_key(tag))
+        return str(state, 'utf-8') if state is not None else None
+
+
+class SnapshotPushException(Exception):
+    pass
+
+
+def _state_key(tag: str) -> str:
+    return f'key:{__name__}#state:{tag}'
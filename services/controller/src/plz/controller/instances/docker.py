@@ -1,7 +1,7 @@
 import io
 import json
 import logging
-from typing import Dict, Iterator, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from docker.types import Mount
 from redis import StrictRedis
@@ -10,30 +10,42 @@ from plz.controller.api.exceptions import InstanceStillRunningException
 from plz.controller.containers import ContainerState, Containers
 from plz.controller.execution_composition import InstanceComposition
 from plz.controller.images import Images
+from plz.controller.input_volume_cache import InputVolumeCache
 from plz.controller.instances.instance_base import ExecutionInfo, Instance, \
     KillingInstanceException, Parameters
 from plz.controller.results import ResultsStorage
 from plz.controller.results.results_base import CouldNotGetOutputException
 from plz.controller.volumes import \
-    VolumeDirectory, VolumeFile, Volumes
+    VolumeDirectory, VolumeEmptyDirectory, VolumeFile, Volumes
 
 log = logging.getLogger(__name__)
 
 
 class DockerInstance(Instance):
-    def __init__(self, images: Images, containers: Containers,
-                 volumes: Volumes, execution_id: str, redis: StrictRedis,
-                 lock_timeout: int):
+    def __init__(self,
+                 images: Images,
+                 containers: Containers,
+                 volumes: Volumes,
+                 execution_id: str,
+                 redis: StrictRedis,
+                 lock_timeout: int,
+                 input_volume_cache: Optional[InputVolumeCache] = None,
+                 instance_type: str = 'local'):
         super().__init__(redis, lock_timeout)
         self.images = images
         self.containers = containers
         self.volumes = volumes
         self.execution_id = execution_id
+        self.input_volume_cache = input_volume_cache
+        self.instance_type = instance_type
 
-    def run(self, snapshot_id: str, parameters: Parameters,
+    def run(self,
+            snapshot_id: str,
+            parameters: Parameters,
             input_stream: Optional[io.RawIOBase],
             docker_run_args: Dict[str, str],
-            index_range_to_run: Optional[Tuple[int, int]]) -> None:
+            index_range_to_run: Optional[Tuple[int, int]],
+            input_id: Optional[str] = None) -> None:
         startup_config = InstanceComposition.create_for(
             index_range_to_run).get_startup_config()
 
@@ -43,20 +55,43 @@ class DockerInstance(Instance):
             'parameters': parameters,
         }
         environment = {'CONFIGURATION_FILE': Volumes.CONFIGURATION_FILE_PATH}
+        use_input_volume_cache = self.input_volume_cache is not None \
+            and input_id is not None and input_stream is not None
+        if use_input_volume_cache:
+            # The cached input volume is mounted on this directory
+            input_volume_object = VolumeEmptyDirectory(Volumes.INPUT_DIRECTORY)
+        else:
+            input_volume_object = VolumeDirectory(Volumes.INPUT_DIRECTORY,
+                                                  contents_tarball=input_stream
+                                                  or io.BytesIO())
         volume = self.volumes.create(self.volume_name, [
-            VolumeDirectory(Volumes.INPUT_DIRECTORY,
-                            contents_tarball=input_stream or io.BytesIO()),
+            input_volume_object,
             *startup_config.volumes,
             VolumeFile(Volumes.CONFIGURATION_FILE,
                        contents=json.dumps(configuration, indent=2)),
         ])
-        self.containers.run(
-            execution_id=self.execution_id,
-            repository=self.images.repository,
-            tag=snapshot_id,
-            environment=environment,
-            mounts=[Mount(source=volume.name, target=Volumes.VOLUME_MOUNT)],
-            docker_run_args=docker_run_args)
+        mounts = [Mount(source=volume.name, target=Volumes.VOLUME_MOUNT)]
+        if not use_input_volume_cache:
+            self._run_container(snapshot_id, environment, mounts,
+                                docker_run_args)
+            return
+        with self.input_volume_cache.volume_for(
+                input_id, input_stream) as input_volume_name:
+            mounts.append(
+                Mount(source=input_volume_name,
+                      target=Volumes.INPUT_DIRECTORY_PATH,
+                      read_only=True))
+            self._run_container(snapshot_id, environment, mounts,
+                                docker_run_args)
+
+    def _run_container(self, snapshot_id: str, environment: Dict[str, str],
+                       mounts: List[Mount], docker_run_args: Dict[str, str]):
+        self.containers.run(execution_id=self.execution_id,
+                            repository=self.images.repository,
+                            tag=snapshot_id,
+                            environment=environment,
+                            mounts=mounts,
+                            docker_run_args=docker_run_args)
 
     def stop_execution(self):
         self.containers.stop(self.execution_id)
@@ -87,7 +122,7 @@ class DockerInstance(Instance):
         return self.execution_id
 
     def get_instance_type(self) -> str:
-        return 'local'
+        return self.instance_type
 
     def get_max_idle_seconds(self) -> int:
         # Doesn't make sense for local instances
@@ -147,7 +182,8 @@ class DockerInstance(Instance):
                                 exit_status=self.get_status().exit_status,
                                 logs=self.get_logs(since=None),
                                 containers=self.containers,
-                                finish_timestamp=finish_timestamp)
+                                finish_timestamp=finish_timestamp,
+                                instance_type=self.get_instance_type())
 
     @property
     def instance_id(self):
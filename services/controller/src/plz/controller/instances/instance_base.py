@@ -21,6 +21,8 @@ ExecutionInfo = namedtuple('ExecutionInfo', [
     'execution_id', 'running', 'status', 'instance_type', 'max_idle_seconds',
     'idle_since_timestamp', 'instance_id'
 ])
+# Instance whose docker daemon builds a snapshot, and the images in it
+BuildHost = namedtuple('BuildHost', ['instance_id', 'images'])
 
 
 class Instance(Results):
@@ -33,10 +35,13 @@ class Instance(Results):
         self._memoised_lock = None
 
     @abstractmethod
-    def run(self, snapshot_id: str, parameters: Parameters,
+    def run(self,
+            snapshot_id: str,
+            parameters: Parameters,
             input_stream: Optional[io.BytesIO],
             docker_run_args: Dict[str, str],
-            index_range_to_run: Optional[Tuple[int, int]]) -> None:
+            index_range_to_run: Optional[Tuple[int, int]],
+            input_id: Optional[str] = None) -> None:
         pass
 
     def get_status(self) -> InstanceStatus:
@@ -129,7 +134,11 @@ class Instance(Results):
         """Set the underlying resource to not be listed among the live ones"""
         pass
 
-    def harvest(self, results_storage: ResultsStorage):
+    def harvest(self, results_storage: ResultsStorage) -> bool:
+        """
+        :return: whether a tombstone was written for the execution, as its
+            instance was interrupted
+        """
         lock = self._lock
         have_lock = lock.acquire(blocking=False)
         if not have_lock:
@@ -138,7 +147,7 @@ class Instance(Results):
                       f'locked')
             # Do not block waiting for an instance. If the lock is held for
             # too long the provider will kill the instance
-            return
+            return False
         try:
             resource_state = self.get_resource_state()
             execution_id = self.get_execution_id()
@@ -153,19 +162,22 @@ class Instance(Results):
                         log.warning(
                             'There\'s a terminated instance without an '
                             'execution ID associated.')
-                        return
+                        return False
                     with results_storage.get(execution_id) as results:
                         if results is not None:
                             log.debug(f'Instance [{self.instance_id}] for '
                                       f'execution id [{execution_id}] is '
                                       f'terminated and has results')
-                            return
+                            return False
                     log.debug('Writing tombstone for instance '
                               f'[{self.instance_id}] for execution id '
                               f'[{execution_id}]')
+                    forensics = self.get_forensics()
                     results_storage.write_tombstone(
-                        execution_id,
-                        tombstone={'forensics': self.get_forensics()})
+                        execution_id, tombstone={'forensics': forensics})
+                    # Instances can also be gone as they were killed, or ran
+                    # out of uptime
+                    return self.was_interrupted(forensics)
                 finally:
                     log.debug(f'Deleting instance [{self.instance_id}] for '
                               f'execution id [{execution_id}]')
@@ -175,7 +187,7 @@ class Instance(Results):
             if resource_state != 'running':
                 log.info(f'Instance for execution ID [{execution_id}] is '
                          f'[{resource_state}]')
-                return
+                return False
 
             log.debug(f'Instance [{self.instance_id}] for [{execution_id}] '
                       'is running')
@@ -197,7 +209,7 @@ class Instance(Results):
                     # There's no container so don't try to release things
                     # there
                     release_container=False)
-                return
+                return False
             if info.status == 'exited':
                 log.debug(f'Instance {self.instance_id} for execution ID: '
                           f'{execution_id} is exited')
@@ -209,6 +221,7 @@ class Instance(Results):
                     log.error(f'Harvesting: Instance {self.instance_id} for '
                               f'execution ID: {self.get_execution_id()}: '
                               f'{result}')
+            return False
         finally:
             lock.release()
 
@@ -257,6 +270,13 @@ class Instance(Results):
         """Gather information useful when the instance is/was misbehaving"""
         pass
 
+    def was_interrupted(self, forensics: dict) -> bool:
+        """
+        Whether the forensics show that the instance was taken away (as spot
+        instances can be), instead of being terminated on purpose
+        """
+        return False
+
     @property
     @abstractmethod
     def instance_id(self) -> str:
@@ -341,14 +361,29 @@ class InstanceProvider(ABC):
 
         instance_ids_to_messages = {}
         there_is_one_instance = False
-        for instance in self.instance_iterator(only_running=False):
+        instances = list(self.instance_iterator(only_running=False))
+        if ignore_ownership:
+            users_of_executions = {}
+        else:
+            # Look up the owners of all executions at once
+            users_of_executions = \
+                self.results_storage.db_storage.get_users_of_executions([
+                    instance.get_execution_id() for instance in instances
+                    if instance.get_execution_id() != ''
+                ])
+        # Instances running several executions show up once per execution
+        killed_instance_ids = set()
+        for instance in instances:
+            if instance.instance_id in killed_instance_ids:
+                continue
             if not self._must_kill_instance(
                     ignore_ownership, including_idle, instance, instance_ids,
                     instance_ids_to_messages, terminate_all_user_instances,
-                    unprocessed_instance_ids, user):
+                    unprocessed_instance_ids, user, users_of_executions):
                 continue
 
             there_is_one_instance = True
+            killed_instance_ids.add(instance.instance_id)
             try:
                 instance.kill(force_if_not_idle)
             except KillingInstanceException as e:
@@ -370,8 +405,9 @@ class InstanceProvider(ABC):
                             instance: Instance, instance_ids: [str],
                             instance_ids_to_messages: dict,
                             terminate_all_instances: bool,
-                            unprocessed_instance_ids: [str
-                                                       ], user: str) -> bool:
+                            unprocessed_instance_ids: [str], user: str,
+                            users_of_executions: Dict[str, Optional[str]]
+                            ) -> bool:
         if instance.is_terminated():
             return False
 
@@ -392,8 +428,7 @@ class InstanceProvider(ABC):
             # user
             if ignore_ownership:
                 return True
-            if self.results_storage.db_storage.get_user_of_execution(
-                    instance.get_execution_id()) != user:
+            if users_of_executions.get(instance.get_execution_id()) != user:
                 if not terminate_all_instances:
                     # It's an error only if the instance was explicitly named.
                     # If someone just requested "all of them", we silently
@@ -401,20 +436,43 @@ class InstanceProvider(ABC):
                     instance_ids_to_messages[instance.instance_id] = \
                         'Instance is running an execution for a ' \
                         'different user'
-                    unprocessed_instance_ids.remove(instance.instance_id)
+                    if instance.instance_id in unprocessed_instance_ids:
+                        unprocessed_instance_ids.remove(instance.instance_id)
                 return False
             else:
                 return True
 
     @abstractmethod
-    def push(self, image_tag: str):
+    def push(self, image_tag: str, build_host: Optional[BuildHost] = None):
+        """
+        Makes the snapshot available to instances. Might not wait for it, in
+        which case instances wait before pulling the snapshot
+
+        :param build_host: the instance the snapshot was built in, if any.
+            It's released once the push doesn't need it anymore
+        """
+        pass
+
+    def acquire_build_host(self, snapshot_id: str) -> Optional[BuildHost]:
+        """
+        :return: an idle instance to build the snapshot in, or None to build
+            it in the controller
+        """
+        return None
+
+    def release_build_host(self, build_host: BuildHost) -> None:
         pass
 
     @abstractmethod
     def instance_iterator(self, only_running: bool) -> Iterator[Instance]:
         pass
 
-    def harvest(self):
+    def harvest(self) -> List[str]:
+        """
+        :return: the executions that were found without an instance, as it was
+            interrupted, and have a tombstone now
+        """
+        interrupted_execution_ids = []
         for instance in self.instance_iterator(only_running=False):
             log.debug(f'Harvest polling for [{instance.instance_id}], '
                       f'[{instance.get_execution_id()}]')
@@ -430,11 +488,14 @@ class InstanceProvider(ABC):
                     log.debug(
                         f'Calling harvesting on [{instance.instance_id}], '
                         f'[{instance.get_execution_id()}]')
-                    instance.harvest(self.results_storage)
+                    if instance.harvest(self.results_storage):
+                        interrupted_execution_ids.append(
+                            instance.get_execution_id())
             except Exception:
                 # Make sure that an exception thrown while harvesting an
                 # instance doesn't stop the whole harvesting process
                 log.exception('Exception harvesting')
+        return interrupted_execution_ids
 
     def get_executions(self) -> [ExecutionInfo]:
         return [
@@ -448,6 +509,20 @@ class InstanceProvider(ABC):
         """Gather information useful when the instance is/was misbehaving"""
         pass
 
+    def prefetch_snapshot(self, snapshot_id: str) -> None:
+        """
+        Make the snapshot available in instances ahead of time. Doesn't wait
+        for it
+        """
+        pass
+
+    def get_warm_pool_stats(self) -> dict:
+        """
+        For each instance type, the number of instances kept idle and how
+        many executions found an idle instance versus had to start one
+        """
+        return {}
+
 
 class InstanceMissingStateException(Exception):
     pass
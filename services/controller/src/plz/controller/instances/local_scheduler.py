@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from redis import StrictRedis
+
+from plz.controller.containers import ContainerMissingException, Containers
+from plz.controller.instances.resources import Resources, cpus_of, memory_of
+
+log = logging.getLogger(__name__)
+
+# Executions that don't limit their CPUs count as taking one
+_DEFAULT_CPUS = 1
+# Waiting executions report their position at least this often, so that the
+# dispatch doesn't look stale
+_STATUS_INTERVAL_IN_SECONDS = 60
+# Waiters refresh their entry each time they check for a slot. Entries that
+# aren't refreshed for this long belong to a controller process that is gone
+_WAITER_STALE_AFTER_SECONDS = 5 * 60
+# Slots are taken before the container exists, as the volumes need to be
+# created first. A slot without a container for this long is taken as leaked
+_UNSTARTED_SLOT_STALE_AFTER_SECONDS = 60 * 60
+_LOCK_TIMEOUT_SECONDS = 30
+
+
+class LocalScheduler:
+    """
+    Limits the CPUs, memory and number of the containers running in the
+    local host.
+
+    Executions wait in a queue, in order of arrival, until there's room for
+    them. Slots are freed when containers exit, as reported by docker.
+
+    The state is in Redis, so that it's shared by all controller processes.
+    Each process listens to the exit events to wake up its own waiters, and
+    checks periodically in case an event is missed
+    """
+
+    def __init__(self,
+                 redis: StrictRedis,
+                 containers: Containers,
+                 max_cpus: Optional[float] = None,
+                 max_memory_in_bytes: Optional[int] = None,
+                 max_containers: Optional[int] = None,
+                 poll_interval_in_seconds: float = 5):
+        self.redis = redis
+        self.containers = containers
+        # The CPUs and memory of the docker host are taken when not given
+        self.max_cpus = max_cpus
+        self.max_memory_in_bytes = max_memory_in_bytes
+        self.max_containers = max_containers
+        self.poll_interval_in_seconds = poll_interval_in_seconds
+        self._exits = threading.Condition()
+        # Threads don't survive forking, so check that the listener was
+        # started in this process
+        self._listener_pid: Optional[int] = None
+        self._listener_lock = threading.Lock()
+
+    def wait_for_slot(self, execution_id: str,
+                      docker_run_args: dict) -> Iterator[dict]:
+        """
+        Waits until there's room for the execution in the host, taking it.
+
+        Yields statuses with the position of the execution while waiting
+        """
+        self._start_listener()
+        requirements = _requirements_of(docker_run_args)
+        self.redis.zadd(_queue_key(), {execution_id: time.time()}, nx=True)
+        occupied = False
+        try:
+            last_ahead = None
+            last_status_time = 0
+            while True:
+                ahead = self._try_to_occupy(execution_id, requirements)
+                if ahead is None:
+                    occupied = True
+                    return
+                now = time.time()
+                if ahead != last_ahead or \
+                        now - last_status_time >= _STATUS_INTERVAL_IN_SECONDS:
+                    yield {
+                        'message': 'waiting for local resources '
+                                   f'({ahead} executions ahead)'
+                    }
+                    last_ahead = ahead
+                    last_status_time = now
+                with self._exits:
+                    self._exits.wait(timeout=self.poll_interval_in_seconds)
+        finally:
+            if not occupied:
+                self._leave_queue(execution_id)
+
+    def started(self, execution_id: str) -> None:
+        """Records that the container of the execution is there"""
+        slot = self.redis.hget(_slots_key(), execution_id)
+        if slot is None:
+            return
+        slot = json.loads(str(slot, 'utf-8'))
+        slot['started'] = True
+        self.redis.hset(_slots_key(), execution_id, json.dumps(slot))
+
+    def vacate(self, execution_id: str) -> None:
+        if self.redis.hdel(_slots_key(), execution_id) == 0:
+            return
+        log.debug(f'Vacated the slot of {execution_id}')
+        with self._exits:
+            self._exits.notify_all()
+
+    def _try_to_occupy(self, execution_id: str,
+                       requirements: Resources) -> Optional[int]:
+        """
+        :return: None if the execution took a slot, or the number of
+            executions ahead of it otherwise
+        """
+        with self.redis.lock(f'lock:{__name__}#slots',
+                             timeout=_LOCK_TIMEOUT_SECONDS):
+            now = time.time()
+            self.redis.hset(_waiters_key(), execution_id, now)
+            self._drop_stale_waiters(now)
+            ahead = self.redis.zrank(_queue_key(), execution_id)
+            if ahead is None:
+                # Dropped as stale, but it's still here
+                self.redis.zadd(_queue_key(), {execution_id: now})
+                ahead = self.redis.zrank(_queue_key(), execution_id)
+            if ahead > 0:
+                return ahead
+            slots = self._slots()
+            if not self._fits(requirements, slots):
+                self._drop_leaked_slots(slots, now)
+                if not self._fits(requirements, slots):
+                    return 0
+            pipeline = self.redis.pipeline()
+            pipeline.zrem(_queue_key(), execution_id)
+            pipeline.hdel(_waiters_key(), execution_id)
+            pipeline.hset(
+                _slots_key(), execution_id,
+                json.dumps({
+                    'cpus': requirements.cpus,
+                    'memory_in_bytes': requirements.memory_in_bytes,
+                    'since': now,
+                    'started': False
+                }))
+            pipeline.execute()
+            return None
+
+    def _fits(self, requirements: Resources, slots: Dict[str, dict]) -> bool:
+        if len(slots) == 0:
+            # Executions asking for more than there is run on their own
+            return True
+        if self.max_containers is not None \
+                and len(slots) >= self.max_containers:
+            return False
+        capacity = self._capacity()
+        cpus = requirements.cpus + sum(s['cpus'] for s in slots.values())
+        memory_in_bytes = requirements.memory_in_bytes + sum(
+            s['memory_in_bytes'] for s in slots.values())
+        return cpus <= capacity.cpus \
+            and memory_in_bytes <= capacity.memory_in_bytes
+
+    def _capacity(self) -> Resources:
+        if self.max_cpus is None or self.max_memory_in_bytes is None:
+            info = self.containers.docker_client.info()
+            if self.max_cpus is None:
+                self.max_cpus = info['NCPU']
+            if self.max_memory_in_bytes is None:
+                self.max_memory_in_bytes = info['MemTotal']
+        return Resources(cpus=self.max_cpus,
+                         memory_in_bytes=self.max_memory_in_bytes)
+
+    def _slots(self) -> Dict[str, dict]:
+        return {
+            str(execution_id, 'utf-8'): json.loads(str(slot, 'utf-8'))
+            for execution_id, slot in self.redis.hgetall(_slots_key()).items()
+        }
+
+    def _drop_leaked_slots(self, slots: Dict[str, dict], now: float) -> None:
+        """Drops the slots whose containers exited without us noticing"""
+        for execution_id, slot in list(slots.items()):
+            if slot['started']:
+                try:
+                    leaked = not self.containers.get_state(
+                        execution_id).running
+                except ContainerMissingException:
+                    leaked = True
+            else:
+                leaked = \
+                    now - slot['since'] > _UNSTARTED_SLOT_STALE_AFTER_SECONDS
+            if leaked:
+                log.warning(f'Dropping leaked slot of {execution_id}')
+                self.redis.hdel(_slots_key(), execution_id)
+                del slots[execution_id]
+
+    def _drop_stale_waiters(self, now: float) -> None:
+        for execution_id, last_seen in self.redis.hgetall(
+                _waiters_key()).items():
+            if now - float(last_seen) > _WAITER_STALE_AFTER_SECONDS:
+                execution_id = str(execution_id, 'utf-8')
+                log.warning(f'Dropping stale waiter {execution_id}')
+                self._leave_queue(execution_id)
+
+    def _leave_queue(self, execution_id: str) -> None:
+        pipeline = self.redis.pipeline()
+        pipeline.zrem(_queue_key(), execution_id)
+        pipeline.hdel(_waiters_key(), execution_id)
+        pipeline.execute()
+
+    def _start_listener(self) -> None:
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen_forever, daemon=True).start()
+
+    def _listen_forever(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                for execution_id in self.containers.exits():
+                    self.vacate(execution_id)
+            except Exception:
+                log.exception('Exception listening to container exits')
+            time.sleep(self.poll_interval_in_seconds)
+
+
+def _requirements_of(docker_run_args: dict) -> Resources:
+    cpus = cpus_of(docker_run_args)
+    memory_in_bytes = memory_of(docker_run_args)
+    return Resources(cpus=cpus if cpus is not None else _DEFAULT_CPUS,
+                     memory_in_bytes=memory_in_bytes or 0)
+
+
+def _queue_key() -> str:
+    return f'key:{__name__}#queue'
+
+
+def _waiters_key() -> str:
+    return f'key:{__name__}#waiters'
+
+
+def _slots_key() -> str:
+    return f'key:{__name__}#slots'
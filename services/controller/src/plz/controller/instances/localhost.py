@@ -6,9 +6,11 @@ from redis import StrictRedis
 
 from plz.controller.containers import Containers
 from plz.controller.images import Images
+from plz.controller.input_volume_cache import InputVolumeCache
 from plz.controller.instances.docker import DockerInstance
 from plz.controller.instances.instance_base \
-    import Instance, InstanceProvider, Parameters
+    import BuildHost, Instance, InstanceProvider, Parameters
+from plz.controller.instances.local_scheduler import LocalScheduler
 from plz.controller.results.results_base import ResultsStorage
 from plz.controller.volumes import Volumes
 
@@ -16,15 +18,23 @@ log = logging.getLogger(__name__)
 
 
 class Localhost(InstanceProvider):
-    def __init__(self, results_storage: ResultsStorage, images: Images,
-                 containers: Containers, volumes: Volumes, redis: StrictRedis,
-                 instance_lock_timeout: int):
+    def __init__(self,
+                 results_storage: ResultsStorage,
+                 images: Images,
+                 containers: Containers,
+                 volumes: Volumes,
+                 redis: StrictRedis,
+                 instance_lock_timeout: int,
+                 input_volume_cache: Optional[InputVolumeCache] = None,
+                 scheduler: Optional[LocalScheduler] = None):
         super().__init__(results_storage, instance_lock_timeout)
         self.images = images
         self.containers = containers
         self.volumes = volumes
         self.results_storage = results_storage
         self.redis = redis
+        self.input_volume_cache = input_volume_cache
+        self.scheduler = scheduler
 
     def run_in_instance(self, execution_id: str, snapshot_id: str,
                         parameters: Parameters,
@@ -32,17 +42,33 @@ class Localhost(InstanceProvider):
                         instance_market_spec: dict,
                         execution_spec: dict) -> Iterator[Dict[str, Any]]:
         """
-        Runs a job in an instance, that happens to be always the localhost
+        Runs a job in an instance, that happens to be always the localhost.
+
+        With a scheduler, the job waits until there's room for it in the host
         """
+        docker_run_args = execution_spec['docker_run_args']
+        if self.scheduler is not None:
+            yield from self.scheduler.wait_for_slot(execution_id,
+                                                    docker_run_args)
         instance = DockerInstance(self.images, self.containers, self.volumes,
                                   execution_id, self.redis,
-                                  self.instance_lock_timeout)
-        instance.run(snapshot_id=snapshot_id,
-                     parameters=parameters,
-                     input_stream=input_stream,
-                     docker_run_args=execution_spec['docker_run_args'],
-                     index_range_to_run=execution_spec['index_range_to_run'])
-        return iter([{'instance': instance}])
+                                  self.instance_lock_timeout,
+                                  self.input_volume_cache)
+        try:
+            instance.run(
+                snapshot_id=snapshot_id,
+                parameters=parameters,
+                input_stream=input_stream,
+                docker_run_args=docker_run_args,
+                index_range_to_run=execution_spec['index_range_to_run'],
+                input_id=execution_spec.get('input_id'))
+        except Exception:
+            if self.scheduler is not None:
+                self.scheduler.vacate(execution_id)
+            raise
+        if self.scheduler is not None:
+            self.scheduler.started(execution_id)
+        yield {'instance': instance}
 
     def instance_for(self, execution_id: str) -> Optional[Instance]:
         """
@@ -51,21 +77,24 @@ class Localhost(InstanceProvider):
         As we're dealing with `localhost` here, it's always the same instance,
         but the return value knows about the container under the hood.
         """
-        if execution_id not in self.containers.execution_ids():
-            log.error(f'Looking for:{execution_id}')
-            log.error(f'Names are:{self.containers.execution_ids()}')
+        if self.containers.from_execution_id(execution_id) is None:
+            log.error(f'No container for {execution_id}')
             return None
+        return self._instance_for(execution_id)
+
+    def _instance_for(self, execution_id: str) -> DockerInstance:
         return DockerInstance(self.images, self.containers, self.volumes,
                               execution_id, self.redis,
                               self.instance_lock_timeout)
 
-    def push(self, image_tag: str):
+    def push(self, image_tag: str, build_host: Optional[BuildHost] = None):
         pass
 
     def instance_iterator(self, only_running: bool) \
             -> Iterator[Instance]:
+        # The containers were just listed, no need to look them up again
         return iter(
-            self.instance_for(execution_id)
+            self._instance_for(execution_id)
             for execution_id in self.containers.execution_ids())
 
     def get_forensics(self, execution_id) -> dict:
@@ -0,0 +1,46 @@
+import collections
+from typing import Optional
+
+import docker.utils
+
+Resources = collections.namedtuple('Resources', ['cpus', 'memory_in_bytes'])
+
+_DEFAULT_CPU_PERIOD = 100000
+
+
+def requirements_of(docker_run_args: dict) -> Optional[Resources]:
+    """
+    Resources that the execution is limited to by its docker run arguments.
+
+    :return: None if either the CPUs or the memory aren't limited, as then
+        the execution can take all of the instance
+    """
+    cpus = cpus_of(docker_run_args)
+    memory_in_bytes = memory_of(docker_run_args)
+    if cpus is None or memory_in_bytes is None:
+        return None
+    return Resources(cpus=cpus, memory_in_bytes=memory_in_bytes)
+
+
+def cpus_of(docker_run_args: dict) -> Optional[float]:
+    """:return: the CPUs the execution is limited to, None if not limited"""
+    if 'nano_cpus' in docker_run_args:
+        return int(docker_run_args['nano_cpus']) / 10**9
+    if 'cpu_quota' in docker_run_args:
+        return int(docker_run_args['cpu_quota']) / int(
+            docker_run_args.get('cpu_period', _DEFAULT_CPU_PERIOD))
+    if 'cpuset_cpus' in docker_run_args:
+        cpus = 0
+        for cpu_range in str(docker_run_args['cpuset_cpus']).split(','):
+            first, _, last = cpu_range.partition('-')
+            cpus += int(last) - int(first) + 1 if last else 1
+        return cpus
+    return None
+
+
+def memory_of(docker_run_args: dict) -> Optional[int]:
+    """:return: the memory the execution is limited to, None if not limited"""
+    mem_limit = docker_run_args.get('mem_limit')
+    if mem_limit is None:
+        return None
+    return docker.utils.parse_bytes(mem_limit)
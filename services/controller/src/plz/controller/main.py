@@ -120,6 +120,16 @@ def root():
     return jsonify({})
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats_entrypoint():
+    # Each worker process has its own cache, this is the one of the worker
+    # serving the request
+    return jsonify({
+        'pid': os.getpid(),
+        **controller.immutable_records_cache.stats()
+    })
+
+
 @app.route(f'/executions', methods=['POST'])
 def run_execution_entrypoint():
     snapshot_id = request.json['snapshot_id']
@@ -172,6 +182,16 @@ def rerun_execution_entrypoint():
                     status=requests.codes.accepted)
 
 
+@app.route('/executions/<execution_id>/dispatch', methods=['GET'])
+def get_dispatch_statuses_entrypoint(execution_id):
+    @_json_stream
+    @stream_with_context
+    def act() -> Iterator[dict]:
+        yield from controller.get_dispatch_statuses(execution_id)
+
+    return Response(act(), mimetype='text/plain', status=requests.codes.ok)
+
+
 @app.route('/executions/list', methods=['GET'])
 def list_executions_entrypoint():
     user: str = request.args.get('user', type=str)
@@ -257,6 +277,31 @@ def create_snapshot():
     return Response(act(), mimetype='text/plain')
 
 
+@app.route('/snapshots/builds/stats', methods=['GET'])
+def build_stats_entrypoint():
+    return jsonify(controller.build_scheduler.stats())
+
+
+@app.route('/snapshots/files/missing', methods=['POST'])
+def get_missing_build_context_files_entrypoint():
+    return jsonify({
+        'missing':
+            controller.get_missing_build_context_files(request.json['digests'])
+    })
+
+
+@app.route('/snapshots/files', methods=['POST'])
+def put_build_context_files_entrypoint():
+    controller.put_build_context_files(request.stream)
+    return jsonify({})
+
+
+@app.route('/snapshots/<user>/<project>/<context_digest>', methods=['GET'])
+def get_snapshot_id_entrypoint(user: str, project: str, context_digest: str):
+    return jsonify(
+        {'id': controller.get_snapshot_id(user, project, context_digest)})
+
+
 @app.route('/data/input/<input_id>', methods=['PUT'])
 def put_input_entrypoint(input_id: str):
     input_metadata = _get_input_metadata_from_request()
@@ -294,6 +339,11 @@ def last_execution_id_entrypoint(user: str):
     return jsonify(response_object)
 
 
+@app.route('/instances/warm_pool/stats', methods=['GET'])
+def get_warm_pool_stats_entrypoint():
+    return jsonify(controller.instance_provider.get_warm_pool_stats())
+
+
 @app.route(f'/instances/kill', methods=['POST'])
 def kill_instances_entrypoint():
     # Internally, we represent "all of them" by setting the list of instance
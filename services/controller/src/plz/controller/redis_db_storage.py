@@ -1,12 +1,16 @@
 import json
 import logging
-from typing import Set, Optional
+from typing import Dict, Optional, Set, Tuple
 
 from redis import StrictRedis
+from redis.client import Pipeline
 
 from plz.controller.db_storage import DBStorage
-from plz.controller.execution_composition import ExecutionComposition, \
-    AtomicComposition, IndicesComposition
+from plz.controller.execution_composition import AtomicComposition, \
+    ExecutionComposition, IndexRanges, IndicesComposition
+from plz.controller.execution_metadata import \
+    apply_sub_execution_start_metadata_delta, is_sub_execution, \
+    sub_execution_start_metadata_delta
 
 log = logging.getLogger(__name__)
 
@@ -18,22 +22,63 @@ class RedisDBStorage(DBStorage):
 
     def store_start_metadata(self, execution_id: str,
                              start_metadata: dict) -> None:
-        self.redis.hset('start_metadata', execution_id,
-                        json.dumps(start_metadata))
+        pipeline = self.redis.pipeline()
+        pipeline.hset('start_metadata', execution_id,
+                      json.dumps(start_metadata))
+        self._index_started_execution(pipeline, start_metadata)
+        pipeline.execute()
+
+    def store_start_metadatas(self, start_metadatas: [dict]) -> None:
+        # Sub-executions of a big parallel execution have almost the same
+        # metadata as their parent, so we store only what's different
+        stored_execution_ids = {m['execution_id'] for m in start_metadatas}
+        pipeline = self.redis.pipeline()
+        for start_metadata in start_metadatas:
+            execution_id = start_metadata['execution_id']
+            if is_sub_execution(start_metadata) and \
+                    start_metadata['parent_execution_id'] \
+                    in stored_execution_ids:
+                pipeline.hset(
+                    'start_metadata_delta', execution_id,
+                    json.dumps(
+                        sub_execution_start_metadata_delta(start_metadata)))
+            else:
+                pipeline.hset('start_metadata', execution_id,
+                              json.dumps(start_metadata))
+            self._index_started_execution(pipeline, start_metadata)
+        pipeline.execute()
+
+    @staticmethod
+    def _index_started_execution(pipeline: Pipeline,
+                                 start_metadata: dict) -> None:
+        # Secondary index, so that we don't need to read and parse the whole
+        # start metadata to know who an execution belongs to
+        pipeline.hset('execution_user', start_metadata['execution_id'],
+                      start_metadata['user'])
 
     def retrieve_start_metadata(self, execution_id: str) -> dict:
-        start_metadata_bytes = self.redis.hget('start_metadata', execution_id)
-        if start_metadata_bytes is None:
+        pipeline = self.redis.pipeline()
+        pipeline.hget('start_metadata', execution_id)
+        pipeline.hget('start_metadata_delta', execution_id)
+        start_metadata_bytes, delta_bytes = pipeline.execute()
+        if start_metadata_bytes is not None:
+            return json.loads(str(start_metadata_bytes, 'utf-8'))
+        if delta_bytes is None:
             raise ValueError(f'No start metadata available for {execution_id}')
-        start_metadata = str(start_metadata_bytes, 'utf-8')
-        return json.loads(str(start_metadata))
+        delta = json.loads(str(delta_bytes, 'utf-8'))
+        return apply_sub_execution_start_metadata_delta(
+            self.retrieve_start_metadata(delta['parent_execution_id']), delta)
 
-    def add_finished_execution_id(self, user: str, project: str,
-                                  execution_id: str):
-        self.redis.sadd(f'finished_execution_ids_for_user#{user}',
-                        execution_id)
-        self.redis.sadd(f'finished_execution_ids_for_project#{project}',
-                        execution_id)
+    def add_finished_execution_id(self,
+                                  user: str,
+                                  project: str,
+                                  execution_id: str,
+                                  finish_timestamp: Optional[int] = None):
+        pipeline = self.redis.pipeline()
+        pipeline.sadd(f'finished_execution_ids_for_user#{user}', execution_id)
+        pipeline.sadd(f'finished_execution_ids_for_project#{project}',
+                      execution_id)
+        pipeline.execute()
 
     def retrieve_finished_execution_ids(self, user: str,
                                         project: str) -> Set[str]:
@@ -45,28 +90,67 @@ class RedisDBStorage(DBStorage):
             ])
         }
 
+    def get_user_of_execution(self, execution_id: str) -> str:
+        return self.get_users_of_executions([execution_id])[execution_id]
+
+    def get_users_of_executions(self, execution_ids: [str]) \
+            -> Dict[str, Optional[str]]:
+        if len(execution_ids) == 0:
+            return {}
+        users_bytes = self.redis.hmget('execution_user', execution_ids)
+        users = {}
+        for execution_id, user_bytes in zip(execution_ids, users_bytes):
+            if user_bytes is not None:
+                users[execution_id] = str(user_bytes, 'utf-8')
+            else:
+                # Started before the indexes existed
+                try:
+                    users[execution_id] = \
+                        self.retrieve_start_metadata(execution_id)['user']
+                except ValueError:
+                    log.warning(f'Cannot find the user of {execution_id}')
+                    users[execution_id] = None
+        return users
+
     def store_execution_composition(self,
                                     execution_composition: ExecutionComposition
                                     ) -> None:
+        # Compositions can have thousands of indices, so we write all of it
+        # in a single round trip
+        pipeline = self.redis.pipeline()
+        self._store_execution_composition_in(pipeline, execution_composition)
+        pipeline.execute()
+
+    def _store_execution_composition_in(
+            self, pipeline: Pipeline,
+            execution_composition: ExecutionComposition) -> None:
         execution_id = execution_composition.execution_id
         if isinstance(execution_composition, AtomicComposition):
-            self.redis.hset('execution_composition_type', execution_id,
-                            'atomic')
+            pipeline.hset('execution_composition_type', execution_id, 'atomic')
         elif isinstance(execution_composition, IndicesComposition):
             execution_composition: IndicesComposition = execution_composition
-            index_bottom_range = min(
-                execution_composition.indices_to_compositions.keys())
-            index_top_range = max(
-                execution_composition.indices_to_compositions.keys()) + 1
-            self.redis.hset('execution_composition_type',
-                            execution_composition.execution_id,
-                            f'indices#{index_bottom_range}#{index_top_range}')
-            idxs_cs = execution_composition.indices_to_compositions
-            for index, comp in idxs_cs.items():
-                self.store_execution_composition(comp)
-                self.redis.hset(
-                    f'composition_index_to_execution#{execution_id}', index,
-                    comp.execution_id)
+            index_ranges = list(
+                execution_composition.indices_to_compositions.ranges())
+            index_bottom_range = index_ranges[0][0]
+            index_top_range = index_ranges[-1][1]
+            pipeline.hset('execution_composition_type',
+                          execution_composition.execution_id,
+                          f'indices#{index_bottom_range}#{index_top_range}')
+            # Several ranges might map to the same sub-execution, store each
+            # one only once
+            sub_compositions = {
+                comp.execution_id: comp
+                for _, _, comp in index_ranges
+            }
+            for comp in sub_compositions.values():
+                self._store_execution_composition_in(pipeline, comp)
+            # Scored by their start, so that the range of an index is the one
+            # with the greatest start not above it
+            pipeline.zadd(
+                _index_ranges_key(execution_id), {
+                    f'{start}#{end}#{comp.execution_id}': start
+                    for start, end, comp in index_ranges
+                })
         else:
             raise ValueError('Execution composition of unknown type: '
                              f'{execution_composition}')
@@ -75,6 +159,12 @@ class RedisDBStorage(DBStorage):
             -> ExecutionComposition:
         composition_type_bytes = self.redis.hget('execution_composition_type',
                                                  execution_id)
+        return self._composition_from_type(execution_id,
+                                           composition_type_bytes)
+
+    def _composition_from_type(self, execution_id: str,
+                               composition_type_bytes: Optional[bytes]) \
+            -> ExecutionComposition:
         # If there's nothing, assume it's a plain old atomic
         if composition_type_bytes is None:
             log.warning(f'Cannot composition type for {execution_id}. '
@@ -89,27 +179,74 @@ class RedisDBStorage(DBStorage):
                 raise ValueError(
                     f'Wrong composition for execution ID {execution_id}: '
                     f'{composition_type}')
-            indices_to_execution_ids = {
-                i: self.retrieve_execution_composition(
-                    self.retrieve_execution_id_from_parent_and_index(
-                        execution_id, i))
-                for i in range(int(index_bounds[0]), int(index_bounds[1]))
-            }
-            return IndicesComposition(
-                execution_id, indices_to_execution_ids,
-                self.retrieve_tombstone_sub_execution_ids(execution_id))
+            return self._retrieve_indices_composition(execution_id)
         else:
             raise ValueError(f'Unknown composition type {composition_type} for'
                              f'execution ID {execution_id}')
 
+    def _retrieve_indices_composition(self, execution_id: str) \
+            -> IndicesComposition:
+        pipeline = self.redis.pipeline()
+        pipeline.zrange(_index_ranges_key(execution_id), 0, -1)
+        # Compositions stored before index ranges were introduced have a
+        # map with an entry per index
+        pipeline.hgetall(f'composition_index_to_execution#{execution_id}')
+        pipeline.smembers(f'tombstone_executions#{execution_id}')
+        index_ranges_bytes, index_to_execution_bytes, tombstone_bytes = \
+            pipeline.execute()
+        index_ranges = []
+        for index_range_bytes in index_ranges_bytes:
+            index_ranges.append(_parse_index_range(index_range_bytes))
+        for index_bytes, sub_execution_id in index_to_execution_bytes.items():
+            index = int(index_bytes)
+            index_ranges.append(
+                (index, index + 1, str(sub_execution_id, 'utf-8')))
+        index_ranges.sort()
+        # Get the types of all sub-executions at once
+        sub_execution_ids = list(set(r[2] for r in index_ranges))
+        if len(sub_execution_ids) > 0:
+            sub_types_bytes = self.redis.hmget('execution_composition_type',
+                                               sub_execution_ids)
+        else:
+            sub_types_bytes = []
+        sub_compositions = {
+            sub_execution_id:
+            self._composition_from_type(sub_execution_id, sub_type_bytes)
+            for sub_execution_id, sub_type_bytes in zip(
+                sub_execution_ids, sub_types_bytes)
+        }
+        indices_to_compositions = IndexRanges()
+        for start, end, sub_execution_id in index_ranges:
+            indices_to_compositions.assign(start, end,
+                                           sub_compositions[sub_execution_id])
+        return IndicesComposition(
+            execution_id, indices_to_compositions,
+            set(str(e, 'utf-8') for e in tombstone_bytes))
+
     def retrieve_execution_id_from_parent_and_index(self, execution_id: str,
                                                     index: int
                                                     ) -> Optional[str]:
-        execution_bytes = self.redis.hget(
-            f'composition_index_to_execution#{execution_id}', index)
-        if execution_bytes is None:
-            return None
-        return str(execution_bytes, 'utf-8')
+        pipeline = self.redis.pipeline()
+        pipeline.zrevrangebyscore(_index_ranges_key(execution_id),
+                                  index,
+                                  '-inf',
+                                  start=0,
+                                  num=1)
+        pipeline.hget(f'composition_index_to_execution#{execution_id}', index)
+        index_ranges_bytes, sub_execution_id_bytes = pipeline.execute()
+        if len(index_ranges_bytes) > 0:
+            _, end, sub_execution_id = _parse_index_range(
+                index_ranges_bytes[0])
+            if index < end:
+                return sub_execution_id
+        if sub_execution_id_bytes is not None:
+            return str(sub_execution_id_bytes, 'utf-8')
+        return None
+
+    def add_tombstone_sub_execution_id(self, execution_id: str,
+                                       sub_execution_id: str) -> None:
+        self.redis.sadd(f'tombstone_executions#{execution_id}',
+                        sub_execution_id)
 
     def retrieve_tombstone_sub_execution_ids(self, execution_id: str) -> set():
         execution_ids_bytes = self.redis.smembers(
@@ -117,3 +254,13 @@ class RedisDBStorage(DBStorage):
         if execution_ids_bytes is None:
             return set()
         return set(str(e, 'utf-8') for e in execution_ids_bytes)
+
+
+def _index_ranges_key(execution_id: str) -> str:
+    return f'composition_index_range_starts#{execution_id}'
+
+
+def _parse_index_range(index_range_bytes: bytes) -> Tuple[int, int, str]:
+    start, end, sub_execution_id = str(index_range_bytes,
+                                       'utf-8').split('#', 2)
+    return int(start), int(end), sub_execution_id
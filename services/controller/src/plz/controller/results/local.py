@@ -2,6 +2,7 @@ import json
 import logging
 import os
 import shutil
+from copy import deepcopy
 from typing import Any, ContextManager, Iterator, Optional, Tuple
 
 from redis import StrictRedis
@@ -14,7 +15,10 @@ from plz.controller.api.exceptions import AbortedExecutionException, \
     NotImplementedControllerException
 from plz.controller.execution_composition import InstanceComposition, \
     subdir_name_for_index
-from plz.controller.execution_metadata import compile_metadata_for_storage
+from plz.controller.execution_metadata import \
+    compile_metadata_for_storage, is_sub_execution
+from plz.controller.immutable_records_cache import ImmutableRecord, \
+    ImmutableRecordsCache
 from plz.controller.results.results_base import InstanceStatus, \
     InstanceStatusFailure, InstanceStatusSuccess, Results, ResultsContext, \
     ResultsStorage
@@ -26,15 +30,20 @@ CHUNK_SIZE = 1024 * 1024  # 1 MB
 
 class LocalResultsStorage(ResultsStorage):
     def __init__(self, redis: StrictRedis, db_storage: DBStorage,
-                 directory: str):
+                 directory: str, cache: ImmutableRecordsCache):
         super().__init__(db_storage)
         self.redis = redis
         self.db_storage = db_storage
         self.directory = directory
-
-    def publish(self, execution_id: str, exit_status: int,
-                logs: Iterator[bytes], containers: Containers,
-                finish_timestamp: int):
+        self.cache = cache
+
+    def publish(self,
+                execution_id: str,
+                exit_status: int,
+                logs: Iterator[bytes],
+                containers: Containers,
+                finish_timestamp: int,
+                instance_type: Optional[str] = None):
         paths = Paths(self.directory, execution_id)
         with self._lock(execution_id):
             log.debug(f'Checking if results exist for {execution_id}')
@@ -51,7 +60,7 @@ class LocalResultsStorage(ResultsStorage):
             write_bytes(paths.logs, logs)
             metadata = compile_metadata_for_storage(
                 self.db_storage.retrieve_start_metadata(execution_id),
-                finish_timestamp)
+                finish_timestamp, instance_type)
             index_range_to_run = metadata['execution_spec'].get(
                 'index_range_to_run')
 
@@ -66,7 +75,8 @@ class LocalResultsStorage(ResultsStorage):
             self.db_storage.add_finished_execution_id(
                 user=metadata['user'],
                 project=metadata['project'],
-                execution_id=execution_id)
+                execution_id=execution_id,
+                finish_timestamp=finish_timestamp)
 
     def write_tombstone(self, execution_id: str, tombstone: object) -> None:
         paths = Paths(self.directory, execution_id)
@@ -79,10 +89,21 @@ class LocalResultsStorage(ResultsStorage):
                 tombstone_file.write(tombstone_json)
             with open(paths.finished_file, 'w') as _:  # noqa: F841 (unused)
                 pass
+            start_metadata = self.db_storage.retrieve_start_metadata(
+                execution_id)
+            if is_sub_execution(start_metadata):
+                self.db_storage.add_tombstone_sub_execution_id(
+                    start_metadata['parent_execution_id'], execution_id)
 
     def get(self, execution_id: str) -> ContextManager[Optional[Results]]:
         paths = Paths(self.directory, execution_id)
-        return LocalResultsContext(paths, self._lock(execution_id))
+        # The lock is there to wait for results being written. Once they are,
+        # they don't change, so there's no need to take it
+        if self.is_finished(execution_id):
+            lock = None
+        else:
+            lock = self._lock(execution_id)
+        return LocalResultsContext(paths, lock, execution_id, self.cache)
 
     def _lock(self, execution_id: str):
         lock_name = f'lock:{__name__}.{self.__class__.__name__}:{execution_id}'
@@ -91,35 +112,47 @@ class LocalResultsStorage(ResultsStorage):
 
     def is_finished(self, execution_id: str):
         paths = Paths(self.directory, execution_id)
-        return os.path.exists(paths.finished_file)
+        # An execution that hasn't finished yet might finish at any time
+        return self.cache.get(ImmutableRecord.FINISHED,
+                              execution_id,
+                              lambda: os.path.exists(paths.finished_file),
+                              should_cache=lambda finished: finished)
 
 
 class LocalResultsContext(ResultsContext):
-    def __init__(self, paths: 'Paths', lock: Lock):
+    def __init__(self, paths: 'Paths', lock: Optional[Lock], execution_id: str,
+                 cache: ImmutableRecordsCache):
         self.paths = paths
         self.lock = lock
+        self.execution_id = execution_id
+        self.cache = cache
 
     def __enter__(self):
-        self.lock.acquire()
+        if self.lock is not None:
+            self.lock.acquire()
         if os.path.exists(self.paths.finished_file):
             if os.path.exists(self.paths.tombstone_file):
                 return LocalTombstone(self.paths)
             else:
-                return LocalResults(self.paths)
+                return LocalResults(self.paths, self.execution_id, self.cache)
         else:
             return None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.lock.release()
+        if self.lock is not None:
+            self.lock.release()
 
 
 class LocalResults(Results):
-    def __init__(self, paths: 'Paths'):
+    def __init__(self, paths: 'Paths', execution_id: str,
+                 cache: ImmutableRecordsCache):
         self.paths = paths
+        self.execution_id = execution_id
+        self.cache = cache
 
     def get_status(self) -> InstanceStatus:
-        with open(self.paths.exit_status) as f:
-            status = int(f.read())
+        status = self.cache.get(ImmutableRecord.EXIT_STATUS, self.execution_id,
+                                self._read_exit_status)
         if status == 0:
             return InstanceStatusSuccess()
         else:
@@ -144,6 +177,16 @@ class LocalResults(Results):
         return read_bytes(self.paths.measures(subdir_name_for_index(index)))
 
     def get_stored_metadata(self) -> dict:
+        # Callers are free to modify what they get
+        return deepcopy(
+            self.cache.get(ImmutableRecord.STORED_METADATA, self.execution_id,
+                           self._read_stored_metadata))
+
+    def _read_exit_status(self) -> int:
+        with open(self.paths.exit_status) as f:
+            return int(f.read())
+
+    def _read_stored_metadata(self) -> dict:
         with open(self.paths.metadata, 'r') as metadata_file:
             return json.load(metadata_file)
 
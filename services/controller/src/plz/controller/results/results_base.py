@@ -13,9 +13,13 @@ class ResultsStorage(ABC):
         self.db_storage = db_storage
 
     @abstractmethod
-    def publish(self, execution_id: str, exit_status: int,
-                logs: Iterator[bytes], containers: Containers,
-                finish_timestamp: int):
+    def publish(self,
+                execution_id: str,
+                exit_status: int,
+                logs: Iterator[bytes],
+                containers: Containers,
+                finish_timestamp: int,
+                instance_type: Optional[str] = None):
         pass
 
     @abstractmethod
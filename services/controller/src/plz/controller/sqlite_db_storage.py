@@ -0,0 +1,320 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import ContextManager, Dict, Optional, Set
+
+from plz.controller.db_storage import DBStorage, ExecutionState
+from plz.controller.execution_composition import AtomicComposition, \
+    ExecutionComposition, IndexRanges, IndicesComposition
+from plz.controller.execution_metadata import \
+    apply_sub_execution_start_metadata_delta, is_atomic, is_sub_execution, \
+    sub_execution_start_metadata_delta
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait for other processes holding the write lock
+_BUSY_TIMEOUT_SECONDS = 30
+# SQLite limits the number of parameters in a query
+_MAX_QUERY_PARAMETERS = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS executions (
+    execution_id TEXT PRIMARY KEY,
+    user TEXT,
+    project TEXT,
+    parent_execution_id TEXT,
+    -- NULL for sub-executions stored as a delta over their parent
+    start_metadata TEXT,
+    index_range_start INTEGER,
+    index_range_end INTEGER,
+    -- NULL for executions that don't run by themselves
+    state TEXT,
+    finish_timestamp INTEGER,
+    composition_type TEXT
+);
+CREATE INDEX IF NOT EXISTS executions_user_project_state
+    ON executions (user, project, state);
+CREATE INDEX IF NOT EXISTS executions_project
+    ON executions (project);
+CREATE INDEX IF NOT EXISTS executions_finish_timestamp
+    ON executions (finish_timestamp);
+CREATE INDEX IF NOT EXISTS executions_parent_execution_id
+    ON executions (parent_execution_id);
+
+CREATE TABLE IF NOT EXISTS composition_index_ranges (
+    execution_id TEXT NOT NULL,
+    range_start INTEGER NOT NULL,
+    range_end INTEGER NOT NULL,
+    sub_execution_id TEXT NOT NULL,
+    PRIMARY KEY (execution_id, range_start)
+);
+
+CREATE TABLE IF NOT EXISTS tombstone_sub_executions (
+    execution_id TEXT NOT NULL,
+    sub_execution_id TEXT NOT NULL,
+    PRIMARY KEY (execution_id, sub_execution_id)
+);
+'''
+
+
+class SQLiteDBStorage(DBStorage):
+    """
+    Keeps the metadata in an embedded SQLite database, for deployments where
+    the controller runs in a single node
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = threading.RLock()
+        # Connections cannot be shared across processes, so we keep track of
+        # the process that opened it (the controller runs under gunicorn)
+        self._connection = None
+        self._connection_pid = None
+        with self._lock:
+            self._get_connection().executescript(_SCHEMA)
+
+    def store_start_metadata(self, execution_id: str,
+                             start_metadata: dict) -> None:
+        with self._transaction() as connection:
+            self._insert_start_metadata(connection,
+                                        start_metadata,
+                                        as_delta=False)
+
+    def store_start_metadatas(self, start_metadatas: [dict]) -> None:
+        stored_execution_ids = {m['execution_id'] for m in start_metadatas}
+        with self._transaction() as connection:
+            for start_metadata in start_metadatas:
+                # Same as for Redis, store sub-executions as a delta over
+                # their parent
+                as_delta = is_sub_execution(start_metadata) and \
+                    start_metadata['parent_execution_id'] \
+                    in stored_execution_ids
+                self._insert_start_metadata(connection, start_metadata,
+                                            as_delta)
+
+    @staticmethod
+    def _insert_start_metadata(connection: sqlite3.Connection,
+                               start_metadata: dict, as_delta: bool) -> None:
+        if as_delta:
+            delta = sub_execution_start_metadata_delta(start_metadata)
+            index_range_start, index_range_end = delta['index_range_to_run']
+            start_metadata_json = None
+        else:
+            index_range_start, index_range_end = None, None
+            start_metadata_json = json.dumps(start_metadata)
+        state = ExecutionState.STARTED if is_atomic(start_metadata) else None
+        connection.execute(
+            'INSERT OR REPLACE INTO executions (execution_id, user, project, '
+            'parent_execution_id, start_metadata, index_range_start, '
+            'index_range_end, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (start_metadata['execution_id'], start_metadata['user'],
+             start_metadata['project'],
+             start_metadata.get('parent_execution_id'), start_metadata_json,
+             index_range_start, index_range_end, state))
+
+    def retrieve_start_metadata(self, execution_id: str) -> dict:
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT start_metadata, parent_execution_id, '
+                'index_range_start, index_range_end FROM executions '
+                'WHERE execution_id = ?', (execution_id, )).fetchone()
+        if row is None or (row[0] is None and row[1] is None):
+            raise ValueError(f'No start metadata available for {execution_id}')
+        start_metadata_json, parent_execution_id, \
+            index_range_start, index_range_end = row
+        if start_metadata_json is not None:
+            return json.loads(start_metadata_json)
+        return apply_sub_execution_start_metadata_delta(
+            self.retrieve_start_metadata(parent_execution_id), {
+                'parent_execution_id': parent_execution_id,
+                'execution_id': execution_id,
+                'index_range_to_run': [index_range_start, index_range_end]
+            })
+
+    def add_finished_execution_id(self,
+                                  user: str,
+                                  project: str,
+                                  execution_id: str,
+                                  finish_timestamp: Optional[int] = None):
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO executions (execution_id, user, '
+                'project) VALUES (?, ?, ?)', (execution_id, user, project))
+            connection.execute(
+                'UPDATE executions SET state = ?, finish_timestamp = ? '
+                'WHERE execution_id = ?',
+                (ExecutionState.FINISHED, finish_timestamp, execution_id))
+
+    def retrieve_finished_execution_ids(self, user: str,
+                                        project: str) -> Set[str]:
+        with self._transaction() as connection:
+            return {
+                row[0]
+                for row in connection.execute(
+                    'SELECT execution_id FROM executions WHERE user = ? AND '
+                    'project = ? AND state = ?', (user, project,
+                                                  ExecutionState.FINISHED))
+            }
+
+    def get_user_of_execution(self, execution_id: str) -> str:
+        return self.get_users_of_executions([execution_id])[execution_id]
+
+    def get_users_of_executions(self, execution_ids: [str]) \
+            -> Dict[str, Optional[str]]:
+        users = {execution_id: None for execution_id in execution_ids}
+        with self._transaction() as connection:
+            for i in range(0, len(execution_ids), _MAX_QUERY_PARAMETERS):
+                chunk = execution_ids[i:i + _MAX_QUERY_PARAMETERS]
+                placeholders = ', '.join('?' for _ in chunk)
+                users.update(
+                    connection.execute(
+                        'SELECT execution_id, user FROM executions WHERE '
+                        f'execution_id IN ({placeholders})', chunk))
+        return users
+
+    def store_execution_composition(self,
+                                    execution_composition: ExecutionComposition
+                                    ) -> None:
+        with self._transaction() as connection:
+            self._insert_execution_composition(connection,
+                                               execution_composition)
+
+    def _insert_execution_composition(
+            self, connection: sqlite3.Connection,
+            execution_composition: ExecutionComposition) -> None:
+        execution_id = execution_composition.execution_id
+        if isinstance(execution_composition, AtomicComposition):
+            composition_type = 'atomic'
+        elif isinstance(execution_composition, IndicesComposition):
+            composition_type = 'indices'
+            index_ranges = list(
+                execution_composition.indices_to_compositions.ranges())
+            sub_compositions = {
+                comp.execution_id: comp
+                for _, _, comp in index_ranges
+            }
+            for comp in sub_compositions.values():
+                self._insert_execution_composition(connection, comp)
+            connection.executemany(
+                'INSERT OR REPLACE INTO composition_index_ranges '
+                '(execution_id, range_start, range_end, sub_execution_id) '
+                'VALUES (?, ?, ?, ?)',
+                [(execution_id, start, end, comp.execution_id)
+                 for start, end, comp in index_ranges])
+        else:
+            raise ValueError('Execution composition of unknown type: '
+                             f'{execution_composition}')
+        connection.execute(
+            'INSERT OR IGNORE INTO executions (execution_id) VALUES (?)',
+            (execution_id, ))
+        connection.execute(
+            'UPDATE executions SET composition_type = ? '
+            'WHERE execution_id = ?', (composition_type, execution_id))
+
+    def retrieve_execution_composition(self, execution_id: str) \
+            -> ExecutionComposition:
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT composition_type FROM executions '
+                'WHERE execution_id = ?', (execution_id, )).fetchone()
+            composition_type = row[0] if row is not None else None
+            return self._composition_of_type(connection, execution_id,
+                                             composition_type)
+
+    def _composition_of_type(self, connection: sqlite3.Connection,
+                             execution_id: str,
+                             composition_type: Optional[str]) \
+            -> ExecutionComposition:
+        # If there's nothing, assume it's a plain old atomic
+        if composition_type is None:
+            log.warning(f'Cannot composition type for {execution_id}. '
+                        'Assuming it\'s atomic')
+            return AtomicComposition(execution_id)
+        if composition_type == 'atomic':
+            return AtomicComposition(execution_id)
+        elif composition_type == 'indices':
+            indices_to_compositions = IndexRanges()
+            sub_compositions = {}
+            rows = connection.execute(
+                'SELECT r.range_start, r.range_end, r.sub_execution_id, '
+                'e.composition_type FROM composition_index_ranges r '
+                'LEFT JOIN executions e '
+                'ON e.execution_id = r.sub_execution_id '
+                'WHERE r.execution_id = ? ORDER BY r.range_start',
+                (execution_id, )).fetchall()
+            for start, end, sub_execution_id, sub_type in rows:
+                if sub_execution_id not in sub_compositions:
+                    sub_compositions[sub_execution_id] = \
+                        self._composition_of_type(
+                            connection, sub_execution_id, sub_type)
+                indices_to_compositions.assign(
+                    start, end, sub_compositions[sub_execution_id])
+            return IndicesComposition(
+                execution_id, indices_to_compositions,
+                self._tombstone_sub_execution_ids(connection, execution_id))
+        else:
+            raise ValueError(f'Unknown composition type {composition_type} for'
+                             f'execution ID {execution_id}')
+
+    def retrieve_execution_id_from_parent_and_index(self, execution_id: str,
+                                                    index: int
+                                                    ) -> Optional[str]:
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT sub_execution_id FROM composition_index_ranges '
+                'WHERE execution_id = ? AND range_start <= ? '
+                'AND range_end > ?', (execution_id, index, index)).fetchone()
+        return row[0] if row is not None else None
+
+    def add_tombstone_sub_execution_id(self, execution_id: str,
+                                       sub_execution_id: str) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO tombstone_sub_executions '
+                '(execution_id, sub_execution_id) VALUES (?, ?)',
+                (execution_id, sub_execution_id))
+
+    def retrieve_tombstone_sub_execution_ids(self,
+                                             execution_id: str) -> Set[str]:
+        with self._transaction() as connection:
+            return self._tombstone_sub_execution_ids(connection, execution_id)
+
+    @staticmethod
+    def _tombstone_sub_execution_ids(connection: sqlite3.Connection,
+                                     execution_id: str) -> Set[str]:
+        return {
+            row[0]
+            for row in connection.execute(
+                'SELECT sub_execution_id FROM tombstone_sub_executions '
+                'WHERE execution_id = ?', (execution_id, ))
+        }
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._connection_pid != os.getpid():
+            # We manage transactions ourselves
+            connection = sqlite3.connect(self.path,
+                                         timeout=_BUSY_TIMEOUT_SECONDS,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            # Readers don't block the writer and vice versa
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _transaction(self) -> ContextManager[sqlite3.Connection]:
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
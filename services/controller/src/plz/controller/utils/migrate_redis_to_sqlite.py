@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import sys
+from logging import INFO
+from typing import Optional
+
+from redis import StrictRedis
+
+from plz.controller import configuration
+from plz.controller.configuration import \
+    get_sqlite_db_storage_path_from_config
+from plz.controller.redis_db_storage import RedisDBStorage
+from plz.controller.results.local import Paths
+from plz.controller.sqlite_db_storage import SQLiteDBStorage
+
+config = configuration.load()
+
+# Number of start metadatas written in each transaction
+_BATCH_SIZE = 1000
+
+
+def _keys_with_prefix(redis: StrictRedis, prefix: str) -> [str]:
+    return [
+        str(key, 'utf-8')[len(prefix):]
+        for key in redis.scan_iter(match=f'{prefix}*')
+    ]
+
+
+def _read_finish_timestamp(execution_id: str) -> Optional[int]:
+    results_directory = config.get('results.directory', None)
+    if results_directory is None:
+        return None
+    paths = Paths(results_directory, execution_id)
+    try:
+        with open(paths.metadata) as metadata_file:
+            return json.load(metadata_file).get('finish_timestamp')
+    except FileNotFoundError:
+        return None
+
+
+def migrate_start_metadata(redis: StrictRedis,
+                           redis_db_storage: RedisDBStorage,
+                           sqlite_db_storage: SQLiteDBStorage) -> dict:
+    execution_ids = sorted({
+        str(execution_id, 'utf-8')
+        for hash_name in ('start_metadata', 'start_metadata_delta')
+        for execution_id in redis.hkeys(hash_name)
+    })
+    print(f'Migrating start metadata of {len(execution_ids)} executions',
+          file=sys.stderr,
+          flush=True)
+    start_metadatas = {}
+    for i in range(0, len(execution_ids), _BATCH_SIZE):
+        batch = [
+            redis_db_storage.retrieve_start_metadata(execution_id)
+            for execution_id in execution_ids[i:i + _BATCH_SIZE]
+        ]
+        sqlite_db_storage.store_start_metadatas(batch)
+        start_metadatas.update({m['execution_id']: m for m in batch})
+    return start_metadatas
+
+
+def migrate_compositions(redis: StrictRedis, redis_db_storage: RedisDBStorage,
+                         sqlite_db_storage: SQLiteDBStorage) -> None:
+    execution_ids = [
+        str(execution_id, 'utf-8')
+        for execution_id in redis.hkeys('execution_composition_type')
+    ]
+    print(f'Migrating compositions of {len(execution_ids)} executions',
+          file=sys.stderr,
+          flush=True)
+    for execution_id in execution_ids:
+        sqlite_db_storage.store_execution_composition(
+            redis_db_storage.retrieve_execution_composition(execution_id))
+    for execution_id in _keys_with_prefix(redis, 'tombstone_executions#'):
+        for sub_execution_id in \
+                redis_db_storage.retrieve_tombstone_sub_execution_ids(
+                    execution_id):
+            sqlite_db_storage.add_tombstone_sub_execution_id(
+                execution_id, sub_execution_id)
+
+
+def migrate_finished_executions(redis: StrictRedis,
+                                sqlite_db_storage: SQLiteDBStorage,
+                                start_metadatas: dict) -> None:
+    finished_execution_ids = set()
+    for user in _keys_with_prefix(redis, 'finished_execution_ids_for_user#'):
+        finished_execution_ids.update(
+            str(execution_id, 'utf-8') for execution_id in redis.smembers(
+                f'finished_execution_ids_for_user#{user}'))
+    print(f'Migrating {len(finished_execution_ids)} finished executions',
+          file=sys.stderr,
+          flush=True)
+    for execution_id in finished_execution_ids:
+        start_metadata = start_metadatas.get(execution_id)
+        if start_metadata is None:
+            print(f'No start metadata for {execution_id}, skipping',
+                  file=sys.stderr,
+                  flush=True)
+            continue
+        sqlite_db_storage.add_finished_execution_id(
+            user=start_metadata['user'],
+            project=start_metadata['project'],
+            execution_id=execution_id,
+            finish_timestamp=_read_finish_timestamp(execution_id))
+
+
+def migrate():
+    redis = StrictRedis(host=config.get('redis_host', 'localhost'))
+    redis_db_storage = RedisDBStorage(redis)
+    path = get_sqlite_db_storage_path_from_config(config)
+    print(f'Migrating the Redis DB storage to {path}',
+          file=sys.stderr,
+          flush=True)
+    sqlite_db_storage = SQLiteDBStorage(path)
+    start_metadatas = migrate_start_metadata(redis, redis_db_storage,
+                                             sqlite_db_storage)
+    migrate_compositions(redis, redis_db_storage, sqlite_db_storage)
+    migrate_finished_executions(redis, sqlite_db_storage, start_metadatas)
+    print(
+        'Done. Set `db_storage.provider = sqlite` in the configuration '
+        'to use it',
+        file=sys.stderr,
+        flush=True)
+
+
+if __name__ == '__main__':
+    root_logger = logging.getLogger()
+    root_logger_handler = logging.StreamHandler(stream=sys.stderr)
+    root_logger_handler.setFormatter(
+        logging.Formatter('%(asctime)s ' + logging.BASIC_FORMAT))
+    root_logger.addHandler(root_logger_handler)
+    logging.getLogger('plz').setLevel(INFO)
+    if os.path.exists(get_sqlite_db_storage_path_from_config(config)):
+        print('The SQLite database already exists, remove it first',
+              file=sys.stderr)
+        exit(1)
+    migrate()
+else:
+    print('You can\'t import this script!', file=sys.stderr)
+    exit(1)
@@ -1,9 +1,8 @@
 import io
 import os.path
 import tarfile
-import tempfile
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Set
 
 import docker
 import docker.errors
@@ -14,7 +13,18 @@ from docker.types import Mount
 
 class VolumeObject(ABC):
     @abstractmethod
+    def add_to(self, tar: tarfile.TarFile):
+        """
+        Adds the object to the tarball that is extracted in the volume, so
+        that all objects go in a single request
+        """
+        pass
+
     def put_in(self, container: Container, root: str):
+        """
+        Puts what doesn't belong in the tarball, like big streams, in the
+        container once the tarball is extracted
+        """
         pass
 
 
@@ -23,28 +33,18 @@ class VolumeFile(VolumeObject):
         self.path = path
         self.contents: bytes = contents.encode('utf-8')
 
-    def put_in(self, container: Container, root: str):
-        with tempfile.NamedTemporaryFile() as f:
-            with tarfile.open(f.name, mode='w') as tar:
-                tarinfo = tarfile.TarInfo(name=self.path)
-                tarinfo.size = len(self.contents)
-                tar.addfile(tarinfo, fileobj=io.BytesIO(self.contents))
-            f.seek(0)
-            container.put_archive(root, f)
+    def add_to(self, tar: tarfile.TarFile):
+        tarinfo = tarfile.TarInfo(name=self.path)
+        tarinfo.size = len(self.contents)
+        tar.addfile(tarinfo, fileobj=io.BytesIO(self.contents))
 
 
 class VolumeEmptyDirectory(VolumeObject):
     def __init__(self, path: str):
         self.path = path
 
-    def put_in(self, container: Container, root: str):
-        with tempfile.NamedTemporaryFile() as f:
-            with tarfile.open(f.name, mode='w') as tar:
-                tarinfo = tarfile.TarInfo(name=self.path)
-                tarinfo.type = tarfile.DIRTYPE
-                tar.addfile(tarinfo)
-            f.seek(0)
-            container.put_archive(root, f)
+    def add_to(self, tar: tarfile.TarFile):
+        tar.addfile(_directory_tarinfo(self.path))
 
 
 class VolumeDirectory(VolumeObject):
@@ -52,15 +52,29 @@ class VolumeDirectory(VolumeObject):
         self.path = path
         self.contents_tarball = contents_tarball
 
+    def add_to(self, tar: tarfile.TarFile):
+        tar.addfile(_directory_tarinfo(self.path))
+
     def put_in(self, container: Container, root: str):
-        full_path = os.path.join(root, self.path)
-        exit_code, output = container.exec_run(['mkdir', full_path])
-        if exit_code > 0:
-            raise VolumeCreationError(output.decode('utf-8'))
         # noinspection PyTypeChecker
         # (the tarball can be an `IOBase` too,
         #  but the docker-py documentation says it must be `bytes`)
-        container.put_archive(full_path, self.contents_tarball)
+        container.put_archive(os.path.join(root, self.path),
+                              self.contents_tarball)
+
+
+class VolumeArchive(VolumeObject):
+    """Contents of a tarball, extracted at the root of the volume"""
+
+    def __init__(self, contents_tarball: io.IOBase):
+        self.contents_tarball = contents_tarball
+
+    def add_to(self, tar: tarfile.TarFile):
+        pass
+
+    def put_in(self, container: Container, root: str):
+        # noinspection PyTypeChecker
+        container.put_archive(root, self.contents_tarball)
 
 
 class Volumes:
@@ -73,6 +87,11 @@ class Volumes:
     OUTPUT_DIRECTORY_PATH = os.path.join(VOLUME_MOUNT, OUTPUT_DIRECTORY)
     MEASURES_DIRECTORY = 'measures'
     MEASURES_DIRECTORY_PATH = os.path.join(VOLUME_MOUNT, MEASURES_DIRECTORY)
+    _BUSYBOX_IMAGE = 'busybox'
+
+    # Docker URLs of the hosts known to have the busybox image, so that it's
+    # not checked every time a volume is created
+    _hosts_with_busybox: Set[str] = set()
 
     @staticmethod
     def for_host(docker_url):
@@ -93,6 +112,7 @@ class Volumes:
             remove=True,
             detach=True)
         try:
+            container.put_archive(root, _tarball_of(objects))
             for volume_object in objects:
                 volume_object.put_in(container, root)
         finally:
@@ -106,13 +126,50 @@ class Volumes:
         except docker.errors.NotFound:
             pass
 
+    def remove_if_unused(self, name: str) -> bool:
+        """
+        :return: whether the volume is gone, False if a container is using it
+        """
+        try:
+            self.docker_client.volumes.get(name).remove()
+        except docker.errors.NotFound:
+            pass
+        except docker.errors.APIError as e:
+            if e.status_code != 409:
+                raise
+            return False
+        return True
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.docker_client.volumes.get(name)
+            return True
+        except docker.errors.NotFound:
+            return False
+
     def _busybox_image(self):
+        docker_url = self.docker_client.api.base_url
+        if docker_url in self._hosts_with_busybox:
+            return self._BUSYBOX_IMAGE
         try:
-            self.docker_client.images.get('busybox')
+            self.docker_client.images.get(self._BUSYBOX_IMAGE)
         except docker.errors.NotFound:
-            self.docker_client.images.pull('busybox', 'latest')
-        return 'busybox'
+            self.docker_client.images.pull(self._BUSYBOX_IMAGE, 'latest')
+        self._hosts_with_busybox.add(docker_url)
+        return self._BUSYBOX_IMAGE
+
+
+def _tarball_of(objects: List[VolumeObject]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for volume_object in objects:
+            volume_object.add_to(tar)
+    return buffer.getvalue()
 
 
-class VolumeCreationError(Exception):
-    pass
+def _directory_tarinfo(path: str) -> tarfile.TarInfo:
+    tarinfo = tarfile.TarInfo(name=path)
+    tarinfo.type = tarfile.DIRTYPE
+    # Same as `mkdir`, TarInfo defaults to 0o644
+    tarinfo.mode = 0o755
+    return tarinfo
@@ -0,0 +1,88 @@
+"""
+Times storing and retrieving the composition of a big parallel execution.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=services/controller/src \
+        python test/benchmarks/composition_storage.py --indices 10000
+
+By default it uses a Redis server running in localhost. Use `--fake` to run
+against fakeredis instead (it needs to be installed).
+"""
+import argparse
+import time
+import uuid
+
+from redis import StrictRedis
+
+from plz.controller.caching_db_storage import CachingDBStorage
+from plz.controller.execution_composition import AtomicComposition, \
+    IndicesComposition
+from plz.controller.immutable_records_cache import ImmutableRecordsCache
+from plz.controller.redis_db_storage import RedisDBStorage
+
+
+def create_composition(n_indices: int, indices_per_execution: int) \
+        -> IndicesComposition:
+    composition = IndicesComposition(str(uuid.uuid4()),
+                                     indices_to_compositions=None,
+                                     tombstone_execution_ids=None)
+    for i in range(0, n_indices, indices_per_execution):
+        sub_composition = AtomicComposition(str(uuid.uuid4()))
+        for j in range(i, min(i + indices_per_execution, n_indices)):
+            composition.assign_index(j, sub_composition)
+    return composition
+
+
+def create_redis(args) -> StrictRedis:
+    if args.fake:
+        import fakeredis
+        return fakeredis.FakeStrictRedis()
+    return StrictRedis(host=args.redis_host)
+
+
+def timed(label: str, f, repetitions: int = 1):
+    start = time.time()
+    result = None
+    for _ in range(repetitions):
+        result = f()
+    elapsed = (time.time() - start) / repetitions
+    print(f'{label}: {elapsed * 1000:.1f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--indices', type=int, default=10000)
+    parser.add_argument('--indices-per-execution', type=int, default=1)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--fake', action='store_true')
+    args = parser.parse_args()
+
+    redis = create_redis(args)
+    composition = create_composition(args.indices, args.indices_per_execution)
+    print(f'{args.indices} indices, '
+          f'{args.indices_per_execution} per execution')
+
+    timed(
+        'Store', lambda: RedisDBStorage(redis).store_execution_composition(
+            composition))
+
+    def retrieve_cold():
+        return RedisDBStorage(redis).retrieve_execution_composition(
+            composition.execution_id)
+
+    retrieved = timed('Retrieve (cold)', retrieve_cold, args.repetitions)
+    assert retrieved.to_jsonable_dict() == composition.to_jsonable_dict()
+
+    db_storage = CachingDBStorage(RedisDBStorage(redis),
+                                  ImmutableRecordsCache(max_entries=100))
+    db_storage.retrieve_execution_composition(composition.execution_id)
+    timed(
+        'Retrieve (cached)', lambda: db_storage.retrieve_execution_composition(
+            composition.execution_id), args.repetitions)
+
+
+if __name__ == '__main__':
+    main()
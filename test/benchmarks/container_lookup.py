@@ -0,0 +1,151 @@
+"""
+Times listing the executions running in the local host and looking up their
+containers, with a fake docker client that simulates the latency of each
+request.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=services/controller/src \
+        python test/benchmarks/container_lookup.py --containers 100 300
+
+Use `--legacy` to also time listing all containers once per lookup, as it
+used to be done.
+"""
+import argparse
+import time
+import uuid
+from typing import Dict, List, Optional
+from unittest import mock
+
+import docker.errors
+
+from plz.controller.containers import Containers
+from plz.controller.instances.localhost import Localhost
+
+
+class FakeContainer:
+    def __init__(self, name: str):
+        self.name = name
+        self.id = uuid.uuid4().hex * 2
+        self.attrs = {
+            'Name': f'/{name}',
+            'State': {
+                'Running': False,
+                'Status': 'exited',
+                'ExitCode': 0,
+                'FinishedAt': '2018-01-01T00:00:00Z'
+            }
+        }
+
+
+class FakeDockerClient:
+    """Answers like docker, taking some time and counting the requests"""
+
+    def __init__(self, names: List[str], latency_in_seconds: float):
+        self.containers_by_name: Dict[str, FakeContainer] = {
+            name: FakeContainer(name)
+            for name in names
+        }
+        self.latency_in_seconds = latency_in_seconds
+        self.requests = 0
+        self.api = mock.Mock()
+        self.api.containers.side_effect = self._list_summaries
+        self.containers = mock.Mock()
+        self.containers.list.side_effect = self._list
+        self.containers.get.side_effect = self._get
+
+    def _request(self):
+        self.requests += 1
+        time.sleep(self.latency_in_seconds)
+
+    def _list_summaries(self,
+                        all: bool = False,
+                        filters: Optional[dict] = None) -> List[dict]:
+        self._request()
+        name_filter = (filters or {}).get('name', '')
+        return [{
+            'Id': container.id,
+            'Names': [f'/{name}']
+        } for name, container in self.containers_by_name.items()
+                if name_filter in name]
+
+    def _list(self, all: bool = False) -> List[FakeContainer]:
+        # Like docker-py, inspect each of the listed containers
+        return [
+            self._get(s['Names'][0].lstrip('/'))
+            for s in self._list_summaries(all=all)
+        ]
+
+    def _get(self, name: str) -> FakeContainer:
+        self._request()
+        if name not in self.containers_by_name:
+            raise docker.errors.NotFound(name)
+        return self.containers_by_name[name]
+
+
+def legacy_execution_ids(docker_client: FakeDockerClient) -> List[str]:
+    # noinspection PyProtectedMember
+    prefix = Containers._CONTAINER_NAME_PREFIX
+    return [
+        container.name[len(prefix):]
+        for container in docker_client.containers.list(all=True)
+        if container.name.startswith(prefix)
+    ]
+
+
+def timed(label: str, docker_client: FakeDockerClient, f):
+    docker_client.requests = 0
+    start = time.time()
+    f()
+    elapsed = time.time() - start
+    print(f'  {label}: {elapsed * 1000:.1f} ms, '
+          f'{docker_client.requests} requests')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--containers', type=int, nargs='+', default=[300])
+    parser.add_argument('--others',
+                        type=int,
+                        default=20,
+                        help='containers in the host not started by plz')
+    parser.add_argument('--latency-in-ms', type=float, default=0.1)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    for n_containers in args.containers:
+        execution_ids = [str(uuid.uuid4()) for _ in range(n_containers)]
+        # noinspection PyProtectedMember
+        names = [
+            Containers._CONTAINER_NAME_PREFIX + execution_id
+            for execution_id in execution_ids
+        ] + [f'other-{i}' for i in range(args.others)]
+        docker_client = FakeDockerClient(names, args.latency_in_ms / 1000)
+        containers = Containers(docker_client)
+        localhost = Localhost(results_storage=mock.Mock(),
+                              images=mock.Mock(),
+                              containers=containers,
+                              volumes=mock.Mock(),
+                              redis=mock.Mock(),
+                              instance_lock_timeout=3600)
+        print(f'{n_containers} containers')
+
+        timed('Iterate instances', docker_client, lambda: list(
+            localhost.instance_iterator(only_running=False)))
+        timed(
+            'Look up each instance', docker_client, lambda: [
+                localhost.instance_for(execution_id)
+                for execution_id in execution_ids
+            ])
+        if args.legacy:
+            # Each lookup listed all containers, up to three times
+            timed(
+                'Look up each instance, listing all containers',
+                docker_client, lambda: [
+                    execution_id in legacy_execution_ids(docker_client)
+                    for execution_id in legacy_execution_ids(docker_client)
+                ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Compares the Redis and SQLite DB storages on the queries done when listing
+executions, looking at history and running compositions.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=services/controller/src \
+        python test/benchmarks/db_storage.py --executions 10000
+
+By default it uses a Redis server running in localhost. Use `--fake` to run
+against fakeredis instead (it needs to be installed).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from redis import StrictRedis
+
+from plz.controller.db_storage import DBStorage
+from plz.controller.execution_composition import AtomicComposition, \
+    IndicesComposition
+from plz.controller.execution_metadata import \
+    enrich_sub_execution_start_metadata
+from plz.controller.redis_db_storage import RedisDBStorage
+from plz.controller.sqlite_db_storage import SQLiteDBStorage
+
+_USERS = [f'user{i}' for i in range(10)]
+_PROJECTS = [f'project{i}' for i in range(10)]
+
+
+def create_start_metadata(user: str, project: str) -> dict:
+    return {
+        'execution_id': str(uuid.uuid4()),
+        'user': user,
+        'project': project,
+        'parent_execution_id': None,
+        'execution_spec': {
+            'instance_type': 't2.micro',
+            'index_range_to_run': None,
+            'parallel_indices_range': None,
+            'indices_per_execution': None,
+            'previous_execution_id': None
+        },
+        'instance_market_spec': {
+            'instance_market_type': 'spot',
+            'max_bid_price_in_dollars_per_hour': 1,
+            'instance_max_uptime_in_minutes': 60
+        },
+        'snapshot_id': str(uuid.uuid4()),
+        'start_timestamp': int(time.time() * 1000),
+        'command': ['python', 'main.py'] * 10,
+    }
+
+
+def populate(db_storage: DBStorage, start_metadatas: [dict]):
+    for start_metadata in start_metadatas:
+        db_storage.store_start_metadata(start_metadata['execution_id'],
+                                        start_metadata)
+        db_storage.store_execution_composition(
+            AtomicComposition(start_metadata['execution_id']))
+        db_storage.add_finished_execution_id(start_metadata['user'],
+                                             start_metadata['project'],
+                                             start_metadata['execution_id'],
+                                             start_metadata['start_timestamp'])
+
+
+def populate_parallel(db_storage: DBStorage, n_indices: int) \
+        -> IndicesComposition:
+    parent = create_start_metadata(_USERS[0], _PROJECTS[0])
+    composition = IndicesComposition(parent['execution_id'],
+                                     indices_to_compositions=None,
+                                     tombstone_execution_ids=None)
+    start_metadatas = [parent]
+    for i in range(n_indices):
+        sub_execution_id = str(uuid.uuid4())
+        start_metadatas.append(
+            enrich_sub_execution_start_metadata(parent, sub_execution_id,
+                                                (i, i + 1)))
+        composition.assign_index_range(i, i + 1,
+                                       AtomicComposition(sub_execution_id))
+    db_storage.store_start_metadatas(start_metadatas)
+    db_storage.store_execution_composition(composition)
+    return composition
+
+
+def create_redis(args) -> StrictRedis:
+    if args.fake:
+        import fakeredis
+        return fakeredis.FakeStrictRedis()
+    return StrictRedis(host=args.redis_host)
+
+
+def timed(label: str, f, repetitions: int = 1):
+    start = time.time()
+    result = None
+    for _ in range(repetitions):
+        result = f()
+    elapsed = (time.time() - start) / repetitions
+    print(f'  {label}: {elapsed * 1000:.2f} ms')
+    return result
+
+
+def benchmark(db_storage: DBStorage, args):
+    start_metadatas = [
+        create_start_metadata(random.choice(_USERS), random.choice(_PROJECTS))
+        for _ in range(args.executions)
+    ]
+    timed('Store executions', lambda: populate(db_storage, start_metadatas))
+    composition = timed('Store parallel execution', lambda: populate_parallel(
+        db_storage, args.indices))
+
+    execution_ids = [m['execution_id'] for m in start_metadatas]
+    timed(
+        'Retrieve start metadata', lambda: db_storage.retrieve_start_metadata(
+            random.choice(execution_ids)), args.repetitions)
+    sub_execution_ids = [
+        comp.execution_id
+        for _, comp in composition.indices_to_compositions.items()
+    ]
+    timed(
+        'Retrieve start metadata of sub-execution', lambda: db_storage.
+        retrieve_start_metadata(random.choice(sub_execution_ids)),
+        args.repetitions)
+    timed(
+        'Retrieve finished execution IDs (history)',
+        lambda: db_storage.retrieve_finished_execution_ids(
+            random.choice(_USERS), random.choice(_PROJECTS)), args.repetitions)
+    timed(
+        'Get users of 100 executions (listing)', lambda: db_storage.
+        get_users_of_executions(random.sample(execution_ids, 100)),
+        args.repetitions)
+    timed(
+        'Retrieve parallel composition', lambda: db_storage.
+        retrieve_execution_composition(composition.execution_id),
+        args.repetitions)
+    timed(
+        'Retrieve sub-execution from index', lambda: db_storage.
+        retrieve_execution_id_from_parent_and_index(
+            composition.execution_id, random.randrange(args.indices)),
+        args.repetitions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--executions', type=int, default=10000)
+    parser.add_argument('--indices', type=int, default=1000)
+    parser.add_argument('--repetitions', type=int, default=100)
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--fake', action='store_true')
+    args = parser.parse_args()
+
+    print('Redis')
+    benchmark(RedisDBStorage(create_redis(args)), args)
+
+    with tempfile.TemporaryDirectory() as directory:
+        print('SQLite')
+        benchmark(SQLiteDBStorage(os.path.join(directory, 'plz.sqlite3')),
+                  args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Times creating the volume of an execution, depending on the number of indices
+it runs.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=services/controller/src \
+        python test/benchmarks/volume_creation.py --indices 1 10 100 1000
+
+It needs a Docker daemon, by default the one in the environment. Use
+`--per-object` to also time sending each object in its own request, as
+volumes used to be populated.
+"""
+import argparse
+import io
+import json
+import tarfile
+import time
+import uuid
+from typing import List
+
+import docker
+from docker.types import Mount
+
+from plz.controller.execution_composition import InstanceComposition
+from plz.controller.volumes import VolumeFile, VolumeObject, Volumes
+
+
+def volume_objects_for(n_indices: int) -> List[VolumeObject]:
+    startup_config = InstanceComposition.create_for(
+        (0, n_indices)).get_startup_config()
+    configuration = {**startup_config.config_keys, 'parameters': {}}
+    return [
+        *startup_config.volumes,
+        VolumeFile(Volumes.CONFIGURATION_FILE,
+                   contents=json.dumps(configuration, indent=2))
+    ]
+
+
+def create_per_object(volumes: Volumes, name: str,
+                      objects: List[VolumeObject]):
+    root = '/output'
+    volume = volumes.docker_client.volumes.create(name)
+    container = volumes.docker_client.containers.run(
+        image=volumes._busybox_image(),
+        command=['cat'],
+        mounts=[Mount(source=volume.name, target=root)],
+        stdin_open=True,
+        remove=True,
+        detach=True)
+    try:
+        for volume_object in objects:
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w') as tar:
+                volume_object.add_to(tar)
+            container.put_archive(root, buffer.getvalue())
+    finally:
+        container.kill()
+
+
+def timed(f, repetitions: int) -> float:
+    start = time.time()
+    for _ in range(repetitions):
+        f()
+    return (time.time() - start) / repetitions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--indices', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--docker-host', default=None)
+    parser.add_argument('--per-object', action='store_true')
+    args = parser.parse_args()
+
+    if args.docker_host is not None:
+        docker_client = docker.DockerClient(base_url=args.docker_host)
+    else:
+        docker_client = docker.from_env()
+    volumes = Volumes(docker_client)
+    # Don't count pulling the helper image
+    volumes._busybox_image()
+
+    for n_indices in args.indices:
+        objects = volume_objects_for(n_indices)
+        names = []
+
+        def create(f):
+            def create_one():
+                name = f'plz-benchmark-{uuid.uuid4()}'
+                names.append(name)
+                f(volumes, name, objects)
+
+            return create_one
+
+        try:
+            elapsed = timed(create(lambda v, name, o: v.create(name, o)),
+                            args.repetitions)
+            line = f'{n_indices} indices, {len(objects)} objects: ' \
+                   f'{elapsed * 1000:.1f} ms'
+            if args.per_object:
+                elapsed = timed(create(create_per_object), args.repetitions)
+                line += f', each object separately: {elapsed * 1000:.1f} ms'
+            print(line)
+        finally:
+            for name in names:
+                volumes.remove(name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+import threading
+from typing import Dict
+
+import fakeredis
+
+
+class FakeRedis(fakeredis.FakeStrictRedis):
+    """
+    Redis in memory, for the parts of the controller that keep their state
+    in it. Locks are process-local, as they don't need scripting then
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def lock(self, name: str, *args, **kwargs) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
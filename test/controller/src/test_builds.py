@@ -0,0 +1,132 @@
+import json
+import time
+import unittest
+
+from plz.controller import builds
+from plz.controller.builds import BuildScheduler
+
+from .fake_redis import FakeRedis
+
+
+class TestBuildScheduler(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+
+    def _scheduler(self, queueing: str,
+                   max_concurrent_builds: int = 1) -> BuildScheduler:
+        return BuildScheduler(self.redis,
+                              max_concurrent_builds,
+                              queueing,
+                              poll_interval_in_seconds=0.01)
+
+    def _queue(self, scheduler: BuildScheduler, *builds_and_users) -> None:
+        for i, (build_id, user) in enumerate(builds_and_users):
+            self.redis.zadd(builds._queue_key(), {build_id: i})
+            self.assertIsNotNone(scheduler._try_to_start(build_id, user))
+
+    def _positions(self, scheduler: BuildScheduler, *builds_and_users) \
+            -> [int]:
+        return [
+            scheduler._try_to_start(build_id, user)
+            for build_id, user in builds_and_users
+        ]
+
+    def _start(self, scheduler: BuildScheduler, build_id: str,
+               user: str) -> None:
+        self.assertIsNone(scheduler._try_to_start(build_id, user))
+
+    def test_fifo_builds_start_in_order_of_arrival(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self._start(scheduler, 'running', 'alice')
+        waiting = [('a1', 'alice'), ('a2', 'alice'), ('b1', 'bob')]
+        self._queue(scheduler, *waiting)
+        self.assertEqual(self._positions(scheduler, *waiting), [1, 2, 3])
+
+    def test_fair_builds_of_users_take_turns(self):
+        scheduler = self._scheduler(BuildScheduler.FAIR)
+        self._start(scheduler, 'running', 'alice')
+        waiting = [('a1', 'alice'), ('a2', 'alice'), ('b1', 'bob'),
+                   ('b2', 'bob'), ('c1', 'carol')]
+        self._queue(scheduler, *waiting)
+        # Bob and Carol have nothing running, so they go before Alice
+        self.assertEqual(self._positions(scheduler, *waiting), [3, 5, 1, 4, 2])
+
+    def test_order_is_the_arrival_within_a_turn(self):
+        scheduler = self._scheduler(BuildScheduler.FAIR)
+        for i, build_id in enumerate(['b1', 'a1', 'c1']):
+            self.redis.zadd(builds._queue_key(), {build_id: i})
+        waiters = {
+            'a1': {
+                'user': 'alice'
+            },
+            'b1': {
+                'user': 'bob'
+            },
+            'c1': {
+                'user': 'carol'
+            }
+        }
+        self.assertEqual(scheduler._order(waiters, {}), ['b1', 'a1', 'c1'])
+
+    def test_builds_start_while_there_is_room(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO,
+                                    max_concurrent_builds=2)
+        self._start(scheduler, 'a1', 'alice')
+        self._start(scheduler, 'a2', 'alice')
+        self.assertEqual(self._positions(scheduler, ('a3', 'alice')), [1])
+        self.assertEqual(scheduler.stats()['running'], 2)
+        self.assertEqual(scheduler.stats()['queued'], 1)
+
+    def test_finished_builds_make_room(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self._start(scheduler, 'a1', 'alice')
+        waiting = scheduler.wait_for_turn('b1', 'bob')
+        self.assertEqual(next(waiting), 1)
+        scheduler.finish('a1')
+        with self.assertRaises(StopIteration):
+            next(waiting)
+
+    def test_builds_that_give_up_leave_the_queue(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self._start(scheduler, 'a1', 'alice')
+        waiting = scheduler.wait_for_turn('b1', 'bob')
+        next(waiting)
+        waiting.close()
+        self.assertEqual(scheduler.stats()['queued'], 0)
+        self.assertEqual(self.redis.hlen(builds._waiters_key()), 0)
+
+    def test_stale_waiters_are_dropped(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self._start(scheduler, 'running', 'alice')
+        self._queue(scheduler, ('gone', 'alice'), ('b1', 'bob'))
+        # The controller process waiting for the first build went away
+        self.redis.hset(
+            builds._waiters_key(), 'gone',
+            json.dumps({
+                'user':
+                    'alice',
+                'last_seen':
+                    time.time() - builds._WAITER_STALE_AFTER_SECONDS - 1
+            }))
+        self.assertEqual(self._positions(scheduler, ('b1', 'bob')), [1])
+        self.assertIsNone(self.redis.zscore(builds._queue_key(), 'gone'))
+
+    def test_waiters_dropped_as_stale_queue_again(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self._start(scheduler, 'running', 'alice')
+        self._queue(scheduler, ('a1', 'alice'))
+        self.redis.zrem(builds._queue_key(), 'a1')
+        self.assertEqual(self._positions(scheduler, ('a1', 'alice')), [1])
+
+    def test_leaked_running_builds_are_dropped(self):
+        scheduler = self._scheduler(BuildScheduler.FIFO)
+        self.redis.hset(
+            builds._running_key(), 'leaked',
+            json.dumps({
+                'user':
+                    'alice',
+                'since':
+                    time.time() - builds._RUNNING_BUILD_STALE_AFTER_SECONDS - 1
+            }))
+        self._start(scheduler, 'b1', 'bob')
+        self.assertIsNone(self.redis.hget(builds._running_key(), 'leaked'))
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+import unittest
+from typing import Iterator
+from unittest import mock
+
+from plz.controller import execution_queue
+from plz.controller.execution_queue import ExecutionQueue
+
+from .fake_redis import FakeRedis
+
+
+def _dispatch(job: dict) -> Iterator[dict]:
+    yield {'status': f'dispatched {job["name"]}'}
+
+
+class TestExecutionQueue(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.queue = ExecutionQueue(self.redis,
+                                    _dispatch,
+                                    max_concurrent_dispatches=3,
+                                    max_concurrent_dispatches_per_user=2,
+                                    dispatchers_per_process=0,
+                                    poll_interval_in_seconds=0.01)
+
+    def _enqueue(self, execution_id: str, user: str) -> int:
+        return self.queue.enqueue(execution_id, user, {
+            'user': user,
+            'name': execution_id
+        })
+
+    def _claim_all(self) -> [str]:
+        claimed = []
+        execution_id = self.queue._claim()
+        while execution_id is not None:
+            claimed.append(execution_id)
+            execution_id = self.queue._claim()
+        return claimed
+
+    def test_reports_the_executions_of_the_user_ahead(self):
+        self.assertEqual(self._enqueue('a1', 'alice'), 0)
+        self.assertEqual(self._enqueue('b1', 'bob'), 0)
+        self.assertEqual(self._enqueue('a2', 'alice'), 1)
+
+    def test_caps_the_dispatches(self):
+        for i in range(3):
+            self._enqueue(f'a{i}', 'alice')
+            self._enqueue(f'b{i}', 'bob')
+        claimed = self._claim_all()
+        self.assertEqual(len(claimed), 3)
+        self.assertLessEqual(len([e for e in claimed if e[0] == 'a']), 2)
+        self.assertLessEqual(len([e for e in claimed if e[0] == 'b']), 2)
+
+    def test_users_with_fewer_dispatches_go_first(self):
+        self._enqueue('a1', 'alice')
+        self._enqueue('a2', 'alice')
+        self._enqueue('b1', 'bob')
+        # Alice has waited for longer
+        self.assertEqual(self.queue._claim(), 'a1')
+        # But Bob has fewer executions being dispatched now
+        self.assertEqual(self.queue._claim(), 'b1')
+        self.assertEqual(self.queue._claim(), 'a2')
+
+    def test_dispatches_and_stores_the_statuses(self):
+        self._enqueue('a1', 'alice')
+        self.queue._dispatch(self.queue._claim())
+        self.assertEqual(list(self.queue.get_statuses('a1')), [{
+            'status': 'dispatched a1'
+        }])
+        self.assertEqual(self.queue._live_dispatches(), {})
+
+    def test_unknown_executions_are_not_queued(self):
+        self.assertEqual(list(self.queue.get_statuses('a1')), [{
+            'error': 'Execution a1 is not queued'
+        }])
+
+    def test_stale_dispatches_without_statuses_are_queued_again(self):
+        self._enqueue('a1', 'alice')
+        self.assertEqual(self.queue._claim(), 'a1')
+        self._make_dispatches_stale()
+        self.assertEqual(self.queue._claim(), 'a1')
+
+    def test_stale_dispatches_with_statuses_are_failed(self):
+        self._enqueue('a1', 'alice')
+        self.assertEqual(self.queue._claim(), 'a1')
+        # The dispatch reported something before its process went away
+        self.redis.hdel(execution_queue._jobs_key(), 'a1')
+        self._make_dispatches_stale()
+        self.assertIsNone(self.queue._claim())
+        self.assertEqual(list(self.queue.get_statuses('a1')), [{
+            'error': 'The controller dispatching it went away'
+        }])
+
+    def test_blocked_dispatches_keep_their_heartbeat(self):
+        release = threading.Event()
+
+        def dispatch(_):
+            release.wait()
+            yield {'status': 'got an instance'}
+
+        self.queue.dispatch = dispatch
+        self._enqueue('a1', 'alice')
+        self.queue._claim()
+        with mock.patch.object(execution_queue,
+                               '_DISPATCH_HEARTBEAT_SECONDS', 0.01), \
+                mock.patch.object(execution_queue,
+                                  '_DISPATCH_STALE_AFTER_SECONDS', 0.1):
+            thread = threading.Thread(target=self.queue._dispatch,
+                                      args=('a1', ))
+            thread.start()
+            time.sleep(0.3)
+            self.assertIn('a1', self.queue._live_dispatches())
+            release.set()
+            thread.join()
+        self.assertEqual(list(self.queue.get_statuses('a1')), [{
+            'status': 'got an instance'
+        }])
+
+    def test_enqueueing_waits_for_claims(self):
+        self._enqueue('a1', 'alice')
+        self.assertEqual(self.queue._claim(), 'a1')
+        # A claim that found the queue of the user empty is about to take
+        # them out of the waiting users
+        with self.redis.lock(f'lock:{execution_queue.__name__}#claim'):
+            thread = threading.Thread(target=self._enqueue,
+                                      args=('a2', 'alice'))
+            thread.start()
+            time.sleep(0.1)
+            self.assertTrue(thread.is_alive())
+            self.redis.zrem(execution_queue._waiting_users_key(), 'alice')
+        thread.join()
+        self.assertEqual(self.queue._claim(), 'a2')
+
+    def _make_dispatches_stale(self):
+        key = execution_queue._dispatches_key()
+        for execution_id, dispatch in self.redis.hgetall(key).items():
+            dispatch = json.loads(str(dispatch, 'utf-8'))
+            dispatch['heartbeat'] -= \
+                execution_queue._DISPATCH_STALE_AFTER_SECONDS + 1
+            self.redis.hset(key, execution_id, json.dumps(dispatch))
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+from plz.controller.caching_db_storage import CachingDBStorage
+from plz.controller.execution_composition import AtomicComposition, \
+    IndicesComposition
+from plz.controller.immutable_records_cache import ImmutableRecordsCache
+from plz.controller.sqlite_db_storage import SQLiteDBStorage
+
+
+def _start_metadata(execution_id: str) -> dict:
+    return {
+        'execution_id': execution_id,
+        'user': 'user',
+        'project': 'project',
+        'parent_execution_id': None,
+        'execution_spec': {},
+    }
+
+
+class TestImmutableRecordsCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.delegate = SQLiteDBStorage(
+            os.path.join(self.directory.name, 'plz.sqlite3'))
+        self.cache = ImmutableRecordsCache(max_entries=10)
+        self.db_storage = CachingDBStorage(self.delegate, self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_mutable_records_are_never_stale(self):
+        self.db_storage.store_start_metadata('id', _start_metadata('id'))
+        self.assertEqual(
+            self.db_storage.retrieve_finished_execution_ids('user', 'project'),
+            set())
+
+        self.db_storage.add_finished_execution_id('user', 'project', 'id')
+
+        self.assertEqual(
+            self.db_storage.retrieve_finished_execution_ids('user', 'project'),
+            {'id'})
+
+    def test_tombstones_of_cached_compositions_are_never_stale(self):
+        composition = IndicesComposition('parent',
+                                         indices_to_compositions=None,
+                                         tombstone_execution_ids=None)
+        composition.assign_index_range(0, 2, AtomicComposition('child'))
+        self.db_storage.store_execution_composition(composition)
+        self.assertEqual(
+            self.db_storage.retrieve_execution_composition(
+                'parent').tombstone_execution_ids, set())
+
+        self.delegate.add_tombstone_sub_execution_id('parent', 'child')
+
+        retrieved = self.db_storage.retrieve_execution_composition('parent')
+        self.assertEqual(retrieved.tombstone_execution_ids, {'child'})
+        self.assertEqual(
+            retrieved.to_jsonable_dict()['index_ranges_to_compositions'],
+            [[0, 2, {
+                'execution_id': 'child'
+            }]])
+
+    def test_records_not_written_yet_are_not_cached(self):
+        with self.assertRaises(ValueError):
+            self.db_storage.retrieve_start_metadata('id')
+        self.assertEqual(self.db_storage.get_users_of_executions(['id']),
+                         {'id': None})
+
+        self.db_storage.store_start_metadata('id', _start_metadata('id'))
+
+        self.assertEqual(
+            self.db_storage.retrieve_start_metadata('id')['execution_id'],
+            'id')
+        self.assertEqual(self.db_storage.get_users_of_executions(['id']),
+                         {'id': 'user'})
+
+    def test_modifying_retrieved_records_does_not_modify_the_cache(self):
+        self.db_storage.store_start_metadata('id', _start_metadata('id'))
+        self.db_storage.retrieve_start_metadata('id')['user'] = 'someone else'
+        self.assertEqual(self.db_storage.retrieve_start_metadata('id'),
+                         _start_metadata('id'))
+
+    def test_refuses_to_cache_mutable_records(self):
+        with self.assertRaises(ValueError):
+            self.cache.get('running_status', 'id', lambda: 'running')
+
+    def test_keeps_stats(self):
+        self.db_storage.store_start_metadata('id', _start_metadata('id'))
+        for _ in range(4):
+            self.db_storage.retrieve_start_metadata('id')
+        stats = self.cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.75)
+
+    def test_evicts_least_recently_used_records(self):
+        for i in range(20):
+            execution_id = str(i)
+            self.db_storage.store_start_metadata(execution_id,
+                                                 _start_metadata(execution_id))
+            self.db_storage.retrieve_start_metadata(execution_id)
+        self.assertEqual(self.cache.stats()['size'], 10)
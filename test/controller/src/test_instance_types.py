@@ -0,0 +1,87 @@
+import time
+import unittest
+
+from plz.controller.instances.aws.ec2_instance import EC2Instance
+from plz.controller.instances.aws.instance_types import \
+    acceptable_instance_types, instance_types_to_start, preference_of
+from plz.controller.instances.aws.placement import WorkerRecords, \
+    rank_instances
+
+from .fake_redis import FakeRedis
+
+_FAMILIES = {'p3': ['p3.2xlarge', 'p3.8xlarge'], 'g4dn': ['g4dn.xlarge']}
+
+
+def _instance_data(instance_id: str, instance_type: str,
+                   idle_minutes: int) -> dict:
+    idle_since_timestamp = int(time.time()) - idle_minutes * 60
+    return {
+        'InstanceId':
+            instance_id,
+        'InstanceType':
+            instance_type,
+        'Tags': [{
+            'Key': EC2Instance.IDLE_SINCE_TIMESTAMP_TAG,
+            'Value': str(idle_since_timestamp)
+        }]
+    }
+
+
+class TestInstanceTypes(unittest.TestCase):
+    def test_a_single_type_is_acceptable_by_default(self):
+        self.assertEqual(
+            acceptable_instance_types({'instance_type': 't2.micro'}),
+            ['t2.micro'])
+
+    def test_the_list_of_types_takes_precedence(self):
+        self.assertEqual(
+            acceptable_instance_types({
+                'instance_type': 't2.micro',
+                'instance_types': ['p3.*', 'p2.xlarge']
+            }), ['p3.*', 'p2.xlarge'])
+
+    def test_families_are_started_as_their_types(self):
+        self.assertEqual(
+            instance_types_to_start(['p2.xlarge', 'p3.*'], _FAMILIES),
+            ['p2.xlarge', 'p3.2xlarge', 'p3.8xlarge'])
+
+    def test_unknown_families_are_not_started(self):
+        self.assertEqual(
+            instance_types_to_start(['p4.*', 'p2.xlarge'], _FAMILIES),
+            ['p2.xlarge'])
+
+    def test_types_are_started_once(self):
+        self.assertEqual(
+            instance_types_to_start(['p3.8xlarge', 'p3.*'], _FAMILIES),
+            ['p3.8xlarge', 'p3.2xlarge'])
+
+    def test_preference_is_the_first_match(self):
+        acceptable = ['p3.8xlarge', 'p3.*', 'g4dn.xlarge']
+        self.assertEqual(preference_of('p3.8xlarge', acceptable), 0)
+        self.assertEqual(preference_of('p3.2xlarge', acceptable), 1)
+        self.assertEqual(preference_of('g4dn.xlarge', acceptable), 2)
+        self.assertIsNone(preference_of('p2.xlarge', acceptable))
+
+    def test_instances_are_ranked_by_preference_first(self):
+        instances = [
+            _instance_data('i-p2', 'p2.xlarge', idle_minutes=1),
+            _instance_data('i-p3', 'p3.2xlarge', idle_minutes=2)
+        ]
+        ranked = rank_instances(instances, WorkerRecords(FakeRedis()),
+                                'user-project-digest', {
+                                    'user': 'user',
+                                    'project': 'project'
+                                }, ['p3.*', 'p2.xlarge'])
+        self.assertEqual([i['InstanceId'] for i in ranked], ['i-p3', 'i-p2'])
+
+    def test_instances_of_the_same_preference_are_ranked_by_score(self):
+        instances = [
+            _instance_data('i-old', 'p3.2xlarge', idle_minutes=30),
+            _instance_data('i-new', 'p3.8xlarge', idle_minutes=1)
+        ]
+        ranked = rank_instances(instances, WorkerRecords(FakeRedis()),
+                                'user-project-digest', {
+                                    'user': 'user',
+                                    'project': 'project'
+                                }, ['p3.*'])
+        self.assertEqual([i['InstanceId'] for i in ranked], ['i-new', 'i-old'])
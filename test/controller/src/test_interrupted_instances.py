@@ -0,0 +1,79 @@
+import unittest
+from typing import Optional
+from unittest import mock
+
+from plz.controller.instances.aws.ec2_instance import EC2Instance
+
+
+def _instance_data(state_reason: Optional[str]) -> dict:
+    data = {
+        'InstanceId': 'i-1',
+        'InstanceType': 't2.micro',
+        'State': {
+            'Name': 'terminated'
+        },
+        'Tags': [{
+            'Key': EC2Instance.EXECUTION_ID_TAG,
+            'Value': 'execution'
+        }]
+    }
+    if state_reason is not None:
+        data['StateReason'] = {'Code': state_reason}
+    return data
+
+
+class TestInterruptedInstances(unittest.TestCase):
+    def setUp(self):
+        self.results_storage = mock.MagicMock()
+        # No results for the execution
+        self.results_storage.get.return_value.__enter__.return_value = None
+        lock = mock.patch.object(EC2Instance,
+                                 '_lock',
+                                 new_callable=mock.PropertyMock)
+        lock.start().return_value.acquire.return_value = True
+        self.addCleanup(lock.stop)
+
+    def _harvest(self, spot_request_status: Optional[str],
+                 state_reason: Optional[str]) -> bool:
+        data = _instance_data(state_reason)
+        client = mock.Mock()
+        client.describe_instances.return_value = {
+            'Reservations': [{
+                'Instances': [data]
+            }]
+        }
+        spot_requests = [] if spot_request_status is None else [{
+            'Status': {
+                'Code': spot_request_status
+            }
+        }]
+        client.describe_spot_instance_requests.return_value = {
+            'SpotInstanceRequests': spot_requests
+        }
+        instance = EC2Instance(client, mock.Mock(), mock.Mock(), mock.Mock(),
+                               'execution', data, mock.Mock(), 60, 60,
+                               mock.Mock())
+        return instance.harvest(self.results_storage)
+
+    def test_spot_instances_reclaimed_by_price_are_interrupted(self):
+        self.assertTrue(self._harvest('instance-terminated-by-price', None))
+        self.results_storage.write_tombstone.assert_called_once()
+
+    def test_spot_instances_reclaimed_for_capacity_are_interrupted(self):
+        self.assertTrue(
+            self._harvest('instance-terminated-no-capacity',
+                          'Server.SpotInstanceTermination'))
+
+    def test_spot_terminations_in_the_state_reason_are_interrupted(self):
+        self.assertTrue(self._harvest(None, 'Server.SpotInstanceTermination'))
+
+    def test_killed_instances_are_not_interrupted(self):
+        self.assertFalse(
+            self._harvest('instance-terminated-by-user',
+                          'Client.UserInitiatedShutdown'))
+        # They still get a tombstone
+        self.results_storage.write_tombstone.assert_called_once()
+
+    def test_instances_out_of_uptime_are_not_interrupted(self):
+        self.assertFalse(
+            self._harvest(None, 'Client.InstanceInitiatedShutdown'))
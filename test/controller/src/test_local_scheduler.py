@@ -0,0 +1,152 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from plz.controller.containers import ContainerMissingException
+from plz.controller.instances import local_scheduler
+from plz.controller.instances.local_scheduler import LocalScheduler
+from plz.controller.instances.resources import Resources
+
+from .fake_redis import FakeRedis
+
+_GB = 2**30
+
+
+class TestLocalScheduler(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.containers = mock.Mock()
+        self.running = {}
+        self.containers.get_state.side_effect = self._get_state
+        # Exits are reported by calling vacate, as the listener would
+        listener = mock.patch.object(LocalScheduler, '_start_listener')
+        listener.start()
+        self.addCleanup(listener.stop)
+        self.scheduler = self._scheduler(poll_interval_in_seconds=0.01)
+
+    def _scheduler(self, **kwargs) -> LocalScheduler:
+        return LocalScheduler(self.redis,
+                              self.containers,
+                              max_cpus=2,
+                              max_memory_in_bytes=4 * _GB,
+                              max_containers=2,
+                              **kwargs)
+
+    def _get_state(self, execution_id: str):
+        if execution_id not in self.running:
+            raise ContainerMissingException(execution_id)
+        return mock.Mock(running=self.running[execution_id])
+
+    def _take(self, execution_id: str, docker_run_args: dict = None) -> None:
+        """Takes a slot, failing if it has to wait"""
+        statuses = list(
+            self.scheduler.wait_for_slot(execution_id, docker_run_args or {}))
+        self.assertEqual(statuses, [])
+        self.scheduler.started(execution_id)
+        self.running[execution_id] = True
+
+    def _wait(self, execution_id: str, docker_run_args: dict = None):
+        """:return: the waiting execution, and its first status"""
+        waiting = self.scheduler.wait_for_slot(execution_id, docker_run_args
+                                               or {})
+        return waiting, next(waiting)['message']
+
+    def test_executions_take_slots_in_order_of_arrival(self):
+        self._take('a1')
+        self._take('a2')
+        b, status = self._wait('b')
+        self.assertEqual(status, 'waiting for local resources '
+                         '(0 executions ahead)')
+        c, status = self._wait('c')
+        self.assertEqual(status, 'waiting for local resources '
+                         '(1 executions ahead)')
+        self.scheduler.vacate('a1')
+        # C cannot jump ahead of B
+        self.assertEqual(self.scheduler._try_to_occupy('c', Resources(0, 0)),
+                         1)
+        with self.assertRaises(StopIteration):
+            next(b)
+        c.close()
+
+    def test_executions_wait_for_cpus(self):
+        self._take('a', {'nano_cpus': 2 * 10**9, 'mem_limit': '1g'})
+        b, _ = self._wait('b', {'nano_cpus': 10**9, 'mem_limit': '1g'})
+        b.close()
+        self._take('c', {'nano_cpus': 0, 'mem_limit': '1g'})
+
+    def test_executions_wait_for_memory(self):
+        self._take('a', {'nano_cpus': 10**9, 'mem_limit': '3g'})
+        b, _ = self._wait('b', {'nano_cpus': 10**9, 'mem_limit': '2g'})
+        b.close()
+        self._take('c', {'nano_cpus': 10**9, 'mem_limit': '1g'})
+
+    def test_executions_larger_than_the_host_run_on_their_own(self):
+        self._take('a', {'nano_cpus': 4 * 10**9})
+
+    def test_exits_wake_up_waiters(self):
+        self.scheduler = self._scheduler(poll_interval_in_seconds=60)
+        self._take('a1')
+        self._take('a2')
+        b, _ = self._wait('b')
+        thread = threading.Thread(target=lambda: list(b))
+        thread.start()
+        time.sleep(0.1)
+        self.scheduler.vacate('a1')
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertIn(b'b', self.redis.hkeys(local_scheduler._slots_key()))
+
+    def test_missed_exits_are_noticed_when_polling(self):
+        self._take('a1')
+        self._take('a2')
+        b, _ = self._wait('b')
+        # The container exits but the event never arrives
+        self.running['a1'] = False
+        with self.assertRaises(StopIteration):
+            next(b)
+        self.assertEqual(set(self.redis.hkeys(local_scheduler._slots_key())),
+                         {b'a2', b'b'})
+
+    def test_slots_of_missing_containers_are_dropped(self):
+        self._take('a1')
+        self._take('a2')
+        del self.running['a1']
+        self._take('b')
+
+    def test_slots_never_started_are_dropped_after_a_while(self):
+        self._take('a1')
+        list(self.scheduler.wait_for_slot('a2', {}))
+        b, _ = self._wait('b')
+        self.assertEqual(len(self.redis.hkeys(local_scheduler._slots_key())),
+                         2)
+        later = time.time() + \
+            local_scheduler._UNSTARTED_SLOT_STALE_AFTER_SECONDS + 1
+        with mock.patch.object(local_scheduler.time, 'time', lambda: later):
+            with self.assertRaises(StopIteration):
+                next(b)
+        self.assertEqual(set(self.redis.hkeys(local_scheduler._slots_key())),
+                         {b'a1', b'b'})
+
+    def test_stale_waiters_are_dropped(self):
+        self._take('a1')
+        self._take('a2')
+        # A waiter whose controller process went away
+        self.redis.zadd(local_scheduler._queue_key(), {'gone': 0})
+        self.redis.hset(
+            local_scheduler._waiters_key(), 'gone',
+            time.time() - local_scheduler._WAITER_STALE_AFTER_SECONDS - 1)
+        b, status = self._wait('b')
+        self.assertEqual(status, 'waiting for local resources '
+                         '(0 executions ahead)')
+        self.assertIsNone(
+            self.redis.zrank(local_scheduler._queue_key(), 'gone'))
+        b.close()
+
+    def test_waiters_that_give_up_leave_the_queue(self):
+        self._take('a1')
+        self._take('a2')
+        b, _ = self._wait('b')
+        b.close()
+        self.assertEqual(self.redis.zcard(local_scheduler._queue_key()), 0)
+        self.assertEqual(self.redis.hlen(local_scheduler._waiters_key()), 0)
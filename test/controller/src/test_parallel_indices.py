@@ -6,6 +6,7 @@ from typing import Dict, Optional, Tuple
 
 import time
 
+from plz.cli.composition_operation import indices_to_compositions
 from plz.cli.run_execution_operation import create_instance_market_spec
 from .utils import TestingContext, create_file_map_from_tarball, \
     get_execution_listing_status, harvest, rerun_execution, run_example
@@ -71,8 +72,9 @@ class TestParallelIndices(unittest.TestCase):
             override_parameters=None,
             instance_market_spec=create_instance_market_spec(
                 context.configuration))
-        execution_composition = context.controller.get_execution_composition(
-            execution_id)['indices_to_compositions']
+        execution_composition = dict(
+            indices_to_compositions(
+                context.controller.get_execution_composition(execution_id)))
         self._check_execution_assignment(rainch, indices_per_execution,
                                          execution_composition)
 
@@ -90,18 +92,18 @@ class TestParallelIndices(unittest.TestCase):
             indices_per_execution=indices_per_execution)
         composition = context.controller.get_execution_composition(
             execution_id)
-        indices_to_compositions = composition['indices_to_compositions']
+        composition_indices = dict(indices_to_compositions(composition))
         self._check_execution_assignment(rainch, indices_per_execution,
-                                         indices_to_compositions)
+                                         composition_indices)
 
         if check_only_assignment:
             return context, execution_id
 
         execution_ids_to_indices = defaultdict(lambda: set())
-        for i, sc in indices_to_compositions.items():
+        for i, sc in composition_indices.items():
             execution_ids_to_indices[sc['execution_id']].add(i)
 
-        for index, subcomp in indices_to_compositions.items():
+        for index, subcomp in composition_indices.items():
             # Json indices are always strings...
             index = int(index)
             index_execution_id = subcomp['execution_id']
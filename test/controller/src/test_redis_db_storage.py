@@ -0,0 +1,57 @@
+import unittest
+
+from plz.controller.execution_composition import AtomicComposition, \
+    IndicesComposition
+from plz.controller.redis_db_storage import RedisDBStorage
+
+from .fake_redis import FakeRedis
+
+
+class TestRedisDBStorage(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.db_storage = RedisDBStorage(self.redis)
+        composition = IndicesComposition('parent',
+                                         indices_to_compositions=None,
+                                         tombstone_execution_ids=None)
+        composition.assign_index_range(0, 3, AtomicComposition('first'))
+        composition.assign_index_range(3, 4, AtomicComposition('second'))
+        composition.assign_index_range(6, 10, AtomicComposition('third'))
+        self.db_storage.store_execution_composition(composition)
+
+    def test_sub_executions_are_found_by_index(self):
+        self.assertEqual([
+            self.db_storage.retrieve_execution_id_from_parent_and_index(
+                'parent', index) for index in (0, 2, 3, 6, 9)
+        ], ['first', 'first', 'second', 'third', 'third'])
+
+    def test_indices_out_of_the_ranges_have_no_sub_execution(self):
+        for index in (-1, 4, 5, 10):
+            self.assertIsNone(
+                self.db_storage.retrieve_execution_id_from_parent_and_index(
+                    'parent', index))
+
+    def test_atomic_executions_have_no_sub_executions(self):
+        self.assertIsNone(
+            self.db_storage.retrieve_execution_id_from_parent_and_index(
+                'first', 0))
+
+    def test_sub_executions_stored_by_index_are_found(self):
+        # As stored before index ranges were introduced
+        self.redis.hset('execution_composition_type', 'old', 'indices#0#2')
+        self.redis.hset('composition_index_to_execution#old', 1, 'old-1')
+        self.assertEqual(
+            self.db_storage.retrieve_execution_id_from_parent_and_index(
+                'old', 1), 'old-1')
+
+    def test_compositions_are_retrieved_with_their_ranges(self):
+        self.assertEqual(
+            self.db_storage.retrieve_execution_composition(
+                'parent').to_jsonable_dict()['index_ranges_to_compositions'],
+            [[0, 3, {
+                'execution_id': 'first'
+            }], [3, 4, {
+                'execution_id': 'second'
+            }], [6, 10, {
+                'execution_id': 'third'
+            }]])
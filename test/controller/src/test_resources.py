@@ -0,0 +1,44 @@
+import unittest
+
+from plz.controller.instances.resources import Resources, cpus_of, \
+    memory_of, requirements_of
+
+
+class TestResources(unittest.TestCase):
+    def test_nano_cpus(self):
+        self.assertEqual(cpus_of({'nano_cpus': 1500000000}), 1.5)
+
+    def test_cpu_quota_over_the_default_period(self):
+        self.assertEqual(cpus_of({'cpu_quota': 200000}), 2)
+
+    def test_cpu_quota_over_a_period(self):
+        self.assertEqual(cpus_of({
+            'cpu_quota': 50000,
+            'cpu_period': 200000
+        }), 0.25)
+
+    def test_cpuset_of_single_cpus(self):
+        self.assertEqual(cpus_of({'cpuset_cpus': '0,2,5'}), 3)
+
+    def test_cpuset_of_ranges(self):
+        self.assertEqual(cpus_of({'cpuset_cpus': '0-3,6,8-9'}), 7)
+
+    def test_cpuset_of_a_single_cpu_as_a_number(self):
+        self.assertEqual(cpus_of({'cpuset_cpus': 3}), 1)
+
+    def test_cpus_are_not_limited_by_default(self):
+        self.assertIsNone(cpus_of({'mem_limit': '1g'}))
+
+    def test_memory_limit(self):
+        self.assertEqual(memory_of({'mem_limit': '2g'}), 2 * 2**30)
+        self.assertEqual(memory_of({'mem_limit': 1024}), 1024)
+
+    def test_requirements_need_cpus_and_memory(self):
+        self.assertEqual(
+            requirements_of({
+                'cpuset_cpus': '0-1',
+                'mem_limit': '1g'
+            }), Resources(cpus=2, memory_in_bytes=2**30))
+        self.assertIsNone(requirements_of({'cpuset_cpus': '0-1'}))
+        self.assertIsNone(requirements_of({'mem_limit': '1g'}))
+        self.assertIsNone(requirements_of({}))
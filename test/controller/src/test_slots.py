@@ -0,0 +1,111 @@
+import unittest
+
+from plz.controller.instances.aws.slots import InstanceSlots, Slot, \
+    SlotTable, has_room
+from plz.controller.instances.resources import Resources
+
+from .fake_redis import FakeRedis
+
+_GB = 2**30
+
+_CAPACITY = Resources(cpus=8, memory_in_bytes=32 * _GB)
+
+
+def _slots(*occupants: Slot) -> InstanceSlots:
+    return InstanceSlots(
+        capacity=_CAPACITY,
+        occupants={f'e{i}': slot
+                   for i, slot in enumerate(occupants)})
+
+
+class TestHasRoom(unittest.TestCase):
+    def test_fits_alongside_executions_of_the_same_user(self):
+        self.assertTrue(
+            has_room(_slots(Slot('alice', Resources(4, 16 * _GB))),
+                     'alice',
+                     Resources(4, 16 * _GB),
+                     max_occupants=4))
+
+    def test_does_not_overflow_the_cpus(self):
+        self.assertFalse(
+            has_room(_slots(Slot('alice', Resources(6, 4 * _GB))),
+                     'alice',
+                     Resources(3, 4 * _GB),
+                     max_occupants=4))
+
+    def test_does_not_overflow_the_memory(self):
+        self.assertFalse(
+            has_room(_slots(Slot('alice', Resources(2, 24 * _GB))),
+                     'alice',
+                     Resources(2, 9 * _GB),
+                     max_occupants=4))
+
+    def test_users_do_not_share_instances(self):
+        self.assertFalse(
+            has_room(_slots(Slot('alice', Resources(1, _GB)),
+                            Slot('bob', Resources(1, _GB))),
+                     'alice',
+                     Resources(1, _GB),
+                     max_occupants=4))
+
+    def test_executions_without_requirements_take_the_whole_instance(self):
+        self.assertFalse(
+            has_room(_slots(Slot('alice', None)),
+                     'alice',
+                     Resources(1, _GB),
+                     max_occupants=4))
+
+    def test_does_not_exceed_the_occupants(self):
+        self.assertFalse(
+            has_room(_slots(Slot('alice', Resources(1, _GB)),
+                            Slot('alice', Resources(1, _GB))),
+                     'alice',
+                     Resources(1, _GB),
+                     max_occupants=2))
+
+    def test_empty_instances_are_not_shared(self):
+        self.assertFalse(
+            has_room(_slots(), 'alice', Resources(1, _GB), max_occupants=4))
+
+    def test_instances_without_capacity_are_not_shared(self):
+        self.assertFalse(
+            has_room(InstanceSlots(
+                capacity=None,
+                occupants={'e0': Slot('alice', Resources(1, _GB))}),
+                     'alice',
+                     Resources(1, _GB),
+                     max_occupants=4))
+
+
+class TestSlotTable(unittest.TestCase):
+    def setUp(self):
+        self.slots = SlotTable(FakeRedis())
+
+    def test_occupants_are_kept_with_their_requirements(self):
+        self.slots.advertise_capacity('i-1', _CAPACITY)
+        self.slots.occupy('i-1', 'e1', 'alice', Resources(2, _GB))
+        self.slots.occupy('i-1', 'e2', 'alice', None)
+        self.assertEqual(
+            self.slots.get(['i-1']), {
+                'i-1':
+                    InstanceSlots(capacity=_CAPACITY,
+                                  occupants={
+                                      'e1': Slot('alice', Resources(2, _GB)),
+                                      'e2': Slot('alice', None)
+                                  })
+            })
+        self.assertEqual(self.slots.instance_of('e1'), 'i-1')
+
+    def test_vacated_executions_are_forgotten(self):
+        self.slots.occupy('i-1', 'e1', 'alice', Resources(2, _GB))
+        self.slots.vacate('i-1', 'e1')
+        self.assertEqual(self.slots.occupants('i-1'), {})
+        self.assertIsNone(self.slots.instance_of('e1'))
+
+    def test_cleared_instances_are_forgotten(self):
+        self.slots.advertise_capacity('i-1', _CAPACITY)
+        self.slots.occupy('i-1', 'e1', 'alice', Resources(2, _GB))
+        self.slots.clear('i-1')
+        self.assertEqual(self.slots.get(['i-1']),
+                         {'i-1': InstanceSlots(capacity=None, occupants={})})
+        self.assertIsNone(self.slots.instance_of('e1'))
@@ -0,0 +1,82 @@
+import threading
+import unittest
+from typing import Dict, Optional
+from unittest import mock
+
+from plz.controller.instances.aws.snapshot_pushes import \
+    SnapshotPushException, SnapshotPushes
+
+
+class _Redis:
+    """The few commands of Redis that snapshot pushes use"""
+
+    def __init__(self):
+        self.values: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+
+    def set(self,
+            key: str,
+            value: str,
+            ex: Optional[int] = None,
+            nx: bool = False,
+            xx: bool = False) -> bool:
+        with self.lock:
+            if (nx and key in self.values) or (xx and key not in self.values):
+                return False
+            self.values[key] = value.encode('utf-8')
+            return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            return self.values.get(key)
+
+    def expire(self, key: str, seconds: int) -> bool:
+        with self.lock:
+            return key in self.values
+
+
+class TestSnapshotPushes(unittest.TestCase):
+    def setUp(self):
+        self.images = mock.Mock()
+        self.pushes = SnapshotPushes(_Redis(),
+                                     self.images,
+                                     poll_interval_in_seconds=0.01)
+
+    def test_pushes_in_the_background(self):
+        self.pushes.push('tag')
+        self.pushes.wait_for('tag')
+        self.images.push.assert_called_once_with('tag')
+
+    def test_pushes_from_the_host_with_the_snapshot(self):
+        host_images = mock.Mock()
+        self.pushes.push('tag', host_images)
+        self.pushes.wait_for('tag')
+        host_images.push.assert_called_once_with('tag')
+        self.images.push.assert_not_called()
+
+    def test_pushes_each_snapshot_once(self):
+        self.pushes.push('tag')
+        self.pushes.wait_for('tag')
+        on_done = mock.Mock()
+        self.pushes.push('tag', on_done=on_done)
+        self.images.push.assert_called_once_with('tag')
+        on_done.assert_called_once_with()
+
+    def test_calls_back_once_pushed(self):
+        done = threading.Event()
+        self.pushes.push('tag', on_done=done.set)
+        self.assertTrue(done.wait(timeout=5))
+        self.images.push.assert_called_once_with('tag')
+
+    def test_failed_pushes_are_reported_and_retried(self):
+        self.images.push.side_effect = Exception('Registry unavailable')
+        done = threading.Event()
+        self.pushes.push('tag', on_done=done.set)
+        with self.assertRaises(SnapshotPushException):
+            self.pushes.wait_for('tag')
+        self.assertTrue(done.wait(timeout=5))
+
+        self.images.push.side_effect = None
+        self.pushes.push('tag')
+        self.pushes.wait_for('tag')
+        self.assertEqual(self.images.push.call_count, 2)
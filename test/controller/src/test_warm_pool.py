@@ -0,0 +1,109 @@
+import time
+import unittest
+from typing import Callable, Optional
+from unittest import mock
+
+from plz.controller.instances.aws.ec2_instance import EC2Instance
+from plz.controller.instances.aws.ec2_instance_group import EC2InstanceGroup
+from plz.controller.instances.instance_base import ExecutionInfo
+
+from .fake_redis import FakeRedis
+
+_MAX_IDLE_SECONDS = 60
+_GRACE_SECONDS = 60
+
+
+def _instance_data(instance_id: str,
+                   instance_type: str = 't2.micro',
+                   execution_id: str = '',
+                   state: str = 'running') -> dict:
+    return {
+        'InstanceId':
+            instance_id,
+        'InstanceType':
+            instance_type,
+        'State': {
+            'Name': state
+        },
+        'Tags': [{
+            'Key': EC2Instance.EXECUTION_ID_TAG,
+            'Value': execution_id
+        }, {
+            'Key': EC2Instance.EARMARK_EXECUTION_ID_TAG,
+            'Value': ''
+        }]
+    }
+
+
+def _keeper(warm_pool_sizes: dict, instances_data: [dict]) \
+        -> Optional[Callable[[str], bool]]:
+    group = mock.Mock(warm_pool_sizes=warm_pool_sizes)
+    return EC2InstanceGroup._warm_pool_keeper(group, instances_data)
+
+
+class TestWarmPoolKeeper(unittest.TestCase):
+    def test_nothing_is_kept_without_a_warm_pool(self):
+        self.assertIsNone(_keeper({}, [_instance_data('i-1')]))
+
+    def test_idle_instances_beyond_the_pool_are_not_kept(self):
+        is_kept = _keeper({'t2.micro': 2},
+                          [_instance_data(f'i-{i}') for i in range(4)])
+        self.assertEqual([is_kept('t2.micro') for _ in range(4)],
+                         [False, False, True, True])
+
+    def test_only_idle_instances_count(self):
+        is_kept = _keeper({'t2.micro': 2}, [
+            _instance_data('i-1'),
+            _instance_data('i-2', execution_id='execution'),
+            _instance_data('i-3', state='shutting-down'),
+            _instance_data('i-4', state='pending')
+        ])
+        self.assertTrue(is_kept('t2.micro'))
+
+    def test_types_out_of_the_pool_are_not_kept(self):
+        is_kept = _keeper({'t2.micro': 2},
+                          [_instance_data('i-1', 'p2.xlarge')])
+        self.assertFalse(is_kept('p2.xlarge'))
+
+
+class TestDisposingWithWarmPool(unittest.TestCase):
+    def setUp(self):
+        kill = mock.patch.object(EC2Instance, 'kill')
+        self.kill = kill.start()
+        self.addCleanup(kill.stop)
+
+    def _dispose(self,
+                 idle_since_timestamp: int,
+                 max_idle_seconds: int = _MAX_IDLE_SECONDS) -> bool:
+        slots = mock.Mock()
+        slots.occupants.return_value = set()
+        instance = EC2Instance(mock.Mock(),
+                               mock.Mock(),
+                               mock.Mock(),
+                               mock.Mock(),
+                               '',
+                               _instance_data('i-1'),
+                               FakeRedis(),
+                               60,
+                               _GRACE_SECONDS,
+                               slots,
+                               is_kept_in_warm_pool=lambda _: True)
+        instance.dispose_if_its_time(
+            ExecutionInfo(execution_id='',
+                          running=False,
+                          status='idle',
+                          instance_type='t2.micro',
+                          max_idle_seconds=max_idle_seconds,
+                          idle_since_timestamp=idle_since_timestamp,
+                          instance_id='i-1'))
+        return self.kill.called
+
+    def test_instances_idle_for_too_long_are_kept(self):
+        self.assertFalse(
+            self._dispose(int(time.time()) - 2 * _MAX_IDLE_SECONDS))
+
+    def test_instances_idle_since_the_future_are_disposed_of(self):
+        self.assertTrue(self._dispose(int(time.time()) + 2 * _GRACE_SECONDS))
+
+    def test_instances_without_idle_time_are_disposed_of(self):
+        self.assertTrue(self._dispose(int(time.time()), max_idle_seconds=0))
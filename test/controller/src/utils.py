@@ -92,7 +92,7 @@ def run_example(
 
     execution_id, _ = \
         RunExecutionOperation.get_execution_id_from_start_response(
-            response_dicts)
+            context.controller, response_dicts)
     return context, execution_id
 
 
@@ -115,7 +115,7 @@ def rerun_execution(
 
     execution_id, _ = \
         RunExecutionOperation.get_execution_id_from_start_response(
-            response_dicts)
+            controller, response_dicts)
     return controller, execution_id
 
 